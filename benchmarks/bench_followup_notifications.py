@@ -0,0 +1,97 @@
+"""
+Compare rendering the followup notification emails of a comment once per
+follower, as notify_comment_followers used to do, with rendering them once
+and replacing the user_name and mute URLs of each follower.
+
+Run it from the root of the repository::
+
+    python benchmarks/bench_followup_notifications.py [num_followers]
+"""
+
+import os
+import sys
+import timeit
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, f"{Path(__file__).resolve().parents[1]}")
+os.environ.setdefault(
+    "DJANGO_SETTINGS_MODULE", "django_comments_xtd.tests.settings"
+)
+
+import django
+
+django.setup()
+
+from django.contrib.sites.models import Site
+from django.core import signing
+from django.template import loader
+from django.urls import reverse
+
+from django_comments_xtd.utils import RecipientMessageRenderer
+
+
+def make_context():
+    content_object = SimpleNamespace(
+        title="An article", get_absolute_url=lambda: "/articles/an-article/"
+    )
+    comment = SimpleNamespace(
+        name="Joe Bloggs",
+        submit_date=datetime(2025, 4, 7, 10, 30),
+        comment="A comment <with> some 'characters' to escape & more.\n" * 5,
+        content_object=content_object,
+    )
+    site = Site(domain="example.com", name="Example")
+    return {"comment": comment, "content_object": content_object, "site": site}
+
+
+def make_recipients(num_followers):
+    recipients = []
+    for i in range(num_followers):
+        key = signing.dumps(f"follower{i}@example.com", compress=True)
+        mute_url = reverse("comments-xtd-mute", args=[key])
+        recipients.append(
+            {
+                "user_name": f"Follower <{i}>",
+                "mute_url": mute_url,
+                "mute_url_short": mute_url[:40],
+            }
+        )
+    return recipients
+
+
+def main():
+    num_followers = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    templates = [
+        loader.get_template("django_comments_xtd/email_followup_comment.txt"),
+        loader.get_template("django_comments_xtd/email_followup_comment.html"),
+    ]
+    context = make_context()
+    recipients = make_recipients(num_followers)
+
+    def current():
+        renderer = RecipientMessageRenderer(
+            templates, context, ["user_name", "mute_url", "mute_url_short"]
+        )
+        messages = [renderer.render(recipient) for recipient in recipients]
+        assert renderer.partials, "The templates must not be fully rendered"
+        return messages
+
+    def former():
+        return [
+            [t.render({**context, **recipient}) for t in templates]
+            for recipient in recipients
+        ]
+
+    assert current() == former(), "Both implementations must give the same"
+
+    for name, func in [("former", former), ("current", current)]:
+        timing = min(timeit.repeat(func, number=1, repeat=5))
+        print(  # noqa: T201
+            f"{name:>8}: {timing * 1000:9.2f} ms for {num_followers} followers"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Compare the size, and the time to encode and decode, of the confirmation
+keys in the pickle format of signed.dumps and in the version 2 format of
+signed.dumps_comment.
+
+Run it from the root of the repository::
+
+    python benchmarks/bench_signed.py
+"""
+
+import os
+import sys
+import timeit
+from datetime import datetime
+from functools import partial
+from pathlib import Path
+
+sys.path.insert(0, f"{Path(__file__).resolve().parents[1]}")
+os.environ.setdefault(
+    "DJANGO_SETTINGS_MODULE", "django_comments_xtd.tests.settings"
+)
+
+import django
+
+django.setup()
+
+from django.contrib.contenttypes.models import ContentType
+
+from django_comments_xtd import signed
+from django_comments_xtd.models import TmpXtdComment
+
+
+def make_comment():
+    content_type = ContentType(id=1, app_label="tests", model="article")
+    # Avoid hitting the database when loading the keys.
+    ContentType.objects._add_to_cache("default", content_type)
+    return TmpXtdComment(
+        content_type=content_type,
+        object_pk="1",
+        site_id=1,
+        user_name="Joe Bloggs",
+        user_email="joe.bloggs@example.com",
+        user_url="https://example.com/~joe/",
+        comment="What a nice September you had. " * 10,
+        submit_date=datetime(2025, 4, 7, 10, 30, 15, 123456),
+        ip_address="192.168.1.10",
+        is_public=True,
+        is_removed=False,
+        thread_id=0,
+        parent_id=0,
+        level=0,
+        order=1,
+        followup=True,
+    )
+
+
+def main():
+    comment = make_comment()
+    formats = [
+        ("pickle", lambda: signed.dumps(comment, compress=True)),
+        ("v2", lambda: signed.dumps_comment(comment)),
+    ]
+    number = 2000
+    for name, encode in formats:
+        key = encode()
+        assert dict(signed.loads(key)) == dict(comment)
+        dumps_time = min(timeit.repeat(encode, number=number, repeat=5))
+        loads = partial(signed.loads, key)
+        loads_time = min(timeit.repeat(loads, number=number, repeat=5))
+        print(  # noqa: T201
+            f"{name:>8}: {len(key):4d} bytes, "
+            f"dumps {dumps_time / number * 1e6:6.1f} us, "
+            f"loads {loads_time / number * 1e6:6.1f} us"
+        )
+
+
+if __name__ == "__main__":
+    main()
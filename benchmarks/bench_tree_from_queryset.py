@@ -0,0 +1,105 @@
+"""
+Compare XtdComment.tree_from_queryset with the former implementation, that
+searched recursively for the parent of each comment in the current tree.
+
+Run it from the root of the repository::
+
+    python benchmarks/bench_tree_from_queryset.py [num_comments]
+"""
+
+import os
+import random
+import sys
+import timeit
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, f"{Path(__file__).resolve().parents[1]}")
+os.environ.setdefault(
+    "DJANGO_SETTINGS_MODULE", "django_comments_xtd.tests.settings"
+)
+
+import django
+
+django.setup()
+
+from django.contrib.auth.models import AnonymousUser
+
+from django_comments_xtd.models import XtdComment
+
+NO_FLAGS = SimpleNamespace(all=lambda: ())
+
+
+def make_comments(num_comments, num_threads=20, max_level=3, seed=1):
+    """Return comments in (thread_id, order) order, like the queryset."""
+    rand = random.Random(seed)
+    comments = []
+    for pk in range(1, num_comments + 1):
+        if pk <= num_threads:
+            parent = None
+        else:
+            parent = rand.choice(comments)
+            while parent.level == max_level:
+                parent = comments[parent.parent_id - 1]
+        comments.append(
+            SimpleNamespace(
+                pk=pk,
+                id=pk,
+                parent_id=parent.pk if parent else pk,
+                level=parent.level + 1 if parent else 0,
+                path=f"{parent.path}/{pk:010d}" if parent else f"{pk:010d}",
+                flags=NO_FLAGS,
+            )
+        )
+    return sorted(comments, key=lambda cm: cm.path)
+
+
+def former_tree_from_queryset(queryset):
+    def add_children(children, obj):
+        for item in children:
+            if item["comment"].pk == obj.parent_id:
+                item["children"].append({"comment": obj, "children": []})
+                return True
+            elif item["children"]:
+                if add_children(item["children"], obj):
+                    return True
+        return False
+
+    dic_list = []
+    cur_dict = None
+    for obj in queryset:
+        if cur_dict and obj.level == cur_dict["comment"].level:
+            dic_list.append(cur_dict)
+            cur_dict = None
+        if not cur_dict:
+            cur_dict = {"comment": obj, "children": []}
+            continue
+        if obj.parent_id == cur_dict["comment"].pk:
+            cur_dict["children"].append({"comment": obj, "children": []})
+        else:
+            add_children(cur_dict["children"], obj)
+    if cur_dict:
+        dic_list.append(cur_dict)
+    return dic_list
+
+
+def main():
+    num_comments = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    comments = make_comments(num_comments)
+    user = AnonymousUser()
+
+    def current():
+        return XtdComment.tree_from_queryset(comments, user=user)
+
+    def former():
+        return former_tree_from_queryset(comments)
+
+    assert current() == former(), "Both implementations must give the same"
+
+    for name, func in [("former", former), ("current", current)]:
+        timing = min(timeit.repeat(func, number=1, repeat=5))
+        print(f"{name:>8}: {timing * 1000:9.2f} ms for {num_comments} comments")  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
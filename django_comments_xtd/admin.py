@@ -4,7 +4,12 @@ from django_comments import get_model
 from django_comments.admin import CommentsAdmin
 from django_comments.models import CommentFlag
 
-from django_comments_xtd.models import BlackListedDomain, XtdComment
+from django_comments_xtd.models import (
+    BlackListedDomain,
+    OutboxEmail,
+    XtdComment,
+    XtdCommentCounter,
+)
 
 
 class XtdCommentsAdmin(CommentsAdmin):
@@ -77,7 +82,33 @@ class BlackListedDomainAdmin(admin.ModelAdmin):
     search_fields = ["domain"]
 
 
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ("subject", "recipients", "send_after", "attempts")
+    list_filter = ("attempts",)
+    search_fields = ["subject", "recipient_list"]
+    date_hierarchy = "created"
+
+    def recipients(self, obj):
+        return ", ".join(obj.recipient_list)
+
+
+class XtdCommentCounterAdmin(admin.ModelAdmin):
+    list_display = (
+        "content_type",
+        "object_pk",
+        "site",
+        "public_count",
+        "thread_count",
+        "last_submit_date",
+    )
+    list_filter = ("content_type", "site")
+    search_fields = ["object_pk"]
+    readonly_fields = list_display
+
+
 if get_model() is XtdComment:
     admin.site.register(XtdComment, XtdCommentsAdmin)
     admin.site.register(CommentFlag)
     admin.site.register(BlackListedDomain, BlackListedDomainAdmin)
+    admin.site.register(OutboxEmail, OutboxEmailAdmin)
+    admin.site.register(XtdCommentCounter, XtdCommentCounterAdmin)
@@ -1,5 +1,7 @@
 from django.apps import AppConfig
-from django.db.models.signals import pre_save
+from django.core import checks as django_checks
+from django.core.signals import setting_changed
+from django.db.models.signals import post_delete, post_save, pre_save
 
 
 class CommentsXtdConfig(AppConfig):
@@ -8,10 +10,47 @@ class CommentsXtdConfig(AppConfig):
     verbose_name = "Comments Xtd"
 
     def ready(self):
-        from django_comments_xtd import get_model
-        from django_comments_xtd.models import publish_or_unpublish_on_pre_save
+        from django_comments.models import CommentFlag
+        from django_comments.signals import comment_was_posted
+
+        from django_comments_xtd import (
+            blacklist,
+            cache,
+            checks,
+            get_model,
+            utils,
+        )
+        from django_comments_xtd.models import (
+            BlackListedDomain,
+            publish_or_unpublish_on_pre_save,
+            recount_on_post_delete,
+        )
+        from django_comments_xtd.signals import confirmation_received
 
         model_app_label = get_model()._meta.label
         pre_save.connect(
             publish_or_unpublish_on_pre_save, sender=model_app_label
         )
+        post_delete.connect(recount_on_post_delete, sender=model_app_label)
+
+        # Invalidate the cached comment trees.
+        comment_was_posted.connect(cache.on_comment_posted)
+        confirmation_received.connect(cache.on_comment_posted)
+        post_delete.connect(cache.on_comment_deleted, sender=model_app_label)
+        # Update the cached comment counts.
+        post_save.connect(cache.on_comment_saved, sender=model_app_label)
+        post_save.connect(cache.on_comment_flag_changed, sender=CommentFlag)
+        post_delete.connect(cache.on_comment_flag_changed, sender=CommentFlag)
+
+        # Reload the blacklisted domains on the next comment.
+        post_save.connect(
+            blacklist.invalidate_blacklist_matcher, sender=BlackListedDomain
+        )
+        post_delete.connect(
+            blacklist.invalidate_blacklist_matcher, sender=BlackListedDomain
+        )
+
+        # Merge the app model options again when the setting changes.
+        setting_changed.connect(utils.reset_app_model_options)
+
+        django_checks.register(checks.check_max_thread_level)
@@ -0,0 +1,102 @@
+"""
+In-memory matcher of the domains in the BlackListedDomain model.
+
+The domains are kept as a sorted array of 64-bit hashes, 8 bytes per
+domain, so that a list of millions of domains fits in a few megabytes.
+An email domain matches if it, or any of its parent domains, is in the
+list. The matcher is loaded on first use and reloaded after a change in
+the BlackListedDomain model, or after COMMENTS_XTD_BLACKLIST_TTL seconds,
+to get the changes made by other processes.
+"""
+
+import hashlib
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from django_comments_xtd.conf import settings
+from django_comments_xtd.models import BlackListedDomain
+
+
+def normalize_domain(domain):
+    """Return the domain lowercased, without wildcards and outer dots."""
+    domain = domain.strip().lower()
+    domain = domain.removeprefix("*.")
+    return domain.strip(".")
+
+
+def get_domain_hash(domain):
+    """Return the 64-bit hash of a normalized domain."""
+    digest = hashlib.blake2b(domain.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, sys.byteorder)
+
+
+def get_domain_hashes(domains):
+    """Return an array with the hashes of the given normalized domains."""
+    hashes = array("Q")
+    # Same as get_domain_hash, without creating an int per domain.
+    hashes.frombytes(
+        b"".join(
+            hashlib.blake2b(domain.encode("utf-8"), digest_size=8).digest()
+            for domain in domains
+        )
+    )
+    return hashes
+
+
+def contains_hash(hashes, domain_hash):
+    """Whether the domain hash is in the sorted array of hashes."""
+    index = bisect_left(hashes, domain_hash)
+    return index < len(hashes) and hashes[index] == domain_hash
+
+
+class DomainMatcher:
+    def __init__(self, hashes):
+        self.hashes = hashes
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def matches(self, domain):
+        """Whether the domain or any of its parent domains is in the list."""
+        labels = normalize_domain(domain).split(".")
+        return any(
+            contains_hash(self.hashes, get_domain_hash(".".join(labels[i:])))
+            for i in range(len(labels))
+        )
+
+
+_matcher = None
+_loaded_at = 0.0
+_lock = threading.Lock()
+
+
+def load_blacklist_matcher(using=None):
+    domains = (
+        BlackListedDomain.objects.using(using)
+        .values_list("domain", flat=True)
+        .iterator(chunk_size=10000)
+    )
+    hashes = get_domain_hashes(normalize_domain(domain) for domain in domains)
+    return DomainMatcher(array("Q", sorted(hashes)))
+
+
+def get_blacklist_matcher():
+    """Return the process-wide matcher, loading it if needed."""
+    global _matcher, _loaded_at  # noqa: PLW0603
+    ttl = settings.COMMENTS_XTD_BLACKLIST_TTL
+    with _lock:
+        expired = ttl is not None and time.monotonic() - _loaded_at > ttl
+        if _matcher is None or expired:
+            _matcher = load_blacklist_matcher()
+            _loaded_at = time.monotonic()
+        return _matcher
+
+
+def invalidate_blacklist_matcher(**kwargs):
+    """Discard the matcher. It's a receiver of BlackListedDomain signals."""
+    global _matcher  # noqa: PLW0603
+    with _lock:
+        _matcher = None
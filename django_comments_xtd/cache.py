@@ -0,0 +1,186 @@
+"""
+Cache of the comment trees displayed with the `render_xtdcomment_tree`
+template tag, and of the comment counts of the `get_xtdcomment_count`
+template tag.
+
+Entries are stored under keys that contain a generation token of the
+object the comments belong to. Invalidating the cache of an object replaces
+its generation token, so that entries stored under the previous token are
+no longer read and expire after COMMENTS_XTD_CACHE_TIMEOUT seconds.
+
+Comment counts are stored per content type and site, and are incremented
+or decremented as comments are created or deleted.
+"""
+
+import hashlib
+import uuid
+from contextlib import suppress
+
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Count
+from django_comments.models import Comment
+
+from django_comments_xtd import get_model
+from django_comments_xtd.conf import settings
+
+KEY_PREFIX = "django_comments_xtd.tree"
+COUNT_KEY_PREFIX = "django_comments_xtd.count"
+
+
+def get_tree_cache():
+    return caches[settings.COMMENTS_XTD_CACHE_ALIAS]
+
+
+def _get_object_key(content_type_id, object_pk, site_id):
+    # Hash the object_pk, it may contain characters or have a length
+    # that are not valid in a cache key.
+    object_hash = hashlib.md5(
+        str(object_pk).encode(), usedforsecurity=False
+    ).hexdigest()
+    return f"{KEY_PREFIX}.{content_type_id}.{site_id}.{object_hash}"
+
+
+def get_tree_cache_key(content_type_id, object_pk, site_id, *parts):
+    """
+    Return the key of a cache entry of the comments of an object.
+
+    The `parts` distinguish the entries of the same object, like the
+    template or the features a tree is rendered with.
+    """
+    cache = get_tree_cache()
+    object_key = _get_object_key(content_type_id, object_pk, site_id)
+    generation_key = f"{object_key}.generation"
+    generation = cache.get(generation_key)
+    if generation is None:
+        cache.add(generation_key, uuid.uuid4().hex, None)
+        generation = cache.get(generation_key)
+    parts_hash = hashlib.md5(
+        repr(parts).encode(), usedforsecurity=False
+    ).hexdigest()
+    return f"{object_key}.{generation}.{parts_hash}"
+
+
+def invalidate_tree_cache(content_type_id, object_pk, site_id, using=None):
+    """
+    Invalidate the cached comment trees of an object.
+
+    The generation token is replaced once the current transaction commits,
+    so that a concurrent request can't cache the data previous to it under
+    the new token.
+    """
+    if not settings.COMMENTS_XTD_CACHE_TREES:
+        return
+    object_key = _get_object_key(content_type_id, object_pk, site_id)
+
+    def replace_generation():
+        get_tree_cache().set(f"{object_key}.generation", uuid.uuid4().hex, None)
+
+    transaction.on_commit(replace_generation, using=using)
+
+
+def invalidate_comment_tree_cache(comment, using=None):
+    """
+    Invalidate the cached comment trees of the object a comment belongs to.
+    The comment can be a XtdComment or a TmpXtdComment.
+    """
+    content_type_id = getattr(comment, "content_type_id", None)
+    if content_type_id is None:
+        content_type_id = comment.content_type.pk
+    invalidate_tree_cache(
+        content_type_id, comment.object_pk, comment.site_id, using=using
+    )
+
+
+def _get_count_key(content_type_id, site_id):
+    return f"{COUNT_KEY_PREFIX}.{content_type_id}.{site_id}"
+
+
+def get_comment_count(content_types, site_id):
+    """
+    Return the number of comments to objects of the given content types in
+    a site.
+
+    With COMMENTS_XTD_CACHE_COUNTS the count of each content type is cached
+    for COMMENTS_XTD_CACHE_COUNTS_TIMEOUT seconds. The content types not in
+    the cache are counted with a single query.
+    """
+    qs = get_model().norel_objects.filter(site_id=site_id)
+    if not settings.COMMENTS_XTD_CACHE_COUNTS:
+        return qs.filter(content_type__in=content_types).count()
+
+    cache = get_tree_cache()
+    keys = {_get_count_key(ct.pk, site_id): ct.pk for ct in content_types}
+    counts = cache.get_many(keys)
+    missing = [ct_id for key, ct_id in keys.items() if key not in counts]
+    if missing:
+        rows = dict(
+            qs.filter(content_type__in=missing)
+            .order_by()
+            .values_list("content_type")
+            .annotate(Count("pk"))
+        )
+        missing_counts = {
+            _get_count_key(ct_id, site_id): rows.get(ct_id, 0)
+            for ct_id in missing
+        }
+        cache.set_many(
+            missing_counts, settings.COMMENTS_XTD_CACHE_COUNTS_TIMEOUT
+        )
+        counts.update(missing_counts)
+    return sum(counts.values())
+
+
+def update_comment_count(comment, delta, using=None):
+    """
+    Add delta to the cached count of the content type and site of a
+    comment, once the current transaction commits. Counts not in the cache
+    are left out, they are counted when they are needed.
+    """
+    if not settings.COMMENTS_XTD_CACHE_COUNTS:
+        return
+    key = _get_count_key(comment.content_type_id, comment.site_id)
+
+    def apply_delta():
+        with suppress(ValueError):
+            get_tree_cache().incr(key, delta)
+
+    transaction.on_commit(apply_delta, using=using)
+
+
+# ----------------------------------------------------------------------
+# Signal receivers, connected in CommentsXtdConfig.ready.
+
+
+def on_comment_posted(sender, comment, **kwargs):
+    """Receiver of comment_was_posted and confirmation_received."""
+    invalidate_comment_tree_cache(comment)
+
+
+def on_comment_saved(sender, instance, created, using, **kwargs):
+    if created:
+        update_comment_count(instance, 1, using=using)
+
+
+def on_comment_deleted(sender, instance, using, **kwargs):
+    invalidate_comment_tree_cache(instance, using=using)
+    update_comment_count(instance, -1, using=using)
+
+
+def on_comment_flag_changed(sender, instance, using, **kwargs):
+    """Receiver of post_save and post_delete of CommentFlag."""
+    if not settings.COMMENTS_XTD_CACHE_TREES:
+        return
+    comment = (
+        Comment.objects.using(using)
+        .filter(pk=instance.comment_id)
+        .values("content_type_id", "object_pk", "site_id")
+        .first()
+    )
+    if comment is not None:
+        invalidate_tree_cache(
+            comment["content_type_id"],
+            comment["object_pk"],
+            comment["site_id"],
+            using=using,
+        )
@@ -0,0 +1,31 @@
+from django.core import checks
+
+from django_comments_xtd.conf import settings
+from django_comments_xtd.models import PATH_MAX_LEVEL
+
+
+def check_max_thread_level(app_configs, **kwargs):
+    """
+    Warn about max thread levels greater than the levels that fit in the
+    materialized path of the comments.
+    """
+    max_levels = {
+        "COMMENTS_XTD_MAX_THREAD_LEVEL": settings.COMMENTS_XTD_MAX_THREAD_LEVEL
+    }
+    for (
+        app_model,
+        max_level,
+    ) in settings.COMMENTS_XTD_MAX_THREAD_LEVEL_BY_APP_MODEL.items():
+        name = f"COMMENTS_XTD_MAX_THREAD_LEVEL_BY_APP_MODEL[{app_model!r}]"
+        max_levels[name] = max_level
+    return [
+        checks.Warning(
+            f"{name} is {max_level}, greater than {PATH_MAX_LEVEL}.",
+            hint=f"Comments nested deeper than level {PATH_MAX_LEVEL} have "
+            "an empty path, and ordering by 'path' doesn't list them in "
+            "tree order.",
+            id="django_comments_xtd.W001",
+        )
+        for name, max_level in max_levels.items()
+        if max_level > PATH_MAX_LEVEL
+    ]
@@ -8,21 +8,76 @@ COMMENTS_XTD_SALT = b""
 # Whether comment posts should be confirmed by email.
 COMMENTS_XTD_CONFIRM_EMAIL = True
 
+# Whether to accept the confirmation and mute keys created by former
+# versions, that contain pickled comments. Set it to False once the emails
+# sent by former versions have expired, to never unpickle values from URLs.
+COMMENTS_XTD_ACCEPT_PICKLED_KEYS = True
+
 # From email address.
 COMMENTS_XTD_FROM_EMAIL = settings.DEFAULT_FROM_EMAIL
 
 # Contact email address.
 COMMENTS_XTD_CONTACT_EMAIL = settings.DEFAULT_FROM_EMAIL
 
-# Maximum Thread Level.
+# Maximum Thread Level. Comments nested deeper than level 22 don't fit in
+# the materialized path, and get an empty path.
 COMMENTS_XTD_MAX_THREAD_LEVEL = 0
 
 # Maximum Thread Level per app.model basis.
 COMMENTS_XTD_MAX_THREAD_LEVEL_BY_APP_MODEL = {}
 
-# Default order to list comments in.
+# Default order to list comments in. Once the materialized path of the
+# comments has been initialized with the management command
+# 'initialize_thread_path', ("path",) gives the same order, as long as no
+# comment is nested deeper than level 22.
 COMMENTS_XTD_LIST_ORDER = ("thread_id", "order")
 
+# Distance between the 'order' values of consecutive comments in a thread.
+# With the default value of 1 the order values are contiguous, and every
+# reply shifts the order of all the comments that follow it in the thread.
+# A greater value (e.g. 1024) leaves gaps so that replies can be placed
+# between existing comments, and only a small window of comments has to be
+# renumbered when a gap runs out. Run the management command
+# 'respace_thread_order' after changing it to re-space existing threads.
+COMMENTS_XTD_ORDER_GAP = 1
+
+# Whether replies to the same thread are serialized with a lock, so that
+# concurrent replies don't corrupt the order of the comments in the thread.
+# Uses advisory locks in PostgreSQL, SELECT ... FOR UPDATE on the thread's
+# root comment in other backends supporting it, and a process-wide lock
+# in SQLite.
+COMMENTS_XTD_LOCK_THREADS = True
+
+# Whether to cache the comment trees displayed with the template tag
+# render_xtdcomment_tree. The comments of each object are cached along with
+# their number of likes, dislikes and removal suggestions, and the flags of
+# the current user are applied on top of them. The HTML is cached too when
+# the user is not authenticated. The cache of an object is invalidated when
+# one of its comments is posted, confirmed, flagged, published or
+# unpublished. The lists of users shown with show_feedback are never cached.
+COMMENTS_XTD_CACHE_TREES = False
+
+# Alias of the cache, in the CACHES setting, used to cache comment trees.
+COMMENTS_XTD_CACHE_ALIAS = "default"
+
+# Number of seconds comment trees are cached for.
+COMMENTS_XTD_CACHE_TIMEOUT = 300
+
+# Whether to cache the comment counts of the get_xtdcomment_count template
+# tag, per content type and site, in the COMMENTS_XTD_CACHE_ALIAS cache.
+# Cached counts are updated as comments are created and deleted. Comments
+# created or deleted in bulk, or with SQL, are counted once the cached
+# counts expire.
+COMMENTS_XTD_CACHE_COUNTS = False
+
+# Number of seconds comment counts are cached for.
+COMMENTS_XTD_CACHE_COUNTS_TIMEOUT = 300
+
+# Number of seconds after which SpamModerator reloads the blacklisted
+# domains, to get the changes made by other processes. Changes made in the
+# same process reload them immediately. None to never reload them.
+COMMENTS_XTD_BLACKLIST_TTL = 300
+
 # Form class to use.
 COMMENTS_XTD_FORM_CLASS = "django_comments_xtd.forms.XtdCommentForm"
 
@@ -37,6 +92,27 @@ COMMENTS_XTD_SEND_HTML_EMAIL = True
 # your own celery app.
 COMMENTS_XTD_THREADED_EMAILS = True
 
+# Maximum number of threads sending emails when COMMENTS_XTD_THREADED_EMAILS
+# is True. Emails are queued and sent by a pool of up to this many threads.
+COMMENTS_XTD_EMAIL_WORKERS = 4
+
+# Maximum number of queued emails a thread sends through a single
+# connection to the email backend.
+COMMENTS_XTD_EMAIL_BATCH_SIZE = 50
+
+# Whether to queue emails in the database, in the model OutboxEmail, instead
+# of sending them. Queued emails are sent by the management command
+# 'process_comment_outbox', that has to be run periodically.
+COMMENTS_XTD_OUTBOX = False
+
+# Number of times the command 'process_comment_outbox' tries to send an
+# email before giving up.
+COMMENTS_XTD_OUTBOX_MAX_ATTEMPTS = 5
+
+# Number of seconds to wait before retrying a failed email. The delay is
+# doubled after each failed attempt.
+COMMENTS_XTD_OUTBOX_RETRY_DELAY = 60
+
 # Define what commenting features a pair app_label.model can have.
 COMMENTS_XTD_APP_MODEL_OPTIONS = {
     "default": {
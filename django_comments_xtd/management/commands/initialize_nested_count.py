@@ -1,7 +1,29 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Max, Min
 from django.db.utils import ConnectionDoesNotExist
 
 from django_comments_xtd.models import XtdComment
+from django_comments_xtd.utils import iter_thread_batches
+
+
+def get_thread_ranges(queryset, num_ranges):
+    """
+    Split the thread ids of the comments in num_ranges disjoint ranges of
+    consecutive ids. Return a list of (first_thread_id, last_thread_id).
+    """
+    bounds = queryset.aggregate(Min("thread_id"), Max("thread_id"))
+    first, last = bounds["thread_id__min"], bounds["thread_id__max"]
+    if first is None:
+        return []
+    size = -(-(last - first + 1) // num_ranges)  # Ceil division.
+    return [
+        (start, min(start + size - 1, last))
+        for start in range(first, last + 1, size)
+    ]
 
 
 class Command(BaseCommand):
@@ -9,38 +31,107 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument("using", nargs="*", type=str)
+        parser.add_argument(
+            "--threads-per-batch",
+            type=int,
+            default=500,
+            help="Number of threads read and updated at once.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=2000,
+            help="Number of comments fetched from the DB at once.",
+        )
+        parser.add_argument(
+            "--threads",
+            type=int,
+            default=1,
+            help="Number of workers processing disjoint ranges of threads "
+            "in parallel (ignored with SQLite).",
+        )
 
-    def initialize_nested_count(self, using):
-        # Control break.
-        active_thread_id = -1
-        parents = {}
+    def report_progress(self, processed):
+        with self.progress_lock:
+            self.processed += processed
+            if self.verbosity >= 1 and self.pending:
+                percent = 100 * self.processed // self.pending
+                self.stdout.write(
+                    f"Processed {self.processed} of {self.pending} "
+                    f"XtdComment object(s) ({percent}%)."
+                )
 
-        qs = XtdComment.objects.using(using).order_by("thread_id", "-order")
+    def initialize_thread_range(self, qs, threads_per_batch, chunk_size):
+        total = 0
+        for batch_qs in iter_thread_batches(qs, threads_per_batch):
+            rows = (
+                batch_qs.order_by("thread_id", "-order")
+                .values_list("pk", "thread_id", "parent_id", "nested_count")
+                .iterator(chunk_size=chunk_size)
+            )
+            changed = []
+            processed = 0
+            # Control break.
+            active_thread_id = None
+            parents = {}
+            # Nested comments come before their parents in the thread.
+            for pk, thread_id, parent_id, nested_count in rows:
+                if thread_id != active_thread_id:
+                    active_thread_id = thread_id
+                    parents = {}
+                new_nested_count = parents.pop(pk, 0)
+                parents[parent_id] = (
+                    parents.get(parent_id, 0) + 1 + new_nested_count
+                )
+                if nested_count != new_nested_count:
+                    changed.append(
+                        XtdComment(pk=pk, nested_count=new_nested_count)
+                    )
+                processed += 1
+            qs.bulk_update(changed, ["nested_count"], batch_size=1000)
+            self.report_progress(processed)
+            total += processed
+        return total
 
-        for comment in qs:
-            # Clean up parents when there is a control break.
-            if comment.thread_id != active_thread_id:
-                parents = {}
-                active_thread_id = comment.thread_id
+    def initialize_nested_count(
+        self, using, threads_per_batch, chunk_size, threads
+    ):
+        qs = XtdComment.norel_objects.using(using)
+        self.pending = qs.count()
+        self.processed = 0
+        # SQLite allows only one writer at a time.
+        if threads <= 1 or connections[using].vendor == "sqlite":
+            return self.initialize_thread_range(
+                qs, threads_per_batch, chunk_size
+            )
 
-            nested_count = parents.get(comment.comment_ptr_id, 0)
-            parents.setdefault(comment.parent_id, 0)
-            if nested_count > 0:
-                parents[comment.parent_id] += 1 + nested_count
-            else:
-                parents[comment.parent_id] += 1
-            comment.nested_count = nested_count
-            comment.save()
+        def work(thread_range):
+            try:
+                return self.initialize_thread_range(
+                    qs.filter(thread_id__range=thread_range),
+                    threads_per_batch,
+                    chunk_size,
+                )
+            finally:
+                connections[using].close()
 
-        return qs.count()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            return sum(executor.map(work, get_thread_ranges(qs, threads)))
 
     def handle(self, *args, **options):
         total = 0
         using = options["using"] or ["default"]
+        self.verbosity = options["verbosity"]
+        self.progress_lock = threading.Lock()
 
         try:
             for db_conn in using:
-                total += self.initialize_nested_count(db_conn)
+                total += self.initialize_nested_count(
+                    db_conn,
+                    options["threads_per_batch"],
+                    options["chunk_size"],
+                    options["threads"],
+                )
         except ConnectionDoesNotExist:
             self.stdout.write(f"DB connection '{db_conn}' does not exist.")
         self.stdout.write(f"Updated {total} XtdComment object(s).")
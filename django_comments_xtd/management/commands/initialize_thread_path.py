@@ -0,0 +1,79 @@
+from django.core.management.base import BaseCommand
+from django.db.utils import ConnectionDoesNotExist
+
+from django_comments_xtd.models import (
+    PATH_MAX_LENGTH,
+    PATH_MAX_LEVEL,
+    PATH_SEPARATOR,
+    XtdComment,
+    get_path_segment,
+)
+from django_comments_xtd.utils import iter_thread_batches
+
+
+class Command(BaseCommand):
+    help = "Initialize the path field for all the comments in the DB."
+
+    def add_arguments(self, parser):
+        parser.add_argument("using", nargs="*", type=str)
+        parser.add_argument(
+            "--threads-per-batch",
+            type=int,
+            default=500,
+            help="Number of threads read and updated at once.",
+        )
+
+    def initialize_thread_path(self, using, threads_per_batch):
+        qs = XtdComment.norel_objects.using(using)
+        total = 0
+        for batch_qs in iter_thread_batches(qs, threads_per_batch):
+            rows = batch_qs.order_by("thread_id", "order").values_list(
+                "pk", "thread_id", "parent_id", "path"
+            )
+            changed = []
+            # Control break.
+            active_thread_id = None
+            paths = {}
+            for pk, thread_id, parent_id, path in rows:
+                if thread_id != active_thread_id:
+                    active_thread_id = thread_id
+                    paths = {}
+                # Parents come before their nested comments in the thread.
+                if pk == parent_id:
+                    new_path = get_path_segment(pk)
+                elif paths.get(parent_id):
+                    new_path = PATH_SEPARATOR.join(
+                        [paths[parent_id], get_path_segment(pk)]
+                    )
+                    if len(new_path) > PATH_MAX_LENGTH:
+                        # Nested deeper than PATH_MAX_LEVEL. It gets no
+                        # path, nor its replies.
+                        new_path = ""
+                        self.too_deep += 1
+                else:
+                    new_path = ""
+                paths[pk] = new_path
+                if path != new_path:
+                    changed.append(XtdComment(pk=pk, path=new_path))
+                total += 1
+            qs.bulk_update(changed, ["path"], batch_size=1000)
+        return total
+
+    def handle(self, *args, **options):
+        total = 0
+        using = options["using"] or ["default"]
+        self.too_deep = 0
+
+        try:
+            for db_conn in using:
+                total += self.initialize_thread_path(
+                    db_conn, options["threads_per_batch"]
+                )
+        except ConnectionDoesNotExist:
+            self.stdout.write(f"DB connection '{db_conn}' does not exist.")
+        if self.too_deep:
+            self.stdout.write(
+                f"{self.too_deep} XtdComment object(s) nested deeper than "
+                f"level {PATH_MAX_LEVEL}, and their replies, have no path."
+            )
+        self.stdout.write(f"Updated {total} XtdComment object(s).")
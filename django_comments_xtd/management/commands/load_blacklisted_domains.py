@@ -0,0 +1,175 @@
+import sys
+from array import array
+from contextlib import nullcontext
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+from django.db.transaction import atomic
+from django.db.utils import ConnectionDoesNotExist
+
+from django_comments_xtd.blacklist import (
+    contains_hash,
+    get_domain_hashes,
+    invalidate_blacklist_matcher,
+    normalize_domain,
+)
+from django_comments_xtd.models import BlackListedDomain
+
+
+class Command(BaseCommand):
+    help = (
+        "Load a list of blacklisted domains, one per line, adding the "
+        "domains that are not in the DB and deleting the ones that are "
+        "not in the list."
+    )
+    stealth_options = ("stdin",)
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "file",
+            type=str,
+            help="Path to the list of domains, or - for stdin.",
+        )
+        parser.add_argument(
+            "--database", default="default", help="DB connection to use."
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=5000,
+            help="Number of domains created or deleted per query.",
+        )
+        parser.add_argument(
+            "--no-delete",
+            action="store_false",
+            dest="delete",
+            help="Don't delete the domains that are not in the list.",
+        )
+
+    def read_domains(self, lines):
+        """Yield the normalized domains, skipping comments and blanks."""
+        max_length = BlackListedDomain._meta.get_field("domain").max_length
+        for line in lines:
+            fields = line.split("#", 1)[0].split()
+            if not fields:
+                continue
+            domain = normalize_domain(fields[0])
+            if domain and len(domain) <= max_length:
+                yield domain
+
+    def read_chunks(self, lines, size):
+        """Yield lists of up to size distinct domains."""
+        chunk = {}
+        for domain in self.read_domains(lines):
+            chunk[domain] = None
+            if len(chunk) >= size:
+                yield list(chunk)
+                chunk = {}
+        if chunk:
+            yield list(chunk)
+
+    def get_table_hashes(self, using, batch_size):
+        """Return a sorted array with the hashes of the domains in the DB."""
+        domains = (
+            BlackListedDomain.objects.using(using)
+            .values_list("domain", flat=True)
+            .iterator(chunk_size=batch_size)
+        )
+        hashes = get_domain_hashes(normalize_domain(d) for d in domains)
+        return array("Q", sorted(hashes))
+
+    def create_domains(self, lines, table_hashes, using, batch_size):
+        """
+        Create the domains of the list that are not in the DB. Return the
+        sorted array with the hashes of all the domains of the list.
+        """
+        list_hashes = array("Q")
+        created_hashes = set()
+        created = 0
+        for chunk in self.read_chunks(lines, batch_size):
+            hashes = get_domain_hashes(chunk)
+            list_hashes.extend(hashes)
+            new_domains = []
+            for domain, domain_hash in zip(chunk, hashes, strict=True):
+                if contains_hash(table_hashes, domain_hash):
+                    continue
+                if domain_hash in created_hashes:
+                    continue
+                created_hashes.add(domain_hash)
+                new_domains.append(BlackListedDomain(domain=domain))
+            BlackListedDomain.objects.using(using).bulk_create(new_domains)
+            created += len(new_domains)
+        return created, array("Q", sorted(list_hashes))
+
+    def get_stale_hashes(self, table_hashes, list_hashes):
+        """Return the hashes in the DB that are not in the list."""
+        stale = set()
+        index, size = 0, len(list_hashes)
+        # Both arrays are sorted, walk them at once.
+        for domain_hash in table_hashes:
+            while index < size and list_hashes[index] < domain_hash:
+                index += 1
+            if index == size or list_hashes[index] != domain_hash:
+                stale.add(domain_hash)
+        return stale
+
+    def delete_domains(self, stale_hashes, using, batch_size):
+        """Delete the domains in the DB with the given hashes."""
+        deleted = 0
+        last_pk = None
+        qs = BlackListedDomain.objects.using(using).order_by("pk")
+        while True:
+            page = qs if last_pk is None else qs.filter(pk__gt=last_pk)
+            rows = list(page.values_list("pk", "domain")[:batch_size])
+            if not rows:
+                break
+            last_pk = rows[-1][0]
+            hashes = get_domain_hashes(
+                normalize_domain(domain) for _, domain in rows
+            )
+            pks = [
+                pk
+                for (pk, _), domain_hash in zip(rows, hashes, strict=True)
+                if domain_hash in stale_hashes
+            ]
+            if pks:
+                deleted += len(pks)
+                BlackListedDomain.objects.using(using).filter(
+                    pk__in=pks
+                ).delete()
+        return deleted
+
+    def load_blacklisted_domains(self, lines, using, batch_size, delete):
+        with atomic(using=using):
+            table_hashes = self.get_table_hashes(using, batch_size)
+            created, list_hashes = self.create_domains(
+                lines, table_hashes, using, batch_size
+            )
+            deleted = 0
+            if delete:
+                stale = self.get_stale_hashes(table_hashes, list_hashes)
+                if stale:
+                    deleted = self.delete_domains(stale, using, batch_size)
+        # Bulk creations don't send signals.
+        invalidate_blacklist_matcher()
+        return created, deleted
+
+    def handle(self, *args, **options):
+        created = deleted = 0
+        db_conn = options["database"]
+
+        try:
+            if options["file"] == "-":
+                stream = nullcontext(options.get("stdin", sys.stdin))
+            else:
+                stream = Path(options["file"]).open(encoding="utf-8")  # noqa: SIM115
+            with stream as lines:
+                created, deleted = self.load_blacklisted_domains(
+                    lines, db_conn, options["batch_size"], options["delete"]
+                )
+        except ConnectionDoesNotExist:
+            self.stdout.write(f"DB connection '{db_conn}' does not exist.")
+        self.stdout.write(
+            f"Created {created} and deleted {deleted} "
+            f"BlackListedDomain object(s)."
+        )
@@ -1,48 +1,104 @@
 from django.core.management.base import BaseCommand
 from django.db import connections
-from django.db.utils import ConnectionDoesNotExist, IntegrityError
+from django.db.models import CharField, Exists, F, Max, Min, OuterRef, Value
+from django.db.models.functions import Cast, LPad
+from django.db.transaction import atomic
+from django.db.utils import ConnectionDoesNotExist
 from django_comments.models import Comment
 
-from django_comments_xtd.models import XtdComment
+from django_comments_xtd.models import PATH_DIGITS, XtdComment
 
 __all__ = ["Command"]
 
 
 class Command(BaseCommand):
-    help = "Load the xtdcomment table with valid data from django_comments."
+    help = (
+        "Load the xtdcomment table with valid data from django_comments. "
+        "Comments already in the xtdcomment table are skipped, so it can be "
+        "run again to resume an interrupted load."
+    )
 
     def add_arguments(self, parser):
         parser.add_argument("using", nargs="*", type=str)
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=10000,
+            help="Range of comment ids copied by each INSERT statement.",
+        )
 
-    def populate_db(self, cursor):
-        for comment in Comment.objects.all():
-            sql = (
-                "INSERT INTO %(table)s "
-                "       ('comment_ptr_id', 'thread_id', 'parent_id',"
-                "        'level', 'order', 'followup') "
-                "VALUES (%(id)d, %(id)d, %(id)d, 0, 1, FALSE)"
-            )
-            cursor.execute(
-                sql % {"table": XtdComment._meta.db_table, "id": comment.id}
+    def get_insert_sql(self, using, first_id, last_id):
+        """
+        Return the INSERT ... SELECT statement, and its params, that copies
+        the comments with ids between first_id and last_id as thread roots.
+        """
+        # The column names come from the annotations, in the same order.
+        columns = {
+            "comment_ptr_id": F("pk"),
+            "thread_id": F("pk"),
+            "parent_id": F("pk"),
+            "level": Value(0),
+            "order": Value(1),
+            "followup": Value(False),
+            "nested_count": Value(0),
+            "path": LPad(Cast("pk", CharField()), PATH_DIGITS, Value("0")),
+        }
+        annotations = {f"xtd_{name}": expr for name, expr in columns.items()}
+        qs = (
+            Comment.objects.using(using)
+            .filter(pk__gte=first_id, pk__lte=last_id)
+            .filter(
+                ~Exists(
+                    XtdComment.norel_objects.using(using).filter(
+                        pk=OuterRef("pk")
+                    )
+                )
             )
+            .order_by()
+            .annotate(**annotations)
+            .values_list(*annotations)
+        )
+        # Compile for the backend of the connection, not the default one.
+        select_sql, params = qs.query.get_compiler(using=using).as_sql()
+        qn = connections[using].ops.quote_name
+        table = qn(XtdComment._meta.db_table)
+        column_names = ", ".join(
+            qn(XtdComment._meta.get_field(name).column) for name in columns
+        )
+        sql = f"INSERT INTO {table} ({column_names}) {select_sql}"
+        return sql, params
+
+    def populate_db(self, using, batch_size):
+        bounds = (
+            Comment.objects.using(using)
+            .order_by()
+            .aggregate(Min("pk"), Max("pk"))
+        )
+        first_id, last_id = bounds["pk__min"], bounds["pk__max"]
+        if first_id is None:
+            return 0
+        total = 0
+        for start in range(first_id, last_id + 1, batch_size):
+            end = min(start + batch_size - 1, last_id)
+            sql, params = self.get_insert_sql(using, start, end)
+            with atomic(using=using), connections[using].cursor() as cursor:
+                cursor.execute(sql, params)
+                total += max(cursor.rowcount, 0)
+            if self.verbosity >= 1:
+                self.stdout.write(
+                    f"Processed comment ids up to {end} of {last_id}, "
+                    f"added {total} XtdComment object(s)."
+                )
+        return total
 
     def handle(self, *args, **options):
         total = 0
         using = options["using"] or ["default"]
+        self.verbosity = options["verbosity"]
+
         try:
             for db_conn in using:
-                self.populate_db(connections[db_conn].cursor())
-                total += XtdComment.objects.using(db_conn).count()
+                total += self.populate_db(db_conn, options["batch_size"])
         except ConnectionDoesNotExist:
             self.stdout.write(f"DB connection '{db_conn}' does not exist.")
-        except IntegrityError:
-            if db_conn != "default":
-                self.stdout.write(
-                    f"Table '{XtdComment._meta.db_table}' "
-                    f"(in '{db_conn}' DB connection) must be empty."
-                )
-            else:
-                self.stdout.write(
-                    f"Table '{XtdComment._meta.db_table}' must be empty."
-                )
         self.stdout.write(f"Added {total} XtdComment object(s).")
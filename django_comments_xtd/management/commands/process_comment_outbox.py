@@ -0,0 +1,103 @@
+from datetime import timedelta
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.transaction import atomic
+from django.db.utils import ConnectionDoesNotExist
+from django.utils import timezone
+
+from django_comments_xtd.conf import settings
+from django_comments_xtd.models import OutboxEmail
+
+
+class Command(BaseCommand):
+    help = (
+        "Send the emails queued in the outbox, retrying the ones that "
+        "fail after COMMENTS_XTD_OUTBOX_RETRY_DELAY seconds, doubled "
+        "after each attempt."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("using", nargs="*", type=str)
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Number of emails sent through each connection.",
+        )
+
+    def get_retry_delay(self, attempts):
+        delay = settings.COMMENTS_XTD_OUTBOX_RETRY_DELAY
+        return timedelta(seconds=delay * 2 ** (attempts - 1))
+
+    def send_batch(self, batch):
+        """Send a batch of emails, and return the ones that failed."""
+        failed = []
+        connection = get_connection()
+        try:
+            connection.open()
+        except Exception as exc:  # noqa: BLE001
+            return [(email, exc) for email in batch]
+        try:
+            for email in batch:
+                try:
+                    connection.send_messages([email.to_message(connection)])
+                except Exception as exc:  # noqa: BLE001, PERF203
+                    failed.append((email, exc))
+        finally:
+            connection.close()
+        return failed
+
+    def process_comment_outbox(self, using, batch_size):
+        sent = failed = 0
+        max_attempts = settings.COMMENTS_XTD_OUTBOX_MAX_ATTEMPTS
+        # Emails are locked while being sent, so that several processes can
+        # work on the outbox at once.
+        features = connections[using].features
+        started = timezone.now()
+        while True:
+            with atomic(using=using):
+                qs = OutboxEmail.objects.using(using).filter(
+                    send_after__lte=started, attempts__lt=max_attempts
+                )
+                if features.has_select_for_update_skip_locked:
+                    qs = qs.select_for_update(skip_locked=True)
+                batch = list(qs[:batch_size])
+                if not batch:
+                    break
+
+                failed_batch = self.send_batch(batch)
+                now = timezone.now()
+                for email, exc in failed_batch:
+                    email.attempts += 1
+                    email.last_error = f"{exc.__class__.__name__}: {exc}"
+                    email.send_after = now + self.get_retry_delay(
+                        email.attempts
+                    )
+                OutboxEmail.objects.using(using).bulk_update(
+                    [email for email, _ in failed_batch],
+                    ["attempts", "last_error", "send_after"],
+                )
+                failed_pks = {email.pk for email, _ in failed_batch}
+                OutboxEmail.objects.using(using).filter(
+                    pk__in=[e.pk for e in batch if e.pk not in failed_pks]
+                ).delete()
+            sent += len(batch) - len(failed_batch)
+            failed += len(failed_batch)
+        return sent, failed
+
+    def handle(self, *args, **options):
+        sent = failed = 0
+        using = options["using"] or ["default"]
+
+        try:
+            for db_conn in using:
+                db_sent, db_failed = self.process_comment_outbox(
+                    db_conn, options["batch_size"]
+                )
+                sent += db_sent
+                failed += db_failed
+        except ConnectionDoesNotExist:
+            self.stdout.write(f"DB connection '{db_conn}' does not exist.")
+        self.stdout.write(f"Sent {sent} email(s), {failed} failed.")
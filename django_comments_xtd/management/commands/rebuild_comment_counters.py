@@ -0,0 +1,93 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Max, Q
+from django.db.transaction import atomic
+from django.db.utils import ConnectionDoesNotExist
+
+from django_comments_xtd.models import XtdComment, XtdCommentCounter
+
+COUNTER_FIELDS = ["public_count", "thread_count", "last_submit_date"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Count again the visible comments of every object, repairing the "
+        "XtdCommentCounter objects that are out of date."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("using", nargs="*", type=str)
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of counters created or updated per query.",
+        )
+
+    def get_counts(self, using, batch_size):
+        """Yield the counts of the comments of each object."""
+        visible = Q(is_public=True, is_removed=False)
+        return (
+            XtdComment.norel_objects.using(using)
+            .order_by()
+            .values_list("content_type_id", "object_pk", "site_id")
+            .annotate(
+                public_count=Count("pk", filter=visible),
+                thread_count=Count("pk", filter=visible & Q(level=0)),
+                last_submit_date=Max("submit_date", filter=visible),
+            )
+            .iterator(chunk_size=batch_size)
+        )
+
+    def rebuild_counters(self, using, batch_size):
+        qs = XtdCommentCounter.objects.using(using)
+        with atomic(using=using):
+            counters = {
+                (c.content_type_id, c.object_pk, c.site_id): c
+                for c in qs.iterator(chunk_size=batch_size)
+            }
+            created, changed = [], []
+            for ct_id, object_pk, site_id, *values in self.get_counts(
+                using, batch_size
+            ):
+                counts = dict(zip(COUNTER_FIELDS, values, strict=True))
+                counter = counters.pop((ct_id, object_pk, site_id), None)
+                if counter is None:
+                    created.append(
+                        XtdCommentCounter(
+                            content_type_id=ct_id,
+                            object_pk=object_pk,
+                            site_id=site_id,
+                            **counts,
+                        )
+                    )
+                elif any(
+                    getattr(counter, name) != value
+                    for name, value in counts.items()
+                ):
+                    for name, value in counts.items():
+                        setattr(counter, name, value)
+                    changed.append(counter)
+            qs.bulk_create(created, batch_size=batch_size)
+            qs.bulk_update(changed, COUNTER_FIELDS, batch_size=batch_size)
+            # Counters of objects whose comments have all been deleted.
+            stale = [counter.pk for counter in counters.values()]
+            for start in range(0, len(stale), batch_size):
+                qs.filter(pk__in=stale[start : start + batch_size]).delete()
+        return len(created), len(changed), len(stale)
+
+    def handle(self, *args, **options):
+        created = updated = deleted = 0
+        using = options["using"] or ["default"]
+
+        try:
+            for db_conn in using:
+                counts = self.rebuild_counters(db_conn, options["batch_size"])
+                created += counts[0]
+                updated += counts[1]
+                deleted += counts[2]
+        except ConnectionDoesNotExist:
+            self.stdout.write(f"DB connection '{db_conn}' does not exist.")
+        self.stdout.write(
+            f"Created {created}, updated {updated} and deleted {deleted} "
+            f"XtdCommentCounter object(s)."
+        )
@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand
+from django.db.utils import ConnectionDoesNotExist
+
+from django_comments_xtd.conf import settings
+from django_comments_xtd.models import XtdComment
+from django_comments_xtd.utils import iter_thread_batches
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-space the order field of the comments in every thread, "
+        "leaving COMMENTS_XTD_ORDER_GAP between consecutive comments."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("using", nargs="*", type=str)
+        parser.add_argument(
+            "--gap",
+            type=int,
+            default=None,
+            help="Distance between order values (default: "
+            "COMMENTS_XTD_ORDER_GAP).",
+        )
+        parser.add_argument(
+            "--threads-per-batch",
+            type=int,
+            default=500,
+            help="Number of threads read and updated at once.",
+        )
+
+    def respace_thread_order(self, using, gap, threads_per_batch):
+        qs = XtdComment.norel_objects.using(using)
+        total = 0
+        for batch_qs in iter_thread_batches(qs, threads_per_batch):
+            rows = batch_qs.order_by("thread_id", "order").values_list(
+                "pk", "thread_id", "order"
+            )
+            changed = []
+            active_thread_id = None
+            new_order = 1
+            for pk, thread_id, order in rows:
+                # Restart the numbering when there is a control break.
+                if thread_id != active_thread_id:
+                    active_thread_id = thread_id
+                    new_order = 1
+                if order != new_order:
+                    changed.append(XtdComment(pk=pk, order=new_order))
+                new_order += gap
+                total += 1
+            qs.bulk_update(changed, ["order"], batch_size=1000)
+        return total
+
+    def handle(self, *args, **options):
+        total = 0
+        using = options["using"] or ["default"]
+        gap = options["gap"] or settings.COMMENTS_XTD_ORDER_GAP
+
+        try:
+            for db_conn in using:
+                total += self.respace_thread_order(
+                    db_conn, gap, options["threads_per_batch"]
+                )
+        except ConnectionDoesNotExist:
+            self.stdout.write(f"DB connection '{db_conn}' does not exist.")
+        self.stdout.write(f"Re-spaced {total} XtdComment object(s).")
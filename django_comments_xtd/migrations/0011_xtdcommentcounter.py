@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('django_comments_xtd', '0010_outboxemail'),
+        ('sites', '0002_alter_domain_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='XtdCommentCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_pk', models.CharField(max_length=64)),
+                ('public_count', models.PositiveIntegerField(default=0)),
+                ('thread_count', models.PositiveIntegerField(default=0)),
+                ('last_submit_date', models.DateTimeField(blank=True, null=True)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+                ('site', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='sites.site')),
+            ],
+            options={
+                'verbose_name': 'comment counter',
+                'verbose_name_plural': 'comment counters',
+                'constraints': [models.UniqueConstraint(fields=('content_type', 'object_pk', 'site'), name='unique_xtdcommentcounter_object')],
+            },
+        ),
+    ]
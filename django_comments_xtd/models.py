@@ -1,15 +1,36 @@
+import threading
+from contextlib import contextmanager
+
 from django.contrib.contenttypes.models import ContentType
+from django.contrib.sites.models import Site
 from django.core import signing
-from django.db import models
-from django.db.models import F, Max, Min, Q
+from django.core.mail import EmailMultiAlternatives
+from django.db import DEFAULT_DB_ALIAS, connections, models, router
+from django.db.models import (
+    Case,
+    CharField,
+    Count,
+    F,
+    Max,
+    Min,
+    OuterRef,
+    Q,
+    Subquery,
+    Value,
+    When,
+)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast, Coalesce, Greatest
 from django.db.transaction import atomic
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django_comments.managers import CommentManager
 from django_comments.models import Comment, CommentFlag
 
-from django_comments_xtd import get_model
+from django_comments_xtd.cache import invalidate_comment_tree_cache
 from django_comments_xtd.conf import settings
+from django_comments_xtd.utils import get_content_type, get_current_site_id
 
 LIKEDIT_FLAG = "I liked it"
 DISLIKEDIT_FLAG = "I disliked it"
@@ -33,17 +54,206 @@ class MaxThreadLevelExceededException(Exception):
         return "Max thread level reached for comment %d" % self.comment.id
 
 
+# Max number of comments renumbered to open a gap in a sparse thread.
+ORDER_RESPACE_WINDOW = 64
+
+# Materialized path: the zero-padded ids of the ancestors of a comment,
+# from the thread's root comment down to the comment itself.
+PATH_DIGITS = 10
+PATH_SEPARATOR = "/"
+PATH_MAX_LENGTH = 255
+# Max level of the comments that have a path, which contains one segment
+# per level. Deeper comments have an empty path.
+PATH_MAX_LEVEL = (PATH_MAX_LENGTH + 1) // (PATH_DIGITS + 1) - 1
+
+# Fields that make a comment visible or not. Their changes are published
+# or unpublished to the nested comments.
+VISIBILITY_FIELDS = frozenset(["is_public", "is_removed"])
+
+
+def get_path_segment(comment_id):
+    return f"{comment_id:0{PATH_DIGITS}d}"
+
+
+def get_sparse_order(qc_eq_thread, qc_ge_level):
+    """
+    Return the order for a new comment in a thread using sparse ordering.
+
+    `qc_eq_thread` contains the comments of the thread, and `qc_ge_level`
+    the comments that follow the subtree of the parent of the new comment.
+    The new comment goes in the middle of the gap between the last comment
+    of that subtree and the next one. When there is no gap left, only the
+    comments within a small window are renumbered to open one.
+    """
+    gap = settings.COMMENTS_XTD_ORDER_GAP
+    next_order = qc_ge_level.aggregate(Min("order"))["order__min"]
+    if next_order is None:
+        max_order = qc_eq_thread.aggregate(Max("order"))["order__max"]
+        return max_order + gap
+
+    prev_order = qc_eq_thread.filter(order__lt=next_order).aggregate(
+        Max("order")
+    )["order__max"]
+    if next_order - prev_order > 1:
+        return prev_order + (next_order - prev_order) // 2
+
+    # No gap left. Spread the comments that follow prev_order, as few as
+    # possible, over the space that remains before the next one.
+    orders = list(
+        qc_eq_thread.filter(order__gt=prev_order)
+        .order_by("order")
+        .values_list("order", flat=True)[: ORDER_RESPACE_WINDOW + 1]
+    )
+    for index in range(1, len(orders) + 1):
+        if index == len(orders) and index <= ORDER_RESPACE_WINDOW:
+            step = gap  # The window reaches the end of the thread.
+        elif index < len(orders):
+            step = (orders[index] - prev_order) // (index + 2)
+        else:
+            break
+        if step > 1:
+            window = orders[:index]
+            qc_eq_thread.filter(
+                order__gte=window[0], order__lte=window[-1]
+            ).update(
+                order=Case(
+                    *[
+                        When(order=order, then=Value(prev_order + step * pos))
+                        for pos, order in enumerate(window, start=2)
+                    ],
+                    default=F("order"),
+                )
+            )
+            return prev_order + step
+
+    # The window is full of contiguous orders (i.e. a thread not re-spaced
+    # yet). Shift the rest of the thread once to make room for many replies.
+    qc_eq_thread.filter(order__gt=prev_order).update(order=F("order") + gap)
+    return prev_order + (gap + 1) // 2
+
+
+# Backends that can select the ancestors of a comment with a recursive CTE
+# in a subquery of the UPDATE statement that modifies them.
+RECURSIVE_CTE_VENDORS = ("postgresql", "sqlite")
+
+
+def get_ancestors_lookup(comment, include_self=False):
+    """
+    Return a Q object that matches the ancestors of the given comment.
+
+    The ancestors are taken from the comment's materialized path. When the
+    path is not initialized, they are selected with a recursive CTE, so that
+    the lookup costs no query by itself regardless of the comment's level.
+    """
+    if comment.path:
+        ids = [int(segment) for segment in comment.path.split(PATH_SEPARATOR)]
+        return Q(pk__in=ids if include_self else ids[:-1])
+
+    start_id = comment.pk if include_self else comment.parent_id
+    if start_id == comment.pk and not include_self:
+        return Q(pk__in=[])  # The comment is the root of the thread.
+
+    connection = connections[comment._state.db or DEFAULT_DB_ALIAS]
+    if connection.vendor not in RECURSIVE_CTE_VENDORS:
+        ids = [start_id]
+        qs = XtdComment.norel_objects.using(comment._state.db)
+        while True:
+            parent_id = qs.values_list("parent_id", flat=True).get(pk=ids[-1])
+            if parent_id == ids[-1]:
+                return Q(pk__in=ids)
+            ids.append(parent_id)
+
+    qn = connection.ops.quote_name
+    table = qn(XtdComment._meta.db_table)
+    pk = qn(XtdComment._meta.pk.column)
+    parent = qn(XtdComment._meta.get_field("parent_id").column)
+    sql = (
+        f"WITH RECURSIVE ancestors(id, parent_id) AS ("
+        f"SELECT {pk}, {parent} FROM {table} WHERE {pk} = %s "
+        f"UNION SELECT t.{pk}, t.{parent} FROM {table} t "
+        f"INNER JOIN ancestors a ON t.{pk} = a.parent_id "
+        f"WHERE a.id <> a.parent_id"
+        f") SELECT id FROM ancestors"
+    )
+    return Q(pk__in=RawSQL(sql, (start_id,)))
+
+
+# Key to tell apart the PostgreSQL advisory locks of comment threads.
+THREAD_ADVISORY_LOCK_KEY = 0x78746463
+
+# SQLite allows only one writer at a time and does not support
+# SELECT ... FOR UPDATE. New comments are serialized within the process.
+_sqlite_write_lock = threading.RLock()
+
+
+@contextmanager
+def sqlite_write_lock(using):
+    connection = connections[using]
+    if settings.COMMENTS_XTD_LOCK_THREADS and connection.vendor == "sqlite":
+        with _sqlite_write_lock:
+            yield
+    else:
+        yield
+
+
+def lock_thread(thread_id, using):
+    """
+    Lock the given thread until the end of the current transaction.
+
+    Serializes the replies to comments of the same thread, so that they
+    don't compute their order out of the same stale values. Replies to other
+    threads are not blocked. Uses an advisory lock on PostgreSQL, and locks
+    the root comment of the thread on other backends that support
+    SELECT ... FOR UPDATE. Returns True when the thread has been locked.
+    """
+    if not settings.COMMENTS_XTD_LOCK_THREADS:
+        return False
+    connection = connections[using or DEFAULT_DB_ALIAS]
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_advisory_xact_lock(%s, %s)",
+                [THREAD_ADVISORY_LOCK_KEY, thread_id],
+            )
+        return True
+    if connection.features.has_select_for_update:
+        list(
+            XtdComment.norel_objects.using(using)
+            .select_for_update()
+            .filter(pk=thread_id)
+            .values_list("pk", flat=True)
+        )
+        return True
+    return False
+
+
 class XtdCommentManager(CommentManager):
     def for_app_models(self, *args, **kwargs):
         """Return XtdComments for pairs "app.model" given in args"""
-        content_types = []
-        for app_model in args:
-            app, model = app_model.split(".")
-            content_types.append(
-                ContentType.objects.get(app_label=app, model=model)
-            )
+        content_types = [get_content_type(app_model) for app_model in args]
         return self.for_content_types(content_types, **kwargs)
 
+    def subthread(self, comment, include_self=False):
+        """
+        Return the XtdComments nested under the given comment.
+
+        The nested comments are those of the same thread placed between the
+        comment and the next comment with the same or lower level. The range
+        of orders is used instead of the materialized path, as the path is
+        empty in comments not initialized yet, or nested deeper than
+        PATH_MAX_LEVEL.
+        """
+        qs = self.get_queryset().filter(thread_id=comment.thread_id)
+        next_order = qs.filter(
+            level__lte=comment.level, order__gt=comment.order
+        ).aggregate(Min("order"))["order__min"]
+        nested = Q(order__gt=comment.order)
+        if next_order is not None:
+            nested &= Q(order__lt=next_order)
+        if include_self:
+            nested |= Q(pk=comment.pk)
+        return qs.filter(nested)
+
     def for_content_types(self, content_types, site=None):
         filter_fields = {"content_type__in": content_types}
         if site is not None:
@@ -51,6 +261,54 @@ class XtdCommentManager(CommentManager):
         qs = self.get_queryset().filter(**filter_fields).reverse()
         return qs
 
+    def counts_for(self, objects, site=None):
+        """
+        Return a dictionary with the number of visible comments of each of
+        the given objects, by object pk, counted with a single query. The
+        objects have to be of the same model.
+        """
+        object_pks = {str(obj.pk): obj.pk for obj in objects}
+        counts = dict.fromkeys(object_pks.values(), 0)
+        if not counts:
+            return counts
+        qs = self.get_queryset().filter(
+            content_type=ContentType.objects.get_for_model(objects[0]),
+            object_pk__in=object_pks,
+            is_public=True,
+            is_removed=False,
+        )
+        if site is not None:
+            qs = qs.filter(site=site)
+        rows = qs.order_by().values_list("object_pk").annotate(Count("pk"))
+        for object_pk, count in rows:
+            counts[object_pks[object_pk]] = count
+        return counts
+
+    def count_subquery(self, model, site=None):
+        """
+        Return an expression with the number of visible comments of each
+        object of a queryset of the given model. To be used as annotation::
+
+            Article.objects.annotate(
+                comment_count=XtdComment.objects.count_subquery(Article)
+            )
+        """
+        qs = self.get_queryset().filter(
+            content_type=ContentType.objects.get_for_model(model),
+            object_pk=Cast(OuterRef("pk"), output_field=CharField()),
+            is_public=True,
+            is_removed=False,
+        )
+        if site is not None:
+            qs = qs.filter(site=site)
+        qs = (
+            qs.order_by()
+            .values("object_pk")
+            .annotate(count=Count("pk"))
+            .values("count")
+        )
+        return Coalesce(Subquery(qs), 0)
+
     def get_queryset(self):
         qs = super().get_queryset()
         return qs.select_related("user", "content_type").order_by(
@@ -67,23 +325,116 @@ class XtdComment(Comment):
         blank=True, default=False, help_text=_("Notify follow-up comments")
     )
     nested_count = models.IntegerField(default=0, db_index=True)
+    path = models.CharField(
+        max_length=PATH_MAX_LENGTH, blank=True, default="", db_index=True
+    )
     objects = XtdCommentManager()
     norel_objects = CommentManager()
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._track_visibility()
+        return instance
+
+    def _track_visibility(self, fields=VISIBILITY_FIELDS):
+        """
+        Record the values of the visibility `fields` as they are in the DB,
+        after they have been loaded or saved. Deferred fields are unknown.
+        """
+        if not hasattr(self, "_saved_visibility"):
+            self._saved_visibility = {}
+        deferred = self.get_deferred_fields()
+        for field in VISIBILITY_FIELDS & set(fields):
+            if field in deferred:
+                self._saved_visibility.pop(field, None)
+            else:
+                self._saved_visibility[field] = getattr(self, field)
+
+    def _get_visibility_change(self, update_fields=None, using=None):
+        """
+        Return whether the comment is visible in the DB, and whether it will
+        be once `update_fields` are saved. The values of the visibility
+        fields that are unknown are read from the DB.
+        """
+        if update_fields is None:
+            # Like Model.save(), that only saves the loaded fields.
+            fields = VISIBILITY_FIELDS - self.get_deferred_fields()
+        else:
+            fields = VISIBILITY_FIELDS & set(update_fields)
+        saved = getattr(self, "_saved_visibility", {})
+        unknown = sorted(VISIBILITY_FIELDS - saved.keys())
+        if fields and unknown:
+            values = (
+                XtdComment.norel_objects.using(using or self._state.db)
+                .filter(pk=self.pk)
+                .values_list(*unknown)
+                .first()
+            )
+            if values is not None:
+                saved.update(zip(unknown, values, strict=True))
+                self._saved_visibility = saved
+        if VISIBILITY_FIELDS - saved.keys():
+            # Not in the DB yet, there is nothing to publish or unpublish.
+            return self.is_visible(), self.is_visible()
+        new = {**saved, **{field: getattr(self, field) for field in fields}}
+        return (
+            saved["is_public"] and not saved["is_removed"],
+            new["is_public"] and not new["is_removed"],
+        )
+
+    def visibility_has_changed(self, update_fields=None, using=None):
+        """
+        Whether saving `update_fields` publishes or unpublishes (or removes)
+        the comment.
+        """
+        was_visible, is_visible = self._get_visibility_change(
+            update_fields, using
+        )
+        return was_visible != is_visible
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        self._track_visibility(VISIBILITY_FIELDS if fields is None else fields)
+
+    def is_visible(self):
+        return self.is_public and not self.is_removed
+
     def save(self, *args, **kwargs):
         is_new = self.pk is None
-        super(Comment, self).save(*args, **kwargs)
-        if is_new:
+        using = kwargs.get("using") or router.db_for_write(
+            self.__class__, instance=self
+        )
+        if not is_new:
+            update_fields = kwargs.get("update_fields")
+            if self.visibility_has_changed(update_fields, using):
+                # The pre_save receiver publishes or unpublishes the nested
+                # comments, recount them along with the comment.
+                with atomic(using=using):
+                    super(Comment, self).save(*args, **kwargs)
+                    XtdCommentCounter.objects.db_manager(using).recount(self)
+            else:
+                super(Comment, self).save(*args, **kwargs)
+            self._track_visibility(
+                VISIBILITY_FIELDS if update_fields is None else update_fields
+            )
+            return
+        with sqlite_write_lock(using), atomic(using=using):
+            super(Comment, self).save(*args, **kwargs)
             if not self.parent_id:
                 self.parent_id = self.id
                 self.thread_id = self.id
+                self.path = get_path_segment(self.id)
             elif max_thread_level_for_content_type(self.content_type):
-                with atomic():
-                    self._calculate_thread_data()
+                self._calculate_thread_data()
             else:
                 raise MaxThreadLevelExceededException(self)
+            # A new comment has no nested comments to publish or unpublish.
+            self._track_visibility()
             kwargs["force_insert"] = False
             super(Comment, self).save(*args, **kwargs)
+            if self.is_visible():
+                XtdCommentCounter.objects.db_manager(using).add_comment(self)
 
     def _calculate_thread_data(self):
         # Implements the following approach:
@@ -91,16 +442,27 @@ class XtdComment(Comment):
         parent = XtdComment.objects.get(pk=self.parent_id)
         if parent.level == max_thread_level_for_content_type(self.content_type):
             raise MaxThreadLevelExceededException(self)
+        if lock_thread(parent.thread_id, self._state.db):
+            # A concurrent reply may have moved the parent before the lock.
+            parent.refresh_from_db(fields=["order"])
 
         self.thread_id = parent.thread_id
         self.level = parent.level + 1
+        # The path stays empty until the parent's path is initialized, and
+        # in comments nested deeper than PATH_MAX_LEVEL.
+        if parent.path and parent.level < PATH_MAX_LEVEL:
+            self.path = PATH_SEPARATOR.join(
+                [parent.path, get_path_segment(self.id)]
+            )
         qc_eq_thread = XtdComment.norel_objects.filter(
             thread_id=parent.thread_id
         )
         qc_ge_level = qc_eq_thread.filter(
             level__lte=parent.level, order__gt=parent.order
         )
-        if qc_ge_level.count():
+        if settings.COMMENTS_XTD_ORDER_GAP > 1:
+            self.order = get_sparse_order(qc_eq_thread, qc_ge_level)
+        elif qc_ge_level.count():
             min_order = qc_ge_level.aggregate(Min("order"))["order__min"]
             qc_eq_thread.filter(order__gte=min_order).update(
                 order=F("order") + 1
@@ -110,17 +472,9 @@ class XtdComment(Comment):
             max_order = qc_eq_thread.aggregate(Max("order"))["order__max"]
             self.order = max_order + 1
 
-        if self.id != parent.id:
-            parent_ids = []
-            while True:
-                parent_ids.append(parent.pk)
-                if parent.id == parent.parent_id:
-                    break
-                parent = qc_eq_thread.get(pk=parent.parent_id)
-            if parent_ids:
-                qc_eq_thread.filter(pk__in=parent_ids).update(
-                    nested_count=F("nested_count") + 1
-                )
+        qc_eq_thread.filter(get_ancestors_lookup(parent, True)).update(
+            nested_count=F("nested_count") + 1
+        )
 
     def get_reply_url(self):
         return reverse("comments-xtd-reply", kwargs={"cid": self.pk})
@@ -131,7 +485,12 @@ class XtdComment(Comment):
     # ruff: noqa: PLR0915
     @classmethod
     def tree_from_queryset(
-        cls, queryset, with_flagging=False, with_feedback=False, user=None
+        cls,
+        queryset,
+        with_flagging=False,
+        with_feedback=False,
+        user=None,
+        aggregate_flags=False,
     ):
         """Converts a XtdComment queryset into a list of nested dictionaries.
         The queryset has to be ordered by thread_id, order.
@@ -140,6 +499,15 @@ class XtdComment(Comment):
                 'comment': the comment object itself,
                 'children': [list of child comment dictionaries]
             }
+
+        By default the flags of each comment are read from `comment.flags`,
+        which should be prefetched. With `aggregate_flags=True` the queryset
+        is annotated with the number of likes, dislikes and removal
+        suggestions, and only the flags of the given user are fetched. The
+        dictionaries then contain `likedit_count` and `dislikedit_count`
+        instead of the lists `likedit_users` and `dislikedit_users`. A list
+        of comments, already annotated with `annotate_flag_counts`, can be
+        given instead of a queryset.
         """
 
         def get_flags(comment, user):
@@ -180,21 +548,33 @@ class XtdComment(Comment):
 
             return flags_dict
 
-        def add_children(children, obj, user):
-            for item in children:
-                if item["comment"].pk == obj.parent_id:
-                    child_dict = {"comment": obj, "children": []}
-                    child_dict.update(get_flags(obj, user))
-                    item["children"].append(child_dict)
-                    return True
-                elif item["children"]:
-                    if add_children(item["children"], obj, user):
-                        return True
-            return False
+        def get_aggregated_flags(comment, user):
+            flags_dict = {}
+            if with_feedback:
+                flags_dict.update(
+                    {
+                        "likedit": (comment.pk, LIKEDIT_FLAG) in user_flags,
+                        "dislikedit": (comment.pk, DISLIKEDIT_FLAG)
+                        in user_flags,
+                        "likedit_count": comment.likedit_count,
+                        "dislikedit_count": comment.dislikedit_count,
+                    }
+                )
+            if with_flagging:
+                removal = (comment.pk, CommentFlag.SUGGEST_REMOVAL)
+                flagged = [user] if removal in user_flags else []
+                flags_dict.update({"flagged": flagged})
+            if with_flagging and add_flagged_count:
+                flags_dict.update({"flagged_count": comment.flagged_count})
+
+            return flags_dict
 
         def get_comment_dict(obj):
             new_dict = {"comment": obj, "children": []}
-            flags_dict = get_flags(obj, user)
+            if aggregate_flags:
+                flags_dict = get_aggregated_flags(obj, user)
+            else:
+                flags_dict = get_flags(obj, user)
             if len(flags_dict):
                 new_dict.update(flags_dict)
             return new_dict
@@ -204,37 +584,85 @@ class XtdComment(Comment):
         if user.has_perm("django_comments.can_moderate"):
             add_flagged_count = True
 
+        if aggregate_flags:
+            user_flags = cls._get_user_flags(
+                queryset, with_flagging, with_feedback, user
+            )
+            if isinstance(queryset, models.QuerySet):
+                queryset = cls.annotate_flag_counts(
+                    queryset, with_feedback, with_flagging and add_flagged_count
+                )
+
         dic_list = []
-        cur_dict = None
+        # Dictionaries of the comments under the current top-level comment,
+        # by comment pk. The parent of a comment always comes before it.
+        nodes = {}
+        top_level = None
         for obj in queryset:
-            if cur_dict and obj.level == cur_dict["comment"].level:
-                dic_list.append(cur_dict)
-                cur_dict = None
-            if not cur_dict:
-                cur_dict = get_comment_dict(obj)
-                continue
-            if obj.parent_id == cur_dict["comment"].pk:
-                child_dict = get_comment_dict(obj)
-                cur_dict["children"].append(child_dict)
+            if top_level is None or obj.level == top_level:
+                top_level = obj.level
+                nodes = {}
+                siblings = dic_list
+            elif obj.parent_id in nodes:
+                siblings = nodes[obj.parent_id]["children"]
             else:
-                add_children(cur_dict["children"], obj, user)
-        if cur_dict:
-            dic_list.append(cur_dict)
+                continue  # Its parent is not in the tree.
+            nodes[obj.pk] = get_comment_dict(obj)
+            siblings.append(nodes[obj.pk])
 
         return dic_list
 
+    @staticmethod
+    def annotate_flag_counts(
+        queryset, with_feedback=False, with_flagged_count=False
+    ):
+        """Annotate a XtdComment queryset with the counts of flags used by
+        `tree_from_queryset` when called with `aggregate_flags=True`."""
+        counts = {}
+        if with_feedback:
+            counts["likedit_count"] = Count(
+                "flags", filter=Q(flags__flag=LIKEDIT_FLAG)
+            )
+            counts["dislikedit_count"] = Count(
+                "flags", filter=Q(flags__flag=DISLIKEDIT_FLAG)
+            )
+        if with_flagged_count:
+            counts["flagged_count"] = Count(
+                "flags", filter=Q(flags__flag=CommentFlag.SUGGEST_REMOVAL)
+            )
+        if counts:
+            queryset = queryset.annotate(**counts)
+        return queryset
+
+    @staticmethod
+    def _get_user_flags(comments, with_flagging, with_feedback, user):
+        """Return the set of (comment_id, flag) pairs of the flags created
+        by the given user in the given comments."""
+        flags = []
+        if with_feedback:
+            flags.extend([LIKEDIT_FLAG, DISLIKEDIT_FLAG])
+        if with_flagging:
+            flags.append(CommentFlag.SUGGEST_REMOVAL)
+        if not flags or user is None or not user.is_authenticated:
+            return set()
+
+        if isinstance(comments, models.QuerySet):
+            comment_ids = comments.values("pk")
+        else:
+            comment_ids = [comment.pk for comment in comments]
+        return set(
+            CommentFlag.objects.filter(
+                user=user, flag__in=flags, comment__in=comment_ids
+            ).values_list("comment_id", "flag")
+        )
 
-def publish_or_unpublish_nested_comments(comment, are_public=False):
-    qs = get_model().norel_objects.filter(
-        ~Q(pk=comment.id), parent_id=comment.id
+
+def publish_or_unpublish_nested_comments(comment, are_public=False, using=None):
+    # The nested comments are those in the subthread of the comment, so they
+    # are all updated at once, regardless of how deep the subthread is.
+    XtdComment.objects.db_manager(using).subthread(comment).update(
+        is_public=are_public
     )
-    nested = [cm.id for cm in qs]
-    qs.update(is_public=are_public)
-    while len(nested):
-        cm_id = nested.pop()
-        qs = XtdComment.norel_objects.filter(~Q(pk=cm_id), parent_id=cm_id)
-        nested.extend([cm.id for cm in qs])
-        qs.update(is_public=are_public)
     # Update nested_count in parents comments in the same thread.
     # The comment.nested_count doesn't change because the comment's is_public
     # attribute is not changing, only its nested comments change, and it will
@@ -243,17 +671,140 @@ def publish_or_unpublish_nested_comments(comment, are_public=False):
         op = F("nested_count") + comment.nested_count
     else:
         op = F("nested_count") - comment.nested_count
-    XtdComment.norel_objects.filter(
-        thread_id=comment.thread_id,
-        level__lt=comment.level,
-        order__lt=comment.order,
+    XtdComment.norel_objects.using(using).filter(
+        get_ancestors_lookup(comment)
     ).update(nested_count=op)
 
 
-def publish_or_unpublish_on_pre_save(sender, instance, raw, using, **kwargs):
+def publish_or_unpublish_on_pre_save(
+    sender, instance, raw, using, update_fields=None, **kwargs
+):
     if not raw and instance and instance.id:
-        are_public = (not instance.is_removed) and instance.is_public
-        publish_or_unpublish_nested_comments(instance, are_public=are_public)
+        was_visible, is_visible = instance._get_visibility_change(
+            update_fields, using
+        )
+        if was_visible != is_visible:
+            publish_or_unpublish_nested_comments(
+                instance, are_public=is_visible, using=using
+            )
+        invalidate_comment_tree_cache(instance, using=using)
+
+
+def recount_on_post_delete(sender, instance, using, **kwargs):
+    XtdCommentCounter.objects.db_manager(using).recount(instance)
+
+
+# ----------------------------------------------------------------------
+class XtdCommentCounterManager(models.Manager):
+    def _get_lookup(self, content_type_id, object_pk, site_id):
+        return {
+            "content_type_id": content_type_id,
+            "object_pk": str(object_pk),
+            "site_id": site_id,
+        }
+
+    def _count(self, lookup):
+        visible = Q(is_public=True, is_removed=False)
+        return (
+            XtdComment.norel_objects.using(self.db)
+            .filter(**lookup)
+            .aggregate(
+                public_count=Count("pk", filter=visible),
+                thread_count=Count("pk", filter=visible & Q(level=0)),
+                last_submit_date=Max("submit_date", filter=visible),
+            )
+        )
+
+    def add_comment(self, comment):
+        """
+        Add a new visible comment to the counter of the object it belongs
+        to. The counter is created, counting the comments of the object,
+        when it doesn't exist yet.
+        """
+        lookup = self._get_lookup(
+            comment.content_type_id, comment.object_pk, comment.site_id
+        )
+        submit_date = Value(comment.submit_date)
+        updated = self.filter(**lookup).update(
+            public_count=F("public_count") + 1,
+            thread_count=F("thread_count") + int(comment.level == 0),
+            last_submit_date=Greatest(
+                Coalesce("last_submit_date", submit_date), submit_date
+            ),
+        )
+        if not updated:
+            self.update_or_create(**lookup, defaults=self._count(lookup))
+
+    def recount(self, comment):
+        """Count again the comments of the object a comment belongs to."""
+        lookup = self._get_lookup(
+            comment.content_type_id, comment.object_pk, comment.site_id
+        )
+        self.update_or_create(**lookup, defaults=self._count(lookup))
+
+    def get_for_object(self, obj, site_id=None):
+        """
+        Return the counter of the given object. An unsaved counter with no
+        comments is returned when the object has no visible comments.
+        """
+        return self.for_objects([obj], site_id=site_id)[obj.pk]
+
+    def for_objects(self, objects, site_id=None):
+        """
+        Return a dictionary with the counters of the given objects, by
+        object pk, fetched with a single query. The objects have to be of
+        the same model.
+        """
+        if not objects:
+            return {}
+        if site_id is None:
+            site_id = get_current_site_id()
+        content_type = ContentType.objects.get_for_model(objects[0])
+        object_pks = {str(obj.pk): obj.pk for obj in objects}
+        counters = self.filter(
+            content_type=content_type,
+            object_pk__in=object_pks,
+            site_id=site_id,
+        )
+        result = {
+            pk: XtdCommentCounter(
+                content_type=content_type, object_pk=str(pk), site_id=site_id
+            )
+            for pk in object_pks.values()
+        }
+        for counter in counters:
+            result[object_pks[counter.object_pk]] = counter
+        return result
+
+
+class XtdCommentCounter(models.Model):
+    """
+    The number of visible comments of an object, maintained as comments are
+    created, published, unpublished or deleted. Comments created or updated
+    in bulk, or with SQL, are counted again with the management command
+    'rebuild_comment_counters'.
+    """
+
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_pk = models.CharField(max_length=64)
+    site = models.ForeignKey(Site, on_delete=models.CASCADE)
+    public_count = models.PositiveIntegerField(default=0)
+    thread_count = models.PositiveIntegerField(default=0)
+    last_submit_date = models.DateTimeField(null=True, blank=True)
+    objects = XtdCommentCounterManager()
+
+    def __str__(self):
+        return f"{self.content_type_id}:{self.object_pk} ({self.public_count})"
+
+    class Meta:
+        verbose_name = _("comment counter")
+        verbose_name_plural = _("comment counters")
+        constraints = (
+            models.UniqueConstraint(
+                fields=("content_type", "object_pk", "site"),
+                name="unique_xtdcommentcounter_object",
+            ),
+        )
 
 
 # ----------------------------------------------------------------------
@@ -297,16 +848,22 @@ class TmpXtdComment(dict):
             app, model = self.content_type.natural_key()
             return signing.dumps(f"{app}.{model}:{self.object_pk}")
 
+    def __missing__(self, key):
+        # The content_object is not pickled, fetch it on first access.
+        if key == "content_object" and "content_type" in self:
+            content_object = self["content_type"].get_object_for_this_type(
+                pk=self["object_pk"]
+            )
+            self["content_object"] = content_object
+            return content_object
+        raise KeyError(key)
+
     def __setstate__(self, state):
         ct_key = state.pop("content_type_key")
+        # get_by_natural_key caches the content types, so that unpickling
+        # doesn't hit the database once a content type has been loaded.
         ctype = ContentType.objects.get_by_natural_key(*ct_key)
-        self.update(
-            state,
-            content_type=ctype,
-            content_object=ctype.get_object_for_this_type(
-                pk=state["object_pk"]
-            ),
-        )
+        self.update(state, content_type=ctype)
 
     def __reduce__(self):
         state = {k: v for k, v in self.items() if k != "content_object"}
@@ -334,3 +891,42 @@ class BlackListedDomain(models.Model):
 
     class Meta:
         ordering = ("domain",)
+
+
+# ----------------------------------------------------------------------
+class OutboxEmail(models.Model):
+    """
+    An email waiting to be sent by the management command
+    'process_comment_outbox'. Emails are queued here instead of being sent
+    when the setting COMMENTS_XTD_OUTBOX is True.
+    """
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html = models.TextField(blank=True, default="")
+    from_email = models.CharField(max_length=254)
+    recipient_list = models.JSONField(default=list)
+    created = models.DateTimeField(default=timezone.now)
+    send_after = models.DateTimeField(default=timezone.now, db_index=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True, default="")
+
+    def __str__(self):
+        return f"{self.subject} ({', '.join(self.recipient_list)})"
+
+    class Meta:
+        ordering = ("send_after", "id")
+        verbose_name = _("outbox email")
+        verbose_name_plural = _("outbox emails")
+
+    def to_message(self, connection=None):
+        msg = EmailMultiAlternatives(
+            self.subject,
+            self.body,
+            self.from_email,
+            self.recipient_list,
+            connection=connection,
+        )
+        if self.html:
+            msg.attach_alternative(self.html, "text/html")
+        return msg
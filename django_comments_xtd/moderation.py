@@ -5,8 +5,9 @@ from django_comments.models import CommentFlag
 from django_comments.moderation import CommentModerator, Moderator
 from django_comments.signals import comment_was_flagged, comment_will_be_posted
 
+from django_comments_xtd.blacklist import get_blacklist_matcher
 from django_comments_xtd.conf import settings
-from django_comments_xtd.models import BlackListedDomain, TmpXtdComment
+from django_comments_xtd.models import TmpXtdComment
 from django_comments_xtd.signals import confirmation_received
 from django_comments_xtd.utils import send_mail
 
@@ -58,7 +59,7 @@ class XtdCommentModerator(CommentModerator):
             "request": request,
         }
         subject = (
-            f'[{c["current_site"].name}] Comment removal '
+            f"[{c['current_site'].name}] Comment removal "
             f'suggestion on "{content_object}"'
         )
         message = t.render(c)
@@ -90,6 +91,10 @@ class SpamModerator(XtdCommentModerator):
     ``SpamModerator`` uses the additional ``django_comments_xtd`` model:
      * ``BlackListedDomain``
 
+    Subdomains of blacklisted domains are discarded too. The domains are
+    loaded in memory, and reloaded when the model changes or every
+    ``COMMENTS_XTD_BLACKLIST_TTL`` seconds.
+
     Remember to update the content regularly through an external Spam
     filtering service.
     """
@@ -100,7 +105,7 @@ class SpamModerator(XtdCommentModerator):
         except IndexError:
             return False
         else:
-            if BlackListedDomain.objects.filter(domain=domain).count():
+            if get_blacklist_matcher().matches(domain):
                 return False
             return super().allow(comment, content_object, request)
 
@@ -35,15 +35,49 @@ start of the base64 pickle.
 
 There are 65 url-safe characters: the 64 used by url-safe base64 and the '.'.
 These functions make use of all of them.
+
+Comments are signed with dumps_comment() instead, in the version 2 format:
+'v2:' followed by a django.core.signing value of a JSON object, that maps
+the fields of the comment to short keys, signed with HMAC-SHA256. As keys
+in the pickle format never contain ':', loads() accepts both formats. The
+pickle format is accepted as long as COMMENTS_XTD_ACCEPT_PICKLED_KEYS is True.
 """
 
 import base64
 import hashlib
 import hmac
+import json
 import pickle
+from datetime import datetime
 
+from django.contrib.contenttypes.models import ContentType
+from django.core import signing
+from django.core.serializers.json import DjangoJSONEncoder
 
 from django_comments_xtd.conf import settings
+from django_comments_xtd.models import TmpXtdComment
+
+V2_PREFIX = "v2:"
+V2_SALT = "django_comments_xtd.signed.v2"
+
+# Short keys of the fields of the comments in the version 2 format.
+V2_FIELD_KEYS = {
+    "object_pk": "o",
+    "site_id": "s",
+    "user_name": "n",
+    "user_email": "e",
+    "user_url": "u",
+    "comment": "c",
+    "ip_address": "i",
+    "is_public": "p",
+    "is_removed": "r",
+    "thread_id": "t",
+    "parent_id": "a",
+    "level": "l",
+    "order": "w",
+    "followup": "f",
+}
+V2_FIELD_NAMES = {v: k for k, v in V2_FIELD_KEYS.items()}
 
 
 def dumps(obj, key=None, compress=False, extra_key=b""):
@@ -75,10 +109,96 @@ def dumps(obj, key=None, compress=False, extra_key=b""):
     )
 
 
+def _get_v2_signer(key, extra_key):
+    return signing.Signer(
+        key=(key or settings.SECRET_KEY.encode("ascii")) + extra_key,
+        salt=V2_SALT,
+        algorithm="sha256",
+    )
+
+
+def _comment_to_v2(comment):
+    data = {}
+    for name, value in comment.items():
+        if name == "content_object":
+            continue
+        elif name == "content_type":
+            data["ct"] = ".".join(value.natural_key())
+        elif name == "submit_date":
+            data["d"] = value.isoformat()
+        elif name in V2_FIELD_KEYS:
+            data[V2_FIELD_KEYS[name]] = value
+        else:
+            data.setdefault("x", {})[name] = value
+    return data
+
+
+def _v2_to_comment(data):
+    comment = TmpXtdComment()
+    for short_key, value in data.items():
+        if short_key == "ct":
+            comment["content_type"] = ContentType.objects.get_by_natural_key(
+                *value.split(".", 1)
+            )
+        elif short_key == "d":
+            comment["submit_date"] = datetime.fromisoformat(value)
+        elif short_key == "x":
+            comment.update(value)
+        else:
+            comment[V2_FIELD_NAMES[short_key]] = value
+    return comment
+
+
+class DjangoJSONSerializer(signing.JSONSerializer):
+    """Serializes the dates, decimals and UUIDs that JSON can't encode."""
+
+    def dumps(self, obj):
+        return json.dumps(
+            obj, separators=(",", ":"), cls=DjangoJSONEncoder
+        ).encode("latin-1")
+
+
+def dumps_comment(comment, key=None, extra_key=b""):
+    """
+    Returns a URL-safe, HMAC-SHA256 signed, version 2 value of a
+    TmpXtdComment. Falls back to dumps() if the comment has values that
+    can't be serialized to JSON, unless COMMENTS_XTD_ACCEPT_PICKLED_KEYS
+    is False. The values are then serialized with DjangoJSONEncoder, and
+    loaded as their JSON representation (e.g. a Decimal as a string).
+    Raises TypeError if they can't be serialized either.
+    """
+    signer = _get_v2_signer(key, extra_key)
+    data = _comment_to_v2(comment)
+    try:
+        value = signer.sign_object(data, compress=True)
+    except TypeError:
+        if settings.COMMENTS_XTD_ACCEPT_PICKLED_KEYS:
+            return dumps(comment, key=key, compress=True, extra_key=extra_key)
+        # loads() would reject the pickled value.
+        value = signer.sign_object(
+            data, serializer=DjangoJSONSerializer, compress=True
+        )
+    return (V2_PREFIX + value).encode("ascii")
+
+
 def loads(s, key=None, extra_key=b""):
-    """Reverse of dumps(), raises ValueError if signature fails"""
-    if isinstance(s, str):
-        s = s.encode("utf8")  # base64 works on bytestrings
+    """Reverse of dumps() and dumps_comment(), raises ValueError if
+    signature fails"""
+    if isinstance(s, bytes):
+        s = s.decode("utf8", errors="replace")
+    if s.startswith(V2_PREFIX):
+        try:
+            data = _get_v2_signer(key, extra_key).unsign_object(
+                s[len(V2_PREFIX) :]
+            )
+            return _v2_to_comment(data)
+        except signing.BadSignature as exc:
+            raise BadSignature(str(exc)) from exc
+        except (KeyError, AttributeError, json.JSONDecodeError) as exc:
+            raise BadSignature("Malformed value.") from exc
+    if not settings.COMMENTS_XTD_ACCEPT_PICKLED_KEYS:
+        raise BadSignature("Pickled values are not accepted.")
+    s = s.encode("utf8")  # base64 works on bytestrings
     try:
         base64d = unsign(
             s, (key or settings.SECRET_KEY.encode("ascii")) + extra_key
@@ -8,12 +8,25 @@ from django.db.models import Prefetch
 from django.template import Library, Node, TemplateSyntaxError, Variable, loader
 from django.urls import reverse
 from django.utils.safestring import mark_safe
+from django.utils.timezone import get_current_timezone_name
+from django.utils.translation import get_language
 from django_comments.models import CommentFlag
 
 from django_comments_xtd import get_model as get_comment_model
-from django_comments_xtd.models import DISLIKEDIT_FLAG, LIKEDIT_FLAG
+from django_comments_xtd.cache import (
+    get_comment_count,
+    get_tree_cache,
+    get_tree_cache_key,
+)
+from django_comments_xtd.conf import settings
+from django_comments_xtd.models import (
+    DISLIKEDIT_FLAG,
+    LIKEDIT_FLAG,
+    XtdCommentCounter,
+)
 from django_comments_xtd.utils import (
     get_app_model_options,
+    get_content_type,
     get_current_site_id,
     get_html_id_suffix,
 )
@@ -31,12 +44,12 @@ class XtdCommentCountNode(Node):
     def __init__(self, as_varname, content_types):
         """Class method to parse get_xtdcomment_list and return a Node."""
         self.as_varname = as_varname
-        self.qs = XtdComment.objects.for_content_types(content_types)
+        self.content_types = content_types
 
     def render(self, context):
-        context[self.as_varname] = self.qs.filter(
-            site=get_current_site_id(context.get("request"))
-        ).count()
+        context[self.as_varname] = get_comment_count(
+            self.content_types, get_current_site_id(context.get("request"))
+        )
         return ""
 
 
@@ -74,6 +87,56 @@ def get_xtdcomment_count(parser, token):
     return XtdCommentCountNode(as_varname, content_types)
 
 
+# ----------------------------------------------------------------------
+class XtdCommentCountsNode(Node):
+    """Store the objects of a list along with their number of XtdComments"""
+
+    def __init__(self, objects, as_varname):
+        self.objects = Variable(objects)
+        self.as_varname = as_varname
+
+    def render(self, context):
+        objects = list(self.objects.resolve(context))
+        counts = XtdComment.objects.counts_for(
+            objects, site=get_current_site_id(context.get("request"))
+        )
+        context[self.as_varname] = [(obj, counts[obj.pk]) for obj in objects]
+        return ""
+
+
+@register.tag
+def get_xtdcomment_counts(parser, token):
+    """
+    Gets the number of comments of each object of a list of objects of the
+    same model, counted with a single query, and populates the template
+    context with a list of (object, count) pairs, whose name is defined by
+    the 'as' clause.
+
+    Syntax::
+
+        {% get_xtdcomment_counts for objects as var %}
+
+    Example usage::
+
+        {% get_xtdcomment_counts for object_list as article_counts %}
+        {% for article, count in article_counts %}...{% endfor %}
+
+    """
+    tokens = token.contents.split()
+
+    if tokens[1] != "for":
+        raise TemplateSyntaxError(
+            f"2nd. argument in {tokens[0]!r} tag must be 'for'"
+        )
+
+    if tokens[3] != "as":
+        raise TemplateSyntaxError(
+            f"4th. argument in {tokens[0]!r} tag must be 'as'"
+        )
+
+    return XtdCommentCountsNode(tokens[2], tokens[4])
+
+
 # ----------------------------------------------------------------------
 class WhoCanPostNode(Node):
     """Stores the who_can_post value from COMMENTS_XTD_APP_MODEL_OPTION"""
@@ -117,7 +180,7 @@ def get_who_can_post(parser, token):
             f"4th. argument in {tokens[0]!r} tag must be 'as'"
         )
 
-    content_type = _get_content_types(tokens[0], [tokens[2]])
+    content_type = _get_content_types(tokens[0], [tokens[2]])[0]
     as_varname = tokens[4]
     return WhoCanPostNode(content_type, as_varname)
 
@@ -136,48 +199,67 @@ class BaseLastXtdCommentsNode(Node):
         self.content_types = content_types
         self.template_path = template_path
 
+    def get_queryset(self, context):
+        """
+        Return the last N XtdComments. The queryset is shared, through the
+        render context, with the other nodes of the template that get the
+        same comments, so that they are fetched only once.
+        """
+        count = self.count
+        if not isinstance(count, int):
+            count = int(count.resolve(context))
+        site_id = get_current_site_id(context.get("request"))
+        key = (
+            "last_xtdcomments",
+            tuple(ct.pk for ct in self.content_types),
+            site_id,
+            count,
+        )
+        qs = context.render_context.get(key)
+        if qs is None:
+            qs = XtdComment.objects.for_content_types(
+                self.content_types, site=site_id
+            ).order_by("submit_date")[:count]
+            context.render_context[key] = qs
+        return qs
+
 
 class RenderLastXtdCommentsNode(BaseLastXtdCommentsNode):
-    qs = None
+    def get_template(self, engine, content_type):
+        if self.template_path:
+            return engine.get_template(self.template_path)
+        return engine.select_template(
+            [
+                f"django_comments_xtd/{content_type.app_label}/{content_type.model}/comment.html",
+                f"django_comments_xtd/{content_type.app_label}/comment.html",
+                "django_comments_xtd/comment.html",
+            ]
+        )
 
     def render(self, context):
-        if not isinstance(self.count, int):
-            self.count = int(self.count.resolve(context))
-
-        self.qs = XtdComment.objects.for_content_types(
-            self.content_types, site=get_current_site_id(context.get("request"))
-        ).order_by("submit_date")[: self.count]
-
         strlist = []
-        context_dict = context.flatten()
-        for xtd_comment in self.qs:
-            if self.template_path:
-                template_arg = self.template_path
-            else:
-                template_arg = [
-                    f"django_comments_xtd/{xtd_comment.content_type.app_label}/{xtd_comment.content_type.model}/comment.html",
-                    f"django_comments_xtd/{xtd_comment.content_type.app_label}/comment.html",
-                    "django_comments_xtd/comment.html",
-                ]
-            context_dict["comment"] = xtd_comment
-            strlist.append(loader.render_to_string(template_arg, context_dict))
+        # Templates are looked up once per content type, with the engine of
+        # the template being rendered, as the include tag does.
+        engine = context.template.engine
+        templates = {}
+        for xtd_comment in self.get_queryset(context):
+            content_type = xtd_comment.content_type
+            if content_type.pk not in templates:
+                templates[content_type.pk] = self.get_template(
+                    engine, content_type
+                )
+            with context.push(comment=xtd_comment):
+                strlist.append(templates[content_type.pk].render(context))
         return "".join(strlist)
 
 
 class GetLastXtdCommentsNode(BaseLastXtdCommentsNode):
-    qs = None
-
     def __init__(self, count, as_varname, content_types):
         super().__init__(count, content_types)
         self.as_varname = as_varname
 
     def render(self, context):
-        if not isinstance(self.count, int):
-            self.count = int(self.count.resolve(context))
-        self.qs = XtdComment.objects.for_content_types(
-            self.content_types, site=get_current_site_id(context.get("request"))
-        ).order_by("submit_date")[: self.count]
-        context[self.as_varname] = self.qs
+        context[self.as_varname] = self.get_queryset(context)
         return ""
 
 
@@ -185,17 +267,14 @@ def _get_content_types(tagname, tokens):
     content_types = []
     try:
         for token in tokens:
-            app, model = token.split(".")
-            content_types.append(
-                ContentType.objects.get(app_label=app, model=model)
-            )
+            content_types.append(get_content_type(token))
     except ValueError as exc:
         raise TemplateSyntaxError(
             f"Argument {token} in {tagname!r} must be in the format 'app.model'"
         ) from exc
     except ContentType.DoesNotExist as exc:
         raise TemplateSyntaxError(
-            f"ContentType '{app}.{model}' used for tag {tagname!r} doesn't exist"
+            f"ContentType '{token}' used for tag {tagname!r} doesn't exist"
         ) from exc
     return content_types
 
@@ -284,6 +363,19 @@ def get_last_xtdcomments(parser, token):
 
 
 # ----------------------------------------------------------------------
+def get_flags_prefetch():
+    """Prefetch of the flags, with their users, read by
+    `XtdComment.tree_from_queryset` when the flags are not aggregated."""
+    flags_qs = CommentFlag.objects.filter(
+        flag__in=[
+            CommentFlag.SUGGEST_REMOVAL,
+            LIKEDIT_FLAG,
+            DISLIKEDIT_FLAG,
+        ]
+    ).prefetch_related("user")
+    return Prefetch("flags", queryset=flags_qs)
+
+
 class RenderXtdCommentTreeNode(Node):
     def __init__(  # noqa: PLR0913
         self,
@@ -307,36 +399,98 @@ class RenderXtdCommentTreeNode(Node):
             cvars.append((vname, Variable(vobj)))
         return cvars
 
+    def get_template_names(self, content_type):
+        if self.template_path:
+            return self.template_path
+        return [
+            "django_comments_xtd/{content_type.app_label}/{content_type.model}/comment_tree.html",
+            "django_comments_xtd/{content_type.app_label}/comment_tree.html",
+            "django_comments_xtd/comment_tree.html",
+        ]
+
+    def get_comments(self, obj, content_type, site_id, context_dict, user):
+        queryset = XtdComment.objects.filter(
+            content_type=content_type,
+            object_pk=obj.pk,
+            site__pk=site_id,
+            is_public=True,
+        )
+        # The lists of users who liked/disliked each comment are only
+        # displayed with show_feedback. Otherwise aggregate the flags.
+        show_feedback = context_dict["show_feedback"]
+        if show_feedback:
+            queryset = queryset.prefetch_related(get_flags_prefetch())
+        elif settings.COMMENTS_XTD_CACHE_TREES:
+            # Cache the comments with their flag counts, shared by all the
+            # users. The flags of the user are fetched by tree_from_queryset.
+            cache = get_tree_cache()
+            key = get_tree_cache_key(
+                content_type.pk,
+                obj.pk,
+                site_id,
+                "comments",
+                self.allow_feedback,
+                self.allow_flagging,
+            )
+            comments = cache.get(key)
+            if comments is None:
+                comments = list(
+                    XtdComment.annotate_flag_counts(
+                        queryset,
+                        with_feedback=self.allow_feedback,
+                        with_flagged_count=self.allow_flagging,
+                    )
+                )
+                cache.set(key, comments, settings.COMMENTS_XTD_CACHE_TIMEOUT)
+            queryset = comments
+        return XtdComment.tree_from_queryset(
+            queryset,
+            with_flagging=self.allow_flagging,
+            with_feedback=self.allow_feedback,
+            user=user,
+            aggregate_flags=not show_feedback,
+        )
+
     def render(self, context):
         context_dict = context.flatten()
         for attr in ["allow_flagging", "allow_feedback", "show_feedback"]:
             context_dict[attr] = getattr(self, attr, False) or context.get(
                 attr, False
             )
+        html_cache_key = None
         if self.obj:
             obj = self.obj.resolve(context)
             content_type = ContentType.objects.get_for_model(obj)
-            flags_qs = CommentFlag.objects.filter(
-                flag__in=[
-                    CommentFlag.SUGGEST_REMOVAL,
-                    LIKEDIT_FLAG,
-                    DISLIKEDIT_FLAG,
-                ]
-            ).prefetch_related("user")
-            prefetch = Prefetch("flags", queryset=flags_qs)
-            queryset = XtdComment.objects.prefetch_related(prefetch).filter(
-                content_type=content_type,
-                object_pk=obj.pk,
-                site__pk=get_current_site_id(context.get("request")),
-                is_public=True,
-            )
-            comments = XtdComment.tree_from_queryset(
-                queryset,
-                with_flagging=self.allow_flagging,
-                with_feedback=self.allow_feedback,
-                user=context["user"],
+            site_id = get_current_site_id(context.get("request"))
+            user = context["user"]
+            template_arg = self.get_template_names(content_type)
+            # Without an authenticated user the HTML doesn't depend on who
+            # is reading it, and can be cached as a whole.
+            if (
+                settings.COMMENTS_XTD_CACHE_TREES
+                and not self.cvars
+                and not context_dict["show_feedback"]
+                and not user.is_authenticated
+            ):
+                html_cache_key = get_tree_cache_key(
+                    content_type.pk,
+                    obj.pk,
+                    site_id,
+                    "html",
+                    template_arg,
+                    context_dict["allow_feedback"],
+                    context_dict["allow_flagging"],
+                    self.allow_feedback,
+                    self.allow_flagging,
+                    get_language(),
+                    get_current_timezone_name(),
+                )
+                html = get_tree_cache().get(html_cache_key)
+                if html is not None:
+                    return html
+            context_dict["comments"] = self.get_comments(
+                obj, content_type, site_id, context_dict, user
             )
-            context_dict["comments"] = comments
         if self.cvars:
             for vname, vobj in self.cvars:
                 context_dict[vname] = vobj.resolve(context)
@@ -358,16 +512,13 @@ class RenderXtdCommentTreeNode(Node):
                 return ""
 
             content_type = comments[0]["comment"].content_type
+            template_arg = self.get_template_names(content_type)
 
-        if self.template_path:
-            template_arg = self.template_path
-        else:
-            template_arg = [
-                "django_comments_xtd/{content_type.app_label}/{content_type.model}/comment_tree.html",
-                "django_comments_xtd/{content_type.app_label}/comment_tree.html",
-                "django_comments_xtd/comment_tree.html",
-            ]
         html = loader.render_to_string(template_arg, context_dict)
+        if html_cache_key:
+            get_tree_cache().set(
+                html_cache_key, html, settings.COMMENTS_XTD_CACHE_TIMEOUT
+            )
         return html
 
 
@@ -380,22 +531,19 @@ class GetXtdCommentTreeNode(Node):
     def render(self, context):
         obj = self.obj.resolve(context)
         content_type = ContentType.objects.get_for_model(obj)
-        flags_qs = CommentFlag.objects.filter(
-            flag__in=[
-                CommentFlag.SUGGEST_REMOVAL,
-                LIKEDIT_FLAG,
-                DISLIKEDIT_FLAG,
-            ]
-        ).prefetch_related("user")
-        prefetch = Prefetch("flags", queryset=flags_qs)
-        queryset = XtdComment.objects.prefetch_related(prefetch).filter(
+        queryset = XtdComment.objects.filter(
             content_type=content_type,
             object_pk=obj.pk,
             site__pk=get_current_site_id(context.get("request")),
             is_public=True,
         )
+        if self.with_feedback:
+            queryset = queryset.prefetch_related(get_flags_prefetch())
         dic_list = XtdComment.tree_from_queryset(
-            queryset, with_feedback=self.with_feedback, user=context["user"]
+            queryset,
+            with_feedback=self.with_feedback,
+            user=context["user"],
+            aggregate_flags=not self.with_feedback,
         )
         context[self.var_name] = dic_list
         return ""
@@ -564,6 +712,20 @@ def comments_xtd_api_list_url(obj):
     )
 
 
+# ----------------------------------------------------------------------
+@register.filter
+def xtd_comment_count(obj):
+    """
+    Return the number of visible comments of an object, read from its
+    XtdCommentCounter.
+
+    Example usage::
+
+        {{ article|xtd_comment_count }} comments
+    """
+    return XtdCommentCounter.objects.get_for_object(obj).public_count
+
+
 # ----------------------------------------------------------------------
 @register.filter
 def has_permission(user_obj, str_permission):
@@ -577,8 +739,7 @@ def has_permission(user_obj, str_permission):
 @register.filter
 def can_receive_comments_from(obj, user):
     ct = ContentType.objects.get_for_model(obj)
-    app_label = f"{ct.app_label}.{ct.model}"
-    options = get_app_model_options(content_type=app_label)
+    options = get_app_model_options(content_type=ct)
     who_can_post = options["who_can_post"]
     return who_can_post == "all" or (
         who_can_post == "users" and user.is_authenticated
@@ -0,0 +1,170 @@
+from unittest.mock import patch
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.sites.models import Site
+from django.template import Context, Template
+from django.test import RequestFactory
+from django.test import TestCase as DjangoTestCase
+from django_comments.models import CommentFlag
+
+from django_comments_xtd.cache import get_tree_cache
+from django_comments_xtd.models import LIKEDIT_FLAG, XtdComment
+from django_comments_xtd.signals import confirmation_received
+from django_comments_xtd.tests.models import Article
+from django_comments_xtd.tests.test_models import (
+    thread_test_step_1,
+    thread_test_step_2,
+    thread_test_step_3,
+)
+
+tree_tag = (
+    "{% load comments_xtd %}"
+    "{% render_xtdcomment_tree for object allow_feedback allow_flagging %}"
+)
+
+
+@patch.multiple(
+    "django_comments_xtd.conf.settings", COMMENTS_XTD_CACHE_TREES=True
+)
+class RenderXtdCommentTreeCacheTestCase(DjangoTestCase):
+    def setUp(self):
+        get_tree_cache().clear()
+        self.article = Article.objects.create(
+            title="September", slug="september", body="During September..."
+        )
+        thread_test_step_1(self.article)
+        thread_test_step_2(self.article)
+
+    def tearDown(self):
+        get_tree_cache().clear()
+
+    def render(self, user=None):
+        user = user or AnonymousUser()
+        request = RequestFactory().get("/")
+        request.user = user
+        context = {"object": self.article, "user": user, "request": request}
+        return Template(tree_tag).render(Context(context))
+
+    def test_html_is_cached_for_anonymous_users(self):
+        output = self.render()
+        self.assertEqual(output.count('<div id="c'), 4)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.render(), output)
+
+    def test_comments_are_cached_for_authenticated_users(self):
+        user = User.objects.create_user("bob", "bob@example.com", "pwd")
+        CommentFlag.objects.create(comment_id=1, user=user, flag=LIKEDIT_FLAG)
+        output = self.render(user)
+        self.assertEqual(output.count("bi-hand-thumbs-up-fill"), 1)
+        # Only the flags of the user are fetched.
+        with self.assertNumQueries(1):
+            self.assertEqual(self.render(user), output)
+        # Other users get the comments from the cache too.
+        alice = User.objects.create_user("alice", "alice@example.com", "pwd")
+        output = self.render(alice)
+        self.assertEqual(output.count('<div id="c'), 4)
+        self.assertNotIn("bi-hand-thumbs-up-fill", output)
+
+    def test_posting_a_comment_invalidates_the_cache(self):
+        self.render()
+        with self.captureOnCommitCallbacks(execute=True):
+            thread_test_step_3(self.article)
+        self.assertEqual(self.render().count('<div id="c'), 5)
+
+    def test_flagging_a_comment_invalidates_the_cache(self):
+        user = User.objects.create_user("bob", "bob@example.com", "pwd")
+        self.render(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            CommentFlag.objects.create(
+                comment_id=1, user=user, flag=CommentFlag.SUGGEST_REMOVAL
+            )
+        with self.assertNumQueries(2):  # Comments and user's flags.
+            self.assertIn("comment flagged", self.render(user))
+
+    def test_unpublishing_a_comment_invalidates_the_cache(self):
+        self.render()
+        comment = XtdComment.objects.get(pk=1)
+        comment.is_public = False
+        with self.captureOnCommitCallbacks(execute=True):
+            comment.save()
+        output = self.render()
+        self.assertEqual(output.count('<div id="c'), 1)
+        self.assertIn('<div id="c2"', output)
+
+    def test_confirmation_received_invalidates_the_cache(self):
+        output = self.render()
+        # Change the comment with a query, that doesn't send signals.
+        XtdComment.objects.filter(pk=2).update(comment="Changed comment")
+        self.assertEqual(self.render(), output)
+        with self.captureOnCommitCallbacks(execute=True):
+            confirmation_received.send(
+                sender=XtdComment,
+                comment=XtdComment.objects.get(pk=2),
+                request=None,
+            )
+        self.assertIn("Changed comment", self.render())
+
+    def test_show_feedback_is_not_cached(self):
+        t = (
+            "{% load comments_xtd %}"
+            "{% render_xtdcomment_tree for object allow_feedback "
+            "show_feedback %}"
+        )
+        context = Context({"object": self.article, "user": AnonymousUser()})
+        Template(t).render(context)
+        with self.assertNumQueries(2):  # Comments and prefetched flags.
+            Template(t).render(context)
+
+
+count_tag = (
+    "{% load comments_xtd %}"
+    "{% get_xtdcomment_count as varname for tests.article tests.diary %}"
+    "{{ varname }}"
+)
+
+
+@patch.multiple(
+    "django_comments_xtd.conf.settings", COMMENTS_XTD_CACHE_COUNTS=True
+)
+class GetXtdCommentCountCacheTestCase(DjangoTestCase):
+    def setUp(self):
+        get_tree_cache().clear()
+        self.article = Article.objects.create(
+            title="September", slug="september", body="During September..."
+        )
+        thread_test_step_1(self.article)
+        self.template = Template(count_tag)
+        Site.objects.get_current()  # Load the sites cache.
+
+    def tearDown(self):
+        get_tree_cache().clear()
+
+    def render(self):
+        return self.template.render(Context())
+
+    def test_counts_are_cached(self):
+        # Both content types are counted with one query.
+        with self.assertNumQueries(1):
+            self.assertEqual(self.render(), "2")
+        with self.assertNumQueries(0):
+            self.assertEqual(self.render(), "2")
+
+    def test_counts_are_updated_when_comments_are_created(self):
+        self.render()
+        with self.captureOnCommitCallbacks(execute=True):
+            thread_test_step_2(self.article)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.render(), "4")
+
+    def test_counts_are_updated_when_comments_are_deleted(self):
+        self.render()
+        with self.captureOnCommitCallbacks(execute=True):
+            XtdComment.objects.get(pk=2).delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.render(), "1")
+
+    def test_counts_are_not_updated_before_commit(self):
+        self.render()
+        with self.captureOnCommitCallbacks(execute=False):
+            thread_test_step_2(self.article)
+        self.assertEqual(self.render(), "2")
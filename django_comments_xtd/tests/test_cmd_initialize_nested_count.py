@@ -5,6 +5,9 @@ from django.core.management import call_command
 from django.test import TestCase
 from django.utils.connection import ConnectionDoesNotExist
 
+from django_comments_xtd.management.commands.initialize_nested_count import (
+    get_thread_ranges,
+)
 from django_comments_xtd.models import XtdComment
 from django_comments_xtd.tests.models import Article
 from django_comments_xtd.tests.test_models import (
@@ -65,6 +68,29 @@ class InitializeNestedCountCmdTest(TestCase):
         self.assertIn("Updated 9 XtdComment object(s).", out.getvalue())
         self.check_nested_count()
 
+    def test_calling_command_with_small_batches(self):
+        XtdComment.norel_objects.update(nested_count=0)
+        out = StringIO()
+        call_command(
+            "initialize_nested_count",
+            "--threads-per-batch=2",
+            "--chunk-size=1",
+            "--threads=2",
+            stdout=out,
+        )
+        self.assertIn(
+            "Processed 8 of 9 XtdComment object(s) (88%).", out.getvalue()
+        )
+        self.assertIn("Updated 9 XtdComment object(s).", out.getvalue())
+        self.check_nested_count()
+
+    def test_get_thread_ranges(self):
+        qs = XtdComment.norel_objects.all()
+        self.assertEqual(get_thread_ranges(qs, 1), [(1, 9)])
+        self.assertEqual(get_thread_ranges(qs, 2), [(1, 5), (6, 9)])
+        self.assertEqual(get_thread_ranges(qs, 4), [(1, 3), (4, 6), (7, 9)])
+        self.assertEqual(get_thread_ranges(qs.none(), 2), [])
+
     def test_command_skips_failed_database(self):
         out = StringIO()
         method_ref = (
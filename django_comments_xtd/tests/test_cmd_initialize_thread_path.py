@@ -0,0 +1,68 @@
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils.connection import ConnectionDoesNotExist
+
+from django_comments_xtd.models import XtdComment
+from django_comments_xtd.tests.models import Article
+from django_comments_xtd.tests.test_models import (
+    step_6_tree_order,
+    thread_test_step_1,
+    thread_test_step_2,
+    thread_test_step_3,
+    thread_test_step_4,
+    thread_test_step_5,
+    thread_test_step_6,
+)
+
+
+class InitializeThreadPathCmdTest(TestCase):
+    def setUp(self):
+        self.article_1 = Article.objects.create(
+            title="September", slug="september", body="During September..."
+        )
+        thread_test_step_1(self.article_1)
+        thread_test_step_2(self.article_1)
+        thread_test_step_3(self.article_1)
+        thread_test_step_4(self.article_1)
+        thread_test_step_5(self.article_1)
+        thread_test_step_6(self.article_1)
+        self.paths = dict(XtdComment.objects.values_list("pk", "path"))
+
+    def test_calling_command_computes_path(self):
+        XtdComment.norel_objects.update(path="")
+        out = StringIO()
+        call_command("initialize_thread_path", stdout=out)
+        self.assertIn("Updated 11 XtdComment object(s).", out.getvalue())
+        self.assertEqual(
+            dict(XtdComment.objects.values_list("pk", "path")), self.paths
+        )
+        pks = list(
+            XtdComment.objects.order_by("path").values_list("pk", flat=True)
+        )
+        self.assertEqual(pks, step_6_tree_order)
+
+    def test_command_is_idempotent(self):
+        out = StringIO()
+        call_command("initialize_thread_path", stdout=out)
+        call_command(
+            "initialize_thread_path", "--threads-per-batch=1", stdout=out
+        )
+        self.assertIn("Updated 11 XtdComment object(s).", out.getvalue())
+        self.assertEqual(
+            dict(XtdComment.objects.values_list("pk", "path")), self.paths
+        )
+
+    def test_command_skips_failed_database(self):
+        out = StringIO()
+        method_ref = (
+            "django_comments_xtd.management.commands"
+            ".initialize_thread_path.Command"
+            ".initialize_thread_path"
+        )
+        with patch(method_ref) as mock_initialize_thread_path:
+            mock_initialize_thread_path.side_effect = ConnectionDoesNotExist
+            call_command("initialize_thread_path", stdout=out)
+        self.assertIn("DB connection 'default' does not exist.", out.getvalue())
@@ -0,0 +1,116 @@
+from io import StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils.connection import ConnectionDoesNotExist
+
+from django_comments_xtd import blacklist
+from django_comments_xtd.models import BlackListedDomain
+
+command = "django_comments_xtd.management.commands.load_blacklisted_domains"
+
+domain_list = """\
+# Blacklisted domains.
+spam.example
+Junk.Example.   # Trailing comment.
+
+*.wildcard.example
+spam.example
+"""
+
+
+class LoadBlacklistedDomainsCmdTest(TestCase):
+    def setUp(self):
+        self.addCleanup(blacklist.invalidate_blacklist_matcher)
+        BlackListedDomain.objects.bulk_create(
+            [
+                BlackListedDomain(domain="spam.example"),
+                BlackListedDomain(domain="gone.example"),
+            ]
+        )
+
+    def get_domains(self):
+        return sorted(
+            BlackListedDomain.objects.values_list("domain", flat=True)
+        )
+
+    def test_calling_command_with_stdin(self):
+        out = StringIO()
+        call_command(
+            "load_blacklisted_domains",
+            "-",
+            "--batch-size=1",
+            stdin=StringIO(domain_list),
+            stdout=out,
+        )
+        self.assertIn(
+            "Created 2 and deleted 1 BlackListedDomain object(s).",
+            out.getvalue(),
+        )
+        self.assertEqual(
+            self.get_domains(),
+            ["junk.example", "spam.example", "wildcard.example"],
+        )
+
+    def test_calling_command_with_file_and_no_delete(self):
+        out = StringIO()
+        with TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / "blacklist.txt"
+            path.write_text(domain_list, encoding="utf-8")
+            call_command(
+                "load_blacklisted_domains", str(path), "--no-delete", stdout=out
+            )
+        self.assertIn(
+            "Created 2 and deleted 0 BlackListedDomain object(s).",
+            out.getvalue(),
+        )
+        self.assertEqual(len(self.get_domains()), 4)
+
+    def test_calling_command_twice_changes_nothing(self):
+        for _ in range(2):
+            out = StringIO()
+            call_command(
+                "load_blacklisted_domains",
+                "-",
+                stdin=StringIO(domain_list),
+                stdout=out,
+            )
+        self.assertIn(
+            "Created 0 and deleted 0 BlackListedDomain object(s).",
+            out.getvalue(),
+        )
+
+    def test_matcher_is_reloaded(self):
+        matcher = blacklist.get_blacklist_matcher()
+        self.assertFalse(matcher.matches("mail.junk.example"))
+        call_command(
+            "load_blacklisted_domains",
+            "-",
+            stdin=StringIO(domain_list),
+            stdout=StringIO(),
+        )
+        matcher = blacklist.get_blacklist_matcher()
+        self.assertTrue(matcher.matches("mail.junk.example"))
+        self.assertFalse(matcher.matches("gone.example"))
+
+    def test_calling_command_with_non_existing_connection(self):
+        out = StringIO()
+        with patch(
+            f"{command}.Command.load_blacklisted_domains",
+            side_effect=ConnectionDoesNotExist,
+        ):
+            call_command(
+                "load_blacklisted_domains",
+                "-",
+                "--database=missing",
+                stdin=StringIO(domain_list),
+                stdout=out,
+            )
+        self.assertIn("DB connection 'missing' does not exist.", out.getvalue())
+        self.assertIn(
+            "Created 0 and deleted 0 BlackListedDomain object(s).",
+            out.getvalue(),
+        )
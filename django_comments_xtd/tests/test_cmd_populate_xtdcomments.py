@@ -0,0 +1,108 @@
+from datetime import datetime
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, connection
+from django.db.models.sql import Query
+from django.test import TestCase
+from django.utils.connection import ConnectionDoesNotExist
+from django_comments.models import Comment
+
+from django_comments_xtd.management.commands.populate_xtdcomments import (
+    Command,
+)
+from django_comments_xtd.models import XtdComment
+from django_comments_xtd.tests.models import Article
+
+command = "django_comments_xtd.management.commands.populate_xtdcomments"
+
+
+class PopulateXtdCommentsCmdTest(TestCase):
+    def setUp(self):
+        article = Article.objects.create(
+            title="September", slug="september", body="During September..."
+        )
+        self.comments = [
+            Comment.objects.create(
+                content_type=ContentType.objects.get_for_model(article),
+                object_pk=article.pk,
+                site_id=1,
+                user_name="Bob",
+                user_email="bob@example.com",
+                comment=f"Comment {i}",
+                submit_date=datetime.now(),
+            )
+            for i in range(5)
+        ]
+
+    def test_calling_command_copies_comments_as_thread_roots(self):
+        out = StringIO()
+        call_command("populate_xtdcomments", stdout=out)
+        self.assertIn("Added 5 XtdComment object(s).", out.getvalue())
+        for comment in self.comments:
+            xtd_comment = XtdComment.objects.get(pk=comment.pk)
+            self.assertEqual(xtd_comment.comment, comment.comment)
+            self.assertEqual(xtd_comment.thread_id, comment.pk)
+            self.assertEqual(xtd_comment.parent_id, comment.pk)
+            self.assertEqual(xtd_comment.level, 0)
+            self.assertEqual(xtd_comment.order, 1)
+            self.assertFalse(xtd_comment.followup)
+            self.assertEqual(xtd_comment.nested_count, 0)
+            self.assertEqual(xtd_comment.path, f"{comment.pk:010d}")
+
+    def test_calling_command_skips_existing_comments(self):
+        call_command(
+            "populate_xtdcomments", "--batch-size=2", stdout=StringIO()
+        )
+        # Remove two comments from the xtdcomment table only.
+        for xtd_comment in XtdComment.norel_objects.filter(
+            pk__in=[self.comments[1].pk, self.comments[4].pk]
+        ):
+            xtd_comment.delete(keep_parents=True)
+        out = StringIO()
+        call_command("populate_xtdcomments", "--batch-size=2", stdout=out)
+        last_id = self.comments[-1].pk
+        self.assertIn(
+            f"Processed comment ids up to {last_id} of {last_id}, "
+            "added 2 XtdComment object(s).",
+            out.getvalue(),
+        )
+        self.assertIn("Added 2 XtdComment object(s).", out.getvalue())
+        self.assertEqual(XtdComment.objects.count(), 5)
+
+        out = StringIO()
+        call_command("populate_xtdcomments", stdout=out)
+        self.assertIn("Added 0 XtdComment object(s).", out.getvalue())
+
+    def test_insert_is_compiled_for_the_given_connection(self):
+        get_compiler = Query.get_compiler
+        with (
+            patch(f"{command}.connections", {"replica": connection}),
+            patch.object(
+                Query,
+                "get_compiler",
+                autospec=True,
+                side_effect=lambda query, using=None, **kwargs: get_compiler(
+                    query, DEFAULT_DB_ALIAS
+                ),
+            ) as mock_get_compiler,
+        ):
+            Command().get_insert_sql("replica", 1, 10)
+        # Subqueries are compiled with the connection of the outer query.
+        usings = [
+            call.kwargs.get("using", next(iter(call.args[1:]), None))
+            for call in mock_get_compiler.call_args_list
+        ]
+        self.assertEqual([u for u in usings if u is not None], ["replica"])
+
+    def test_calling_command_with_non_existing_connection(self):
+        out = StringIO()
+        with patch(
+            f"{command}.Command.populate_db",
+            side_effect=ConnectionDoesNotExist,
+        ):
+            call_command("populate_xtdcomments", "missing", stdout=out)
+        self.assertIn("DB connection 'missing' does not exist.", out.getvalue())
+        self.assertIn("Added 0 XtdComment object(s).", out.getvalue())
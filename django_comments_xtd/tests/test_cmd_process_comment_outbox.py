@@ -0,0 +1,106 @@
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+
+from django.core import mail
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from django.utils.connection import ConnectionDoesNotExist
+
+from django_comments_xtd import utils
+from django_comments_xtd.models import OutboxEmail
+
+command = "django_comments_xtd.management.commands.process_comment_outbox"
+
+
+@patch.multiple("django_comments_xtd.conf.settings", COMMENTS_XTD_OUTBOX=True)
+class ProcessCommentOutboxCmdTest(TestCase):
+    def queue_emails(self, count):
+        for i in range(count):
+            utils.send_mail(
+                f"subject {i}",
+                "the message",
+                "helpdesk@example.com",
+                [f"user{i}@example.com"],
+                html="<p>The message.</p>",
+            )
+
+    def test_send_mail_queues_emails(self):
+        self.queue_emails(2)
+        self.assertEqual(len(mail.outbox), 0)
+        email = OutboxEmail.objects.get(subject="subject 1")
+        self.assertEqual(email.recipient_list, ["user1@example.com"])
+        self.assertEqual(email.html, "<p>The message.</p>")
+
+    def test_calling_command_sends_queued_emails(self):
+        self.queue_emails(5)
+        out = StringIO()
+        call_command("process_comment_outbox", "--batch-size=2", stdout=out)
+        self.assertIn("Sent 5 email(s), 0 failed.", out.getvalue())
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(mail.outbox[0].to, ["user0@example.com"])
+        self.assertEqual(mail.outbox[0].alternatives[0][1], "text/html")
+        self.assertFalse(OutboxEmail.objects.exists())
+
+    def test_emails_to_send_later_are_not_sent(self):
+        self.queue_emails(2)
+        OutboxEmail.objects.filter(subject="subject 1").update(
+            send_after=timezone.now() + timedelta(minutes=1)
+        )
+        out = StringIO()
+        call_command("process_comment_outbox", stdout=out)
+        self.assertIn("Sent 1 email(s), 0 failed.", out.getvalue())
+        self.assertEqual(OutboxEmail.objects.get().subject, "subject 1")
+
+    @patch.multiple(
+        "django_comments_xtd.conf.settings",
+        COMMENTS_XTD_OUTBOX_RETRY_DELAY=60,
+        COMMENTS_XTD_OUTBOX_MAX_ATTEMPTS=2,
+    )
+    def test_failed_emails_are_retried_with_backoff(self):
+        self.queue_emails(2)
+        out = StringIO()
+        with patch(
+            "django.core.mail.backends.locmem.EmailBackend.send_messages",
+            side_effect=[OSError("Connection refused"), 1],
+        ):
+            call_command("process_comment_outbox", stdout=out)
+        self.assertIn("Sent 1 email(s), 1 failed.", out.getvalue())
+        email = OutboxEmail.objects.get()
+        self.assertEqual(email.attempts, 1)
+        self.assertEqual(email.last_error, "OSError: Connection refused")
+        delay = email.send_after - timezone.now()
+        self.assertTrue(timedelta(seconds=50) < delay <= timedelta(seconds=60))
+
+        # Once it's time to retry, a second failure doubles the delay.
+        OutboxEmail.objects.update(send_after=timezone.now())
+        with patch(
+            "django.core.mail.backends.locmem.EmailBackend.send_messages",
+            side_effect=OSError("Connection refused"),
+        ):
+            call_command("process_comment_outbox", stdout=out)
+        email.refresh_from_db()
+        self.assertEqual(email.attempts, 2)
+        delay = email.send_after - timezone.now()
+        self.assertTrue(
+            timedelta(seconds=110) < delay <= timedelta(seconds=120)
+        )
+
+        # After COMMENTS_XTD_OUTBOX_MAX_ATTEMPTS the email is not retried.
+        OutboxEmail.objects.update(send_after=timezone.now())
+        out = StringIO()
+        call_command("process_comment_outbox", stdout=out)
+        self.assertIn("Sent 0 email(s), 0 failed.", out.getvalue())
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_calling_command_with_non_existing_connection(self):
+        self.queue_emails(1)
+        out = StringIO()
+        with patch(
+            f"{command}.Command.process_comment_outbox",
+            side_effect=ConnectionDoesNotExist,
+        ):
+            call_command("process_comment_outbox", "missing", stdout=out)
+        self.assertIn("DB connection 'missing' does not exist.", out.getvalue())
+        self.assertIn("Sent 0 email(s), 0 failed.", out.getvalue())
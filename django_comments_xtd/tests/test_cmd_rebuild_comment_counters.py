@@ -0,0 +1,78 @@
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils.connection import ConnectionDoesNotExist
+
+from django_comments_xtd.models import XtdComment, XtdCommentCounter
+from django_comments_xtd.tests.models import Article
+from django_comments_xtd.tests.test_models import (
+    thread_test_step_1,
+    thread_test_step_2,
+)
+
+command = "django_comments_xtd.management.commands.rebuild_comment_counters"
+
+
+class RebuildCommentCountersCmdTest(TestCase):
+    def setUp(self):
+        self.article_1 = Article.objects.create(
+            title="September", slug="september", body="During September..."
+        )
+        self.article_2 = Article.objects.create(
+            title="October", slug="october", body="What I did on October..."
+        )
+        thread_test_step_1(self.article_1)
+        thread_test_step_2(self.article_1)
+        thread_test_step_1(self.article_2)
+
+    def get_counts(self, article):
+        counter = XtdCommentCounter.objects.get_for_object(article)
+        return counter.public_count, counter.thread_count
+
+    def test_calling_command_repairs_counters(self):
+        # Updates in bulk don't maintain the counters.
+        XtdComment.objects.filter(pk=3).update(is_public=False)
+        XtdCommentCounter.objects.filter(object_pk=self.article_2.pk).delete()
+        out = StringIO()
+        call_command("rebuild_comment_counters", "--batch-size=1", stdout=out)
+        self.assertIn(
+            "Created 1, updated 1 and deleted 0 XtdCommentCounter object(s).",
+            out.getvalue(),
+        )
+        self.assertEqual(self.get_counts(self.article_1), (3, 2))
+        self.assertEqual(self.get_counts(self.article_2), (2, 2))
+
+        out = StringIO()
+        call_command("rebuild_comment_counters", stdout=out)
+        self.assertIn(
+            "Created 0, updated 0 and deleted 0 XtdCommentCounter object(s).",
+            out.getvalue(),
+        )
+
+    def test_calling_command_deletes_counters_without_comments(self):
+        XtdComment.objects.filter(object_pk=self.article_2.pk).delete()
+        XtdCommentCounter.objects.filter(object_pk=self.article_2.pk).update(
+            public_count=2
+        )
+        out = StringIO()
+        call_command("rebuild_comment_counters", stdout=out)
+        self.assertIn(
+            "Created 0, updated 0 and deleted 1 XtdCommentCounter object(s).",
+            out.getvalue(),
+        )
+        self.assertEqual(XtdCommentCounter.objects.count(), 1)
+
+    def test_calling_command_with_non_existing_connection(self):
+        out = StringIO()
+        with patch(
+            f"{command}.Command.rebuild_counters",
+            side_effect=ConnectionDoesNotExist,
+        ):
+            call_command("rebuild_comment_counters", "missing", stdout=out)
+        self.assertIn("DB connection 'missing' does not exist.", out.getvalue())
+        self.assertIn(
+            "Created 0, updated 0 and deleted 0 XtdCommentCounter object(s).",
+            out.getvalue(),
+        )
@@ -0,0 +1,71 @@
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils.connection import ConnectionDoesNotExist
+
+from django_comments_xtd.models import XtdComment
+from django_comments_xtd.tests.models import Article
+from django_comments_xtd.tests.test_models import (
+    step_6_tree_order,
+    thread_test_step_1,
+    thread_test_step_2,
+    thread_test_step_3,
+    thread_test_step_4,
+    thread_test_step_5,
+    thread_test_step_6,
+)
+
+
+class RespaceThreadOrderCmdTest(TestCase):
+    def setUp(self):
+        self.article_1 = Article.objects.create(
+            title="September", slug="september", body="During September..."
+        )
+        thread_test_step_1(self.article_1)
+        thread_test_step_2(self.article_1)
+        thread_test_step_3(self.article_1)
+        thread_test_step_4(self.article_1)
+        thread_test_step_5(self.article_1)
+        thread_test_step_6(self.article_1)
+
+    def test_calling_command_respaces_threads(self):
+        out = StringIO()
+        call_command("respace_thread_order", "--gap=100", stdout=out)
+        self.assertIn("Re-spaced 11 XtdComment object(s).", out.getvalue())
+        pks = list(XtdComment.objects.values_list("pk", flat=True))
+        self.assertEqual(pks, step_6_tree_order)
+        orders = list(
+            XtdComment.objects.filter(thread_id=1).values_list(
+                "order", flat=True
+            )
+        )
+        self.assertEqual(orders, [1, 101, 201, 301, 401, 501, 601])
+        self.assertEqual(XtdComment.objects.get(pk=9).order, 1)
+
+    def test_command_is_idempotent(self):
+        out = StringIO()
+        call_command("respace_thread_order", "--gap=100", stdout=out)
+        with self.assertNumQueries(2):
+            # Threads are read but nothing has to be updated.
+            call_command(
+                "respace_thread_order",
+                "--gap=100",
+                "--threads-per-batch=10",
+                stdout=out,
+            )
+        pks = list(XtdComment.objects.values_list("pk", flat=True))
+        self.assertEqual(pks, step_6_tree_order)
+
+    def test_command_skips_failed_database(self):
+        out = StringIO()
+        method_ref = (
+            "django_comments_xtd.management.commands"
+            ".respace_thread_order.Command"
+            ".respace_thread_order"
+        )
+        with patch(method_ref) as mock_respace_thread_order:
+            mock_respace_thread_order.side_effect = ConnectionDoesNotExist
+            call_command("respace_thread_order", stdout=out)
+        self.assertIn("DB connection 'default' does not exist.", out.getvalue())
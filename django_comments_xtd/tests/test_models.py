@@ -1,16 +1,38 @@
 # ruff:noqa: PLR2004
+import pickle
+import random
+import threading
 from datetime import datetime, timedelta
+from io import StringIO
 from unittest.mock import patch
 
+from django.contrib.auth.models import AnonymousUser, Permission, User
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.sites.models import Site
+from django.core import checks
+from django.core.management import call_command
+from django.db import DatabaseError, connection, transaction
 from django.db.models.signals import pre_save
 from django.test import TestCase as DjangoTestCase
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django_comments.models import CommentFlag
 
 from django_comments_xtd import get_model
+from django_comments_xtd.checks import check_max_thread_level
 from django_comments_xtd.models import (
+    DISLIKEDIT_FLAG,
+    LIKEDIT_FLAG,
+    PATH_MAX_LENGTH,
+    PATH_MAX_LEVEL,
+    PATH_SEPARATOR,
+    THREAD_ADVISORY_LOCK_KEY,
     MaxThreadLevelExceededException,
+    TmpXtdComment,
     XtdComment,
+    XtdCommentCounter,
+    lock_thread,
+    publish_or_unpublish_nested_comments,
     publish_or_unpublish_on_pre_save,
 )
 from django_comments_xtd.tests.models import Article, Diary, MyComment
@@ -123,6 +145,35 @@ class XtdCommentManagerTestCase(ArticleBaseTestCase):
         ).count()
         self.assertEqual(count_site2, 1)
 
+    def post_all_comments(self):
+        self.post_comment_1()
+        self.post_comment_2()
+        self.post_comment_3()
+        self.post_comment_4()
+        XtdComment.objects.filter(comment="and another one").update(
+            is_public=False
+        )
+
+    def test_counts_for(self):
+        self.post_all_comments()
+        objects = [self.article_1, self.article_2]
+        with self.assertNumQueries(1):
+            counts = XtdComment.objects.counts_for(objects)
+        self.assertEqual(counts, {self.article_1.pk: 2, self.article_2.pk: 1})
+        counts = XtdComment.objects.counts_for(objects, site=self.site2)
+        self.assertEqual(counts, {self.article_1.pk: 1, self.article_2.pk: 0})
+
+    def test_count_subquery(self):
+        self.post_all_comments()
+        articles = Article.objects.annotate(
+            comment_count=XtdComment.objects.count_subquery(
+                Article, site=self.site1
+            )
+        ).order_by("pk")
+        self.assertEqual(
+            [article.comment_count for article in articles], [1, 1]
+        )
+
 
 # In order to test 'save' and '_calculate_thread_data' methods, simulate the
 # following threads, in order of arrival:
@@ -749,3 +800,843 @@ class PublishOrUnpublishNestedCommentsTwoTestCase(ArticleBaseTestCase):
         cm4 = MyComment.objects.get(pk=4)
         self.assertFalse(cm4.is_public)
         self.assertFalse(cm4.is_removed)
+
+
+cascade = "django_comments_xtd.models.publish_or_unpublish_nested_comments"
+
+
+class VisibilityTrackerTestCase(ArticleBaseTestCase):
+    def setUp(self):
+        super().setUp()
+        thread_test_step_1(self.article_1)
+        thread_test_step_2(self.article_1)
+
+    def test_new_comments_do_not_publish_nested_comments(self):
+        with patch(cascade) as mock_cascade:
+            thread_test_step_3(self.article_1)
+        mock_cascade.assert_not_called()
+
+    def test_saving_other_fields_does_not_publish_nested_comments(self):
+        cm1 = XtdComment.objects.get(pk=1)
+        cm1.comment = "Edited comment"
+        cm1.nested_count = 2
+        with patch(cascade) as mock_cascade:
+            cm1.save()
+        mock_cascade.assert_not_called()
+
+    def test_changing_visibility_unpublishes_nested_comments_once(self):
+        cm1 = XtdComment.objects.get(pk=1)
+        cm1.is_public = False
+        with patch(cascade) as mock_cascade:
+            cm1.save()
+            cm1.save()
+            # Removing an unpublished comment doesn't change its visibility.
+            cm1.is_removed = True
+            cm1.save()
+        mock_cascade.assert_called_once_with(
+            cm1, are_public=False, using="default"
+        )
+
+    def test_visibility_is_tracked_on_refresh_from_db(self):
+        cm1 = XtdComment.objects.get(pk=1)
+        XtdComment.objects.filter(pk=1).update(is_public=False)
+        cm1.refresh_from_db()
+        self.assertFalse(cm1.visibility_has_changed())
+        cm1.is_public = True
+        self.assertTrue(cm1.visibility_has_changed())
+
+    def test_deferred_visibility_is_read_from_db(self):
+        cm1 = XtdComment.objects.defer("is_public").get(pk=1)
+        with self.assertNumQueries(1):
+            self.assertFalse(cm1.visibility_has_changed(["is_removed"]))
+        with patch(cascade) as mock_cascade:
+            cm1.save()
+        mock_cascade.assert_not_called()
+
+    def test_deferred_visibility_unpublishes_nested_comments(self):
+        cm1 = XtdComment.objects.defer("is_public").get(pk=1)
+        cm1.is_public = False
+        with patch(cascade) as mock_cascade:
+            cm1.save()
+            cm1.save()
+        mock_cascade.assert_called_once_with(
+            cm1, are_public=False, using="default"
+        )
+
+    def test_visibility_is_tracked_on_partial_refresh_from_db(self):
+        cm1 = XtdComment.objects.get(pk=1)
+        XtdComment.objects.filter(pk=1).update(is_public=False)
+        cm1.refresh_from_db(fields=["is_public"])
+        with patch(cascade) as mock_cascade:
+            cm1.save()
+        mock_cascade.assert_not_called()
+
+    def test_update_fields_with_visibility_is_tracked(self):
+        cm1 = XtdComment.objects.get(pk=1)
+        cm1.is_public = False
+        with patch(cascade) as mock_cascade:
+            cm1.save(update_fields=["is_public"])
+            cm1.comment = "Edited comment"
+            cm1.save()
+        mock_cascade.assert_called_once_with(
+            cm1, are_public=False, using="default"
+        )
+
+    @patch.multiple(
+        "django_comments_xtd.conf.settings", COMMENTS_XTD_MAX_THREAD_LEVEL=3
+    )
+    def test_nested_count_is_updated_once(self):
+        c3 = create_comment_chain(self.article_2, 4)
+        root = XtdComment.objects.get(pk=c3.thread_id)
+        self.assertEqual(root.nested_count, 3)
+        c1 = XtdComment.objects.get(thread_id=root.pk, level=1)
+        c1.is_public = False
+        c1.save(update_fields=["is_public"])
+        root.refresh_from_db()
+        self.assertEqual(root.nested_count, 1)
+        c1.comment = "Edited comment"
+        c1.save()
+        root.refresh_from_db()
+        self.assertEqual(root.nested_count, 1)
+
+    def test_update_fields_without_visibility(self):
+        cm1 = XtdComment.objects.get(pk=1)
+        cm1.is_public = False
+        with patch(cascade) as mock_cascade:
+            cm1.save(update_fields=["comment"])
+        mock_cascade.assert_not_called()
+        self.assertTrue(cm1.visibility_has_changed())
+
+
+# Order of the comments posted in thread_test_step_1 to thread_test_step_6,
+# as listed by ("thread_id", "order"). See ThreadStep6TestCase.
+step_6_tree_order = [1, 3, 8, 11, 4, 7, 10, 2, 5, 6, 9]
+
+
+class PublishOrUnpublishNestedCommentsQueriesTestCase(ArticleBaseTestCase):
+    def setUp(self):
+        super().setUp()
+        thread_test_step_1(self.article_1)
+        thread_test_step_2(self.article_1)
+        thread_test_step_3(self.article_1)
+        thread_test_step_4(self.article_1)
+        thread_test_step_5(self.article_1)
+        thread_test_step_6(self.article_1)
+
+    def get_public_pks(self):
+        return set(
+            XtdComment.objects.filter(is_public=True).values_list(
+                "pk", flat=True
+            )
+        )
+
+    def assert_unpublishing_costs(self, num_queries):
+        cm1 = XtdComment.objects.get(pk=1)
+        with self.assertNumQueries(num_queries):
+            publish_or_unpublish_nested_comments(cm1, are_public=False)
+        self.assertEqual(self.get_public_pks(), {1, 2, 5, 6, 9})
+
+        with self.assertNumQueries(num_queries):
+            publish_or_unpublish_nested_comments(cm1, are_public=True)
+        self.assertEqual(self.get_public_pks(), set(step_6_tree_order))
+
+    def test_nested_comments_are_updated_at_once(self):
+        # One query to find where the subthread ends, one UPDATE for the
+        # nested comments, and one for the ancestors.
+        self.assert_unpublishing_costs(3)
+
+    def test_nested_comments_without_path_are_updated_at_once(self):
+        XtdComment.objects.update(path="")
+        self.assert_unpublishing_costs(3)
+
+    def test_only_ancestors_nested_count_is_updated(self):
+        # Comment 7 is nested in comment 4, itself nested in comment 1.
+        cm7 = XtdComment.objects.get(pk=7)
+        cm7.is_public = False
+        cm7.save()
+        self.assertEqual(
+            self.get_public_pks(), set(step_6_tree_order) - {7, 10}
+        )
+        nested = dict(XtdComment.objects.values_list("pk", "nested_count"))
+        self.assertEqual(nested[1], 5)
+        self.assertEqual(nested[3], 2)
+        self.assertEqual(nested[4], 1)
+        self.assertEqual(nested[7], 1)
+
+
+def create_comment_chain(article, num_levels):
+    """Post a comment and num_levels - 1 replies, each to the previous one."""
+    article_ct = ContentType.objects.get(app_label="tests", model="article")
+    site = Site.objects.get(pk=1)
+    parent_id = 0
+    for level in range(num_levels):
+        comment = XtdComment.objects.create(
+            content_type=article_ct,
+            object_pk=article.id,
+            site=site,
+            comment=f"level {level}",
+            submit_date=datetime.now(),
+            parent_id=parent_id,
+        )
+        parent_id = comment.pk
+    return comment
+
+
+class PathMaxLevelTestCase(ArticleBaseTestCase):
+    @patch.multiple(
+        "django_comments_xtd.conf.settings", COMMENTS_XTD_MAX_THREAD_LEVEL=40
+    )
+    def test_deepest_comment_fits_in_the_path(self):
+        comment = create_comment_chain(self.article_1, PATH_MAX_LEVEL + 1)
+        self.assertEqual(comment.level, PATH_MAX_LEVEL)
+        self.assertLessEqual(len(comment.path), PATH_MAX_LENGTH)
+        self.assertEqual(comment.path.count(PATH_SEPARATOR), PATH_MAX_LEVEL)
+
+    @patch.multiple(
+        "django_comments_xtd.conf.settings", COMMENTS_XTD_MAX_THREAD_LEVEL=40
+    )
+    def test_deeper_comments_have_no_path(self):
+        comment = create_comment_chain(self.article_1, PATH_MAX_LEVEL + 3)
+        self.assertEqual(comment.level, PATH_MAX_LEVEL + 2)
+        self.assertEqual(
+            list(
+                XtdComment.objects.filter(path="").values_list(
+                    "level", flat=True
+                )
+            ),
+            [PATH_MAX_LEVEL + 1, PATH_MAX_LEVEL + 2],
+        )
+        root = XtdComment.objects.get(pk=comment.thread_id)
+        self.assertEqual(root.nested_count, PATH_MAX_LEVEL + 2)
+        self.assertEqual(
+            XtdComment.objects.subthread(root).count(), PATH_MAX_LEVEL + 2
+        )
+
+    def test_max_thread_level_check(self):
+        with patch.multiple(
+            "django_comments_xtd.conf.settings",
+            COMMENTS_XTD_MAX_THREAD_LEVEL=PATH_MAX_LEVEL,
+            COMMENTS_XTD_MAX_THREAD_LEVEL_BY_APP_MODEL={"tests.diary": 0},
+        ):
+            self.assertEqual(check_max_thread_level(None), [])
+        with patch.multiple(
+            "django_comments_xtd.conf.settings",
+            COMMENTS_XTD_MAX_THREAD_LEVEL=2,
+            COMMENTS_XTD_MAX_THREAD_LEVEL_BY_APP_MODEL={"tests.diary": 30},
+        ):
+            errors = check_max_thread_level(None)
+        self.assertEqual(
+            [error.id for error in errors], ["django_comments_xtd.W001"]
+        )
+        self.assertIsInstance(errors[0], checks.Warning)
+        self.assertIn("'tests.diary'", errors[0].msg)
+
+
+class DeepThreadTestCase(ArticleBaseTestCase):
+    """
+    A thread nested deeper than the materialized path can hold.
+    """
+
+    @patch.multiple(
+        "django_comments_xtd.conf.settings", COMMENTS_XTD_MAX_THREAD_LEVEL=40
+    )
+    def setUp(self):
+        super().setUp()
+        create_comment_chain(self.article_1, 30)
+        XtdComment.norel_objects.update(path="")
+        self.out = StringIO()
+        call_command("initialize_thread_path", stdout=self.out)
+
+    def test_comments_deeper_than_the_path_have_no_path(self):
+        self.assertEqual(
+            XtdComment.objects.filter(path="").count(), 30 - PATH_MAX_LEVEL - 1
+        )
+        self.assertIn(
+            f"1 XtdComment object(s) nested deeper than level "
+            f"{PATH_MAX_LEVEL}, and their replies, have no path.",
+            self.out.getvalue(),
+        )
+
+    @patch.multiple(
+        "django_comments_xtd.conf.settings", COMMENTS_XTD_MAX_THREAD_LEVEL=40
+    )
+    def test_replies_deeper_than_the_path_have_no_path(self):
+        cm = XtdComment.objects.get(level=PATH_MAX_LEVEL)
+        reply = XtdComment.objects.create(
+            content_type=cm.content_type,
+            object_pk=cm.object_pk,
+            site=cm.site,
+            comment="Deeper than the path",
+            submit_date=datetime.now(),
+            parent_id=cm.pk,
+        )
+        self.assertEqual(reply.level, PATH_MAX_LEVEL + 1)
+        self.assertEqual(reply.path, "")
+        self.assertIn(reply, XtdComment.objects.subthread(cm))
+        self.assertTrue(cm.allow_thread())
+
+    def test_subthread_includes_comments_without_path(self):
+        cm = XtdComment.objects.get(level=1)
+        self.assertEqual(XtdComment.objects.subthread(cm).count(), 28)
+
+    def test_unpublishing_unpublishes_comments_without_path(self):
+        cm = XtdComment.objects.get(level=1)
+        cm.is_public = False
+        cm.save()
+        self.assertEqual(
+            list(
+                XtdComment.objects.filter(is_public=True).values_list(
+                    "level", flat=True
+                )
+            ),
+            [0],
+        )
+
+
+class XtdCommentCounterTestCase(ArticleBaseTestCase):
+    def setUp(self):
+        super().setUp()
+        thread_test_step_1(self.article_1)
+        thread_test_step_2(self.article_1)
+        thread_test_step_3(self.article_1)
+        thread_test_step_4(self.article_1)
+        thread_test_step_5(self.article_1)
+        thread_test_step_6(self.article_1)
+
+    def get_counts(self, article):
+        counter = XtdCommentCounter.objects.get_for_object(article)
+        return counter.public_count, counter.thread_count
+
+    def test_new_comments_are_counted(self):
+        self.assertEqual(self.get_counts(self.article_1), (11, 3))
+        self.assertEqual(self.get_counts(self.article_2), (0, 0))
+        counter = XtdCommentCounter.objects.get_for_object(self.article_1)
+        self.assertEqual(
+            counter.last_submit_date,
+            XtdComment.objects.get(pk=11).submit_date,
+        )
+
+    def test_new_comments_not_public_are_not_counted(self):
+        thread_test_step_1(self.article_2, is_public=False)
+        self.assertEqual(self.get_counts(self.article_2), (0, 0))
+
+    def test_unpublishing_uncounts_nested_comments(self):
+        cm1 = XtdComment.objects.get(pk=1)
+        cm1.is_public = False
+        cm1.save()
+        # Comment 1 and its 6 nested comments are not visible.
+        self.assertEqual(self.get_counts(self.article_1), (4, 2))
+        cm1.is_public = True
+        cm1.save()
+        self.assertEqual(self.get_counts(self.article_1), (11, 3))
+
+    def test_removing_a_nested_comment(self):
+        cm4 = XtdComment.objects.get(pk=4)
+        cm4.is_removed = True
+        cm4.save()
+        # Comment 4 and its nested comments 7 and 10.
+        self.assertEqual(self.get_counts(self.article_1), (8, 3))
+
+    def test_deleted_comments_are_uncounted(self):
+        XtdComment.objects.get(pk=2).delete()
+        self.assertEqual(self.get_counts(self.article_1), (10, 2))
+
+    def test_counters_of_many_objects_are_fetched_at_once(self):
+        articles = [self.article_1, self.article_2]
+        Site.objects.get_current()  # Load the site cache.
+        with self.assertNumQueries(1):
+            counters = XtdCommentCounter.objects.for_objects(articles)
+        self.assertEqual(counters[self.article_1.pk].public_count, 11)
+        self.assertEqual(counters[self.article_2.pk].public_count, 0)
+
+
+class SparseOrderTestCase(ArticleBaseTestCase):
+    def post_all_steps(self):
+        thread_test_step_1(self.article_1)
+        thread_test_step_2(self.article_1)
+        thread_test_step_3(self.article_1)
+        thread_test_step_4(self.article_1)
+        thread_test_step_5(self.article_1)
+        thread_test_step_6(self.article_1)
+
+    def get_orders(self):
+        return dict(XtdComment.objects.values_list("pk", "order"))
+
+    def assert_tree_is_consistent(self):
+        pks = list(XtdComment.objects.values_list("pk", flat=True))
+        self.assertEqual(pks, step_6_tree_order)
+        nested = dict(XtdComment.objects.values_list("pk", "nested_count"))
+        self.assertEqual(nested, {
+            1: 6, 3: 2, 8: 1, 11: 0, 4: 2, 7: 1, 10: 0,
+            2: 2, 5: 1, 6: 0, 9: 0,
+        })  # fmt: skip
+
+    @patch.multiple(
+        "django_comments_xtd.conf.settings", COMMENTS_XTD_ORDER_GAP=1024
+    )
+    def test_replies_fill_the_gaps(self):
+        self.post_all_steps()
+        self.assert_tree_is_consistent()
+        orders = self.get_orders()
+        # Replies appended to the end of a thread leave a gap, and replies
+        # in the middle of a thread don't shift the comments below them.
+        self.assertEqual(orders[1], 1)
+        self.assertEqual(orders[3], 1025)
+        self.assertEqual(orders[4], 2049)
+        self.assertEqual(orders[7], 3073)
+        self.assertEqual(orders[8], 1537)
+        self.assertEqual(orders[11], 1793)
+        self.assertEqual(orders[10], 4097)
+
+    @patch.multiple(
+        "django_comments_xtd.conf.settings", COMMENTS_XTD_ORDER_GAP=2
+    )
+    def test_exhausted_gap_renumbers_a_window(self):
+        self.post_all_steps()
+        self.assert_tree_is_consistent()
+        orders = self.get_orders()
+        # Posting c11 exhausted the gap after c8 and renumbered c4 and c7.
+        self.assertEqual(orders[8], 4)
+        self.assertEqual(orders[11], 6)
+        self.assertEqual(orders[4], 8)
+        self.assertEqual(orders[7], 10)
+        self.assertEqual(orders[10], 12)
+
+    @patch("django_comments_xtd.models.ORDER_RESPACE_WINDOW", 1)
+    def test_contiguous_thread_is_shifted_once(self):
+        # Threads created with contiguous orders, before sparse ordering
+        # was enabled, get shifted once when there's no room in the window.
+        thread_test_step_1(self.article_1)
+        thread_test_step_2(self.article_1)
+        thread_test_step_3(self.article_1)
+        thread_test_step_4(self.article_1)
+        thread_test_step_5(self.article_1)
+        with patch.multiple(
+            "django_comments_xtd.conf.settings", COMMENTS_XTD_ORDER_GAP=8
+        ):
+            thread_test_step_6(self.article_1)
+        self.assert_tree_is_consistent()
+        orders = self.get_orders()
+        self.assertEqual(orders[11], 7)
+        self.assertEqual(orders[4], 12)
+        self.assertEqual(orders[7], 13)
+        self.assertEqual(orders[10], 21)
+
+
+class ThreadPathTestCase(ArticleBaseTestCase):
+    def setUp(self):
+        super().setUp()
+        thread_test_step_1(self.article_1)
+        thread_test_step_2(self.article_1)
+        thread_test_step_3(self.article_1)
+        thread_test_step_4(self.article_1)
+        thread_test_step_5(self.article_1)
+        thread_test_step_6(self.article_1)
+
+    def test_path_contains_the_ids_of_the_ancestors(self):
+        self.assertEqual(XtdComment.objects.get(pk=1).path, "0000000001")
+        self.assertEqual(XtdComment.objects.get(pk=9).path, "0000000009")
+        self.assertEqual(
+            XtdComment.objects.get(pk=11).path,
+            "0000000001/0000000003/0000000008/0000000011",
+        )
+
+    def test_ordering_by_path_gives_the_tree_order(self):
+        pks = list(
+            XtdComment.objects.order_by("path").values_list("pk", flat=True)
+        )
+        self.assertEqual(pks, step_6_tree_order)
+
+    def test_subthread(self):
+        c3 = XtdComment.objects.get(pk=3)
+        # One query to find where the subthread ends.
+        with self.assertNumQueries(2):
+            pks = [cm.pk for cm in XtdComment.objects.subthread(c3)]
+        self.assertEqual(pks, [8, 11])
+        qs = XtdComment.objects.subthread(c3, include_self=True)
+        self.assertEqual([cm.pk for cm in qs], [3, 8, 11])
+        c2 = XtdComment.objects.get(pk=2)
+        self.assertEqual(
+            [cm.pk for cm in XtdComment.objects.subthread(c2)], [5, 6]
+        )
+
+    def test_subthread_without_path(self):
+        XtdComment.norel_objects.update(path="")
+        c3 = XtdComment.objects.get(pk=3)
+        self.assertEqual(
+            [cm.pk for cm in XtdComment.objects.subthread(c3)], [8, 11]
+        )
+        c4 = XtdComment.objects.get(pk=4)
+        qs = XtdComment.objects.subthread(c4, include_self=True)
+        self.assertEqual([cm.pk for cm in qs], [4, 7, 10])
+
+    def test_reply_to_comment_without_path(self):
+        XtdComment.norel_objects.filter(pk=10).update(path="")
+        article_ct = ContentType.objects.get(app_label="tests", model="article")
+        XtdComment.objects.create(
+            content_type=article_ct,
+            object_pk=self.article_1.id,
+            content_object=self.article_1,
+            site=Site.objects.get(pk=1),
+            comment="c12.c2",
+            submit_date=datetime.now(),
+            parent_id=2,
+        )
+        self.assertEqual(
+            XtdComment.objects.get(pk=12).path, "0000000002/0000000012"
+        )
+
+
+class AncestorsNestedCountTestCase(ArticleBaseTestCase):
+    def setUp(self):
+        super().setUp()
+        thread_test_step_1(self.article_1)
+        thread_test_step_2(self.article_1)
+        thread_test_step_3(self.article_1)
+        thread_test_step_4(self.article_1)
+        thread_test_step_5(self.article_1)
+        self.article_ct = ContentType.objects.get(
+            app_label="tests", model="article"
+        )
+        self.site = Site.objects.get(pk=1)
+
+    def post_reply(self, parent_id):
+        with CaptureQueriesContext(connection) as ctx:
+            XtdComment.objects.create(
+                content_type=self.article_ct,
+                object_pk=self.article_1.id,
+                content_object=self.article_1,
+                site=self.site,
+                comment=f"reply to c{parent_id}",
+                submit_date=datetime.now(),
+                parent_id=parent_id,
+            )
+        return len(ctx.captured_queries)
+
+    def assert_nested_count(self):
+        # Comment 10 replies to c3 (level 1), comment 11 to c8 (level 2).
+        nested = dict(XtdComment.objects.values_list("pk", "nested_count"))
+        self.assertEqual(nested, {
+            1: 6, 3: 3, 8: 1, 11: 0, 10: 0, 4: 1, 7: 0,
+            2: 2, 5: 1, 6: 0, 9: 0,
+        })  # fmt: skip
+
+    def test_queries_do_not_depend_on_level(self):
+        num_queries_level_1 = self.post_reply(3)
+        num_queries_level_2 = self.post_reply(8)
+        self.assertEqual(num_queries_level_1, num_queries_level_2)
+        self.assert_nested_count()
+
+    def test_queries_do_not_depend_on_level_without_path(self):
+        XtdComment.norel_objects.update(path="")
+        num_queries_level_1 = self.post_reply(3)
+        num_queries_level_2 = self.post_reply(8)
+        self.assertEqual(num_queries_level_1, num_queries_level_2)
+        self.assert_nested_count()
+
+    @patch("django_comments_xtd.models.RECURSIVE_CTE_VENDORS", ())
+    def test_nested_count_without_path_nor_recursive_cte(self):
+        XtdComment.norel_objects.update(path="")
+        self.post_reply(3)
+        self.post_reply(8)
+        self.assert_nested_count()
+
+
+class LockThreadTestCase(ArticleBaseTestCase):
+    # The stress test of ConcurrentRepliesTestCase runs on SQLite, that
+    # doesn't use these locks. Check the statements they issue instead.
+    @patch.object(connection, "vendor", "postgresql")
+    def test_advisory_lock_on_postgresql(self):
+        with patch.object(connection, "cursor") as mock_cursor:
+            self.assertTrue(lock_thread(42, "default"))
+        cursor = mock_cursor.return_value.__enter__.return_value
+        cursor.execute.assert_called_once_with(
+            "SELECT pg_advisory_xact_lock(%s, %s)",
+            [THREAD_ADVISORY_LOCK_KEY, 42],
+        )
+
+    @patch.object(connection.features, "has_select_for_update", True)
+    def test_select_for_update_on_other_backends(self):
+        # SQLite doesn't understand the statement, only the SQL is checked.
+        with (
+            CaptureQueriesContext(connection) as queries,
+            self.assertRaises(DatabaseError),
+            transaction.atomic(),
+        ):
+            lock_thread(42, "default")
+        sql = [
+            query["sql"]
+            for query in queries
+            if "django_comments_xtd_xtdcomment" in query["sql"]
+        ]
+        self.assertEqual(len(sql), 1)
+        self.assertIn("FOR UPDATE", sql[0])
+
+    def test_replies_lock_their_thread(self):
+        thread_test_step_1(self.article_1)
+        with patch(
+            "django_comments_xtd.models.lock_thread", return_value=True
+        ) as mock_lock_thread:
+            thread_test_step_2(self.article_1)
+        mock_lock_thread.assert_called_with(1, "default")
+        self.assertEqual(mock_lock_thread.call_count, 2)
+
+    @patch.multiple(
+        "django_comments_xtd.conf.settings", COMMENTS_XTD_LOCK_THREADS=False
+    )
+    @patch.object(connection, "vendor", "postgresql")
+    def test_disabled_lock(self):
+        with self.assertNumQueries(0):
+            self.assertFalse(lock_thread(42, "default"))
+
+
+class ConcurrentRepliesTestCase(TransactionTestCase):
+    # Post replies to the same thread from several threads at once, and
+    # verify that the thread's tree remains consistent.
+    num_threads = 8
+    replies_per_thread = 10
+
+    def setUp(self):
+        self.article = Article.objects.create(
+            title="September", slug="september", body="During September..."
+        )
+        self.article_ct = ContentType.objects.get(
+            app_label="tests", model="article"
+        )
+        self.site = Site.objects.get(pk=1)
+        self.root = self.post_comment(0)
+        child_1 = self.post_comment(self.root.pk)
+        child_2 = self.post_comment(self.root.pk)
+        grandchild = self.post_comment(child_1.pk)
+        self.parent_ids = [self.root.pk, child_1.pk, child_2.pk, grandchild.pk]
+
+    def post_comment(self, parent_id):
+        return XtdComment.objects.create(
+            content_type=self.article_ct,
+            object_pk=self.article.id,
+            content_object=self.article,
+            site=self.site,
+            comment="concurrent comment",
+            submit_date=datetime.now(),
+            parent_id=parent_id,
+        )
+
+    def post_replies(self, seed, errors):
+        rand = random.Random(seed)
+        try:
+            for _ in range(self.replies_per_thread):
+                self.post_comment(rand.choice(self.parent_ids))
+        except Exception as exc:  # noqa: BLE001
+            errors.append(exc)
+        finally:
+            connection.close()
+
+    def post_concurrent_replies(self):
+        errors = []
+        threads = [
+            threading.Thread(target=self.post_replies, args=(seed, errors))
+            for seed in range(self.num_threads)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def assert_thread_is_consistent(self):
+        comments = list(XtdComment.objects.filter(thread_id=self.root.pk))
+        expected = 4 + self.num_threads * self.replies_per_thread
+        self.assertEqual(len(comments), expected)
+        orders = [cm.order for cm in comments]
+        self.assertEqual(len(set(orders)), len(orders))
+        # The path is built out of the comment ids, so it is not affected
+        # by the order computed for each reply.
+        by_path = sorted(comments, key=lambda cm: cm.path)
+        self.assertEqual(comments, by_path)
+        for cm in comments:
+            prefix = f"{cm.path}/"
+            nested = [
+                other for other in comments if other.path.startswith(prefix)
+            ]
+            self.assertEqual(cm.nested_count, len(nested))
+
+    def test_concurrent_replies(self):
+        self.post_concurrent_replies()
+        self.assert_thread_is_consistent()
+
+    @patch.multiple(
+        "django_comments_xtd.conf.settings", COMMENTS_XTD_ORDER_GAP=4
+    )
+    def test_concurrent_replies_with_sparse_order(self):
+        self.post_concurrent_replies()
+        self.assert_thread_is_consistent()
+
+
+def tree_to_pks(dic_list):
+    return [
+        (item["comment"].pk, tree_to_pks(item["children"])) for item in dic_list
+    ]
+
+
+class TreeFromQuerysetTestCase(ArticleBaseTestCase):
+    def setUp(self):
+        super().setUp()
+        thread_test_step_1(self.article_1)
+        thread_test_step_2(self.article_1)
+        thread_test_step_3(self.article_1)
+        thread_test_step_4(self.article_1)
+        thread_test_step_5(self.article_1)
+        thread_test_step_6(self.article_1)
+        self.user = AnonymousUser()
+
+    def test_tree_from_queryset(self):
+        tree = XtdComment.tree_from_queryset(
+            XtdComment.objects.all(), user=self.user
+        )
+        self.assertEqual(
+            tree_to_pks(tree),
+            [
+                (1, [(3, [(8, [(11, [])])]), (4, [(7, [(10, [])])])]),
+                (2, [(5, [(6, [])])]),
+                (9, []),
+            ],
+        )
+
+    def test_comments_whose_parent_is_missing_are_left_out(self):
+        queryset = XtdComment.objects.exclude(pk__in=[3, 5])
+        tree = XtdComment.tree_from_queryset(queryset, user=self.user)
+        self.assertEqual(
+            tree_to_pks(tree),
+            [(1, [(4, [(7, [(10, [])])])]), (2, []), (9, [])],
+        )
+
+    def test_first_comment_starts_the_top_level(self):
+        queryset = XtdComment.objects.filter(thread_id=1).exclude(pk=1)
+        tree = XtdComment.tree_from_queryset(queryset, user=self.user)
+        self.assertEqual(
+            tree_to_pks(tree), [(3, [(8, [(11, [])])]), (4, [(7, [(10, [])])])]
+        )
+
+
+class AggregatedFlagsTreeFromQuerysetTestCase(ArticleBaseTestCase):
+    def setUp(self):
+        super().setUp()
+        thread_test_step_1(self.article_1)
+        thread_test_step_2(self.article_1)
+        self.users = [
+            User.objects.create_user(f"user{i}", f"user{i}@example.com")
+            for i in range(4)
+        ]
+        self.user = self.users[0]
+        self.user.user_permissions.add(
+            Permission.objects.get(
+                content_type__app_label="django_comments",
+                codename="can_moderate",
+            )
+        )
+        self.user = User.objects.get(pk=self.user.pk)
+        for user in self.users:
+            self.add_flag(1, user, LIKEDIT_FLAG)
+        self.add_flag(1, self.users[1], CommentFlag.SUGGEST_REMOVAL)
+        self.add_flag(2, self.users[1], DISLIKEDIT_FLAG)
+        self.add_flag(2, self.users[2], DISLIKEDIT_FLAG)
+        self.add_flag(3, self.user, DISLIKEDIT_FLAG)
+        self.add_flag(3, self.user, CommentFlag.SUGGEST_REMOVAL)
+
+    def add_flag(self, comment_pk, user, flag):
+        CommentFlag.objects.create(comment_id=comment_pk, user=user, flag=flag)
+
+    def get_tree_items(self, **kwargs):
+        tree = XtdComment.tree_from_queryset(
+            XtdComment.objects.all(),
+            with_flagging=True,
+            with_feedback=True,
+            user=self.user,
+            aggregate_flags=True,
+            **kwargs,
+        )
+        items = {}
+        nodes = list(tree)
+        while nodes:
+            node = nodes.pop()
+            items[node["comment"].pk] = node
+            nodes.extend(node["children"])
+        return items
+
+    def test_counts_and_user_flags(self):
+        items = self.get_tree_items()
+        self.assertEqual(len(items), 4)
+        expected = {
+            # pk: (likedit, dislikedit, likes, dislikes, flagged, flags)
+            1: (True, False, 4, 0, [], 1),
+            2: (False, False, 0, 2, [], 0),
+            3: (False, True, 0, 1, [self.user], 1),
+            4: (False, False, 0, 0, [], 0),
+        }
+        for pk, values in expected.items():
+            item = items[pk]
+            self.assertEqual(
+                (
+                    item["likedit"],
+                    item["dislikedit"],
+                    item["likedit_count"],
+                    item["dislikedit_count"],
+                    item["flagged"],
+                    item["flagged_count"],
+                ),
+                values,
+            )
+            self.assertNotIn("likedit_users", item)
+
+    def test_number_of_queries_does_not_depend_on_flags(self):
+        self.get_tree_items()  # Load the user's permissions cache.
+        # One query for the comments and one for the user's flags.
+        with self.assertNumQueries(2):
+            self.get_tree_items()
+        for user in self.users[1:]:
+            self.add_flag(4, user, LIKEDIT_FLAG)
+            self.add_flag(4, user, CommentFlag.SUGGEST_REMOVAL)
+        with self.assertNumQueries(2):
+            items = self.get_tree_items()
+        self.assertEqual(items[4]["likedit_count"], 3)
+        self.assertEqual(items[4]["flagged_count"], 3)
+
+    def test_anonymous_user_does_not_fetch_user_flags(self):
+        tree = XtdComment.tree_from_queryset(
+            XtdComment.objects.all(),
+            with_flagging=True,
+            with_feedback=True,
+            user=AnonymousUser(),
+            aggregate_flags=True,
+        )
+        self.assertEqual(tree[0]["likedit_count"], 4)
+        self.assertFalse(tree[0]["likedit"])
+        self.assertNotIn("flagged_count", tree[0])
+
+
+class TmpXtdCommentTestCase(ArticleBaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmp_comment = TmpXtdComment(
+            content_type=ContentType.objects.get_for_model(Article),
+            object_pk=self.article_1.pk,
+            content_object=self.article_1,
+            comment="c1",
+            followup=True,
+        )
+
+    def test_unpickling_does_not_hit_the_database(self):
+        data = pickle.dumps(self.tmp_comment)
+        pickle.loads(data)  # Load the content type cache.
+        with self.assertNumQueries(0):
+            tmp_comment = pickle.loads(data)
+        self.assertEqual(tmp_comment.comment, "c1")
+        self.assertNotIn("content_object", tmp_comment)
+
+    def test_content_object_is_fetched_on_first_access(self):
+        tmp_comment = pickle.loads(pickle.dumps(self.tmp_comment))
+        with self.assertNumQueries(1):
+            self.assertEqual(tmp_comment.content_object, self.article_1)
+        with self.assertNumQueries(0):
+            self.assertEqual(tmp_comment["content_object"], self.article_1)
+        self.assertIsNone(tmp_comment.xtd_comment)
@@ -8,8 +8,14 @@ from django.test import RequestFactory, TestCase
 from django.urls import reverse
 from django_comments.models import CommentFlag
 
-from django_comments_xtd import views
-from django_comments_xtd.models import DISLIKEDIT_FLAG, LIKEDIT_FLAG
+from django_comments_xtd import blacklist, views
+from django_comments_xtd.models import (
+    DISLIKEDIT_FLAG,
+    LIKEDIT_FLAG,
+    BlackListedDomain,
+    TmpXtdComment,
+)
+from django_comments_xtd.moderation import SpamModerator
 from django_comments_xtd.tests.models import Diary
 from django_comments_xtd.tests.test_views import (
     confirm_comment_url,
@@ -395,3 +401,57 @@ class FlaggingLikedItAndDislikedIt(TestCase):
             comment=comment, user=self.user, flag=DISLIKEDIT_FLAG
         )
         self.assertTrue(flags.count() == 1)
+
+
+class SpamModeratorTestCase(TestCase):
+    def setUp(self):
+        blacklist.invalidate_blacklist_matcher()
+        self.addCleanup(blacklist.invalidate_blacklist_matcher)
+        BlackListedDomain.objects.create(domain="spam.example")
+        BlackListedDomain.objects.create(domain="*.Junk.Example.")
+        self.moderator = SpamModerator(Diary)
+        self.diary_entry = Diary.objects.create(
+            body="What I did on October...",
+            allow_comments=True,
+            publish=datetime.now(),
+        )
+
+    def allow(self, email):
+        comment = TmpXtdComment(user_email=email)
+        request = request_factory.get("/")
+        return self.moderator.allow(comment, self.diary_entry, request)
+
+    def test_blacklisted_domains_and_subdomains_are_discarded(self):
+        self.assertFalse(self.allow("bob@spam.example"))
+        self.assertFalse(self.allow("bob@mail.spam.example"))
+        self.assertFalse(self.allow("bob@MAIL.Junk.example"))
+        self.assertTrue(self.allow("bob@example"))
+        self.assertTrue(self.allow("bob@notspam.example"))
+        self.assertTrue(self.allow("bob@spam.example.com"))
+        self.assertFalse(self.allow("bob"))
+
+    def test_domains_are_not_queried_per_comment(self):
+        self.allow("bob@example.com")
+        with self.assertNumQueries(0):
+            self.assertTrue(self.allow("alice@example.com"))
+            self.assertFalse(self.allow("alice@spam.example"))
+
+    def test_matcher_is_reloaded_when_domains_change(self):
+        self.assertTrue(self.allow("bob@new.example"))
+        domain = BlackListedDomain.objects.create(domain="new.example")
+        self.assertFalse(self.allow("bob@new.example"))
+        domain.delete()
+        self.assertTrue(self.allow("bob@new.example"))
+
+    def test_matcher_is_reloaded_after_ttl(self):
+        self.assertTrue(self.allow("bob@new.example"))
+        # Changes made by another process don't send signals here.
+        BlackListedDomain.objects.bulk_create(
+            [BlackListedDomain(domain="new.example")]
+        )
+        self.assertTrue(self.allow("bob@new.example"))
+        with patch.multiple(
+            "django_comments_xtd.conf.settings",
+            COMMENTS_XTD_BLACKLIST_TTL=0,
+        ):
+            self.assertFalse(self.allow("bob@new.example"))
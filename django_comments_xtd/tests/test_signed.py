@@ -0,0 +1,100 @@
+from datetime import datetime
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.contrib.contenttypes.models import ContentType
+from django.test import TestCase
+
+from django_comments_xtd import signed
+from django_comments_xtd.models import TmpXtdComment
+from django_comments_xtd.tests.models import Article
+
+
+class SignedCommentTestCase(TestCase):
+    def setUp(self):
+        self.article = Article.objects.create(
+            title="September", slug="september", body="During September..."
+        )
+        self.comment = TmpXtdComment(
+            content_type=ContentType.objects.get_for_model(self.article),
+            object_pk=str(self.article.pk),
+            content_object=self.article,
+            site_id=1,
+            user_name="Bob",
+            user_email="bob@example.com",
+            user_url="",
+            comment="Nice September you had...",
+            submit_date=datetime(2025, 4, 7, 10, 30, 15, 123456),
+            ip_address="127.0.0.1",
+            is_public=True,
+            is_removed=False,
+            thread_id=0,
+            parent_id=0,
+            level=0,
+            order=1,
+            followup=True,
+        )
+
+    def assert_same_comment(self, tmp_comment):
+        self.assertIsInstance(tmp_comment, TmpXtdComment)
+        expected = {
+            k: v for k, v in self.comment.items() if k != "content_object"
+        }
+        self.assertEqual(dict(tmp_comment), expected)
+        self.assertEqual(tmp_comment.content_object, self.article)
+
+    def test_dumps_comment_uses_version_2(self):
+        key = signed.dumps_comment(self.comment, extra_key=b"salt")
+        self.assertTrue(key.startswith(b"v2:"))
+        self.assertLess(
+            len(key),
+            len(signed.dumps(self.comment, compress=True, extra_key=b"salt")),
+        )
+        self.assert_same_comment(signed.loads(key, extra_key=b"salt"))
+
+    def test_loads_version_2_with_wrong_key(self):
+        key = signed.dumps_comment(self.comment, extra_key=b"salt")
+        with self.assertRaises(signed.BadSignature):
+            signed.loads(key, extra_key=b"other salt")
+        with self.assertRaises(signed.BadSignature):
+            signed.loads(key[:-1], extra_key=b"salt")
+
+    def test_extra_fields_are_kept(self):
+        self.comment["custom_field"] = ["a", 1]
+        key = signed.dumps_comment(self.comment)
+        self.assertTrue(key.startswith(b"v2:"))
+        self.assertEqual(signed.loads(key).custom_field, ["a", 1])
+
+    def test_values_not_serializable_fall_back_to_pickle(self):
+        self.comment["custom_field"] = {1, 2}
+        key = signed.dumps_comment(self.comment)
+        self.assertFalse(key.startswith(b"v2:"))
+        self.assertEqual(signed.loads(key).custom_field, {1, 2})
+
+    def test_loads_pickled_comments(self):
+        key = signed.dumps(self.comment, compress=True, extra_key=b"salt")
+        self.assert_same_comment(signed.loads(key, extra_key=b"salt"))
+
+    @patch.multiple(
+        "django_comments_xtd.conf.settings",
+        COMMENTS_XTD_ACCEPT_PICKLED_KEYS=False,
+    )
+    def test_pickled_comments_can_be_rejected(self):
+        key = signed.dumps(self.comment, compress=True)
+        with self.assertRaises(signed.BadSignature):
+            signed.loads(key)
+        key = signed.dumps_comment(self.comment)
+        self.assert_same_comment(signed.loads(key))
+
+    @patch.multiple(
+        "django_comments_xtd.conf.settings",
+        COMMENTS_XTD_ACCEPT_PICKLED_KEYS=False,
+    )
+    def test_values_not_serializable_without_pickle(self):
+        self.comment["custom_field"] = Decimal("1.50")
+        key = signed.dumps_comment(self.comment)
+        self.assertTrue(key.startswith(b"v2:"))
+        self.assertEqual(signed.loads(key).custom_field, "1.50")
+        self.comment["custom_field"] = {1, 2}
+        with self.assertRaises(TypeError):
+            signed.dumps_comment(self.comment)
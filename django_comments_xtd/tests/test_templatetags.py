@@ -1,9 +1,19 @@
-from django.contrib.auth.models import AnonymousUser
-from django.template import Context, Template
+from pathlib import Path
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.template import Context, Template, TemplateSyntaxError
+from django.test import RequestFactory, override_settings
 from django.test import TestCase as DjangoTestCase
+from django.test.utils import CaptureQueriesContext
+from django_comments.models import CommentFlag
 
-from django_comments_xtd.models import XtdComment
-from django_comments_xtd.tests.models import Article, Diary
+from django_comments_xtd import utils
+from django_comments_xtd.models import LIKEDIT_FLAG, XtdComment
+from django_comments_xtd.tests.models import Article, Diary, Quote
 from django_comments_xtd.tests.test_models import (
     add_comment_to_diary_entry,
     thread_test_step_1,
@@ -44,6 +54,82 @@ class GetXtdCommentCountTestCase(DjangoTestCase):
         )
         self.assertEqual(Template(t).render(Context()), "3")
 
+    def test_get_xtdcomment_counts(self):
+        thread_test_step_1(self.article_1)
+        t = Template(
+            "{% load comments_xtd %}"
+            "{% get_xtdcomment_counts for objects as counts %}"
+            "{% for obj, count in counts %}{{ obj.slug }}:{{ count }} {% endfor %}"
+        )
+        objects = [self.article_1, self.article_2]
+        self.assertEqual(
+            t.render(Context({"objects": objects})), "september:2 october:0 "
+        )
+
+    def test_xtd_comment_count_filter(self):
+        thread_test_step_1(self.article_1)
+        thread_test_step_2(self.article_1)
+        t = Template("{% load comments_xtd %}{{ article|xtd_comment_count }}")
+        self.assertEqual(t.render(Context({"article": self.article_1})), "4")
+        self.assertEqual(t.render(Context({"article": self.article_2})), "0")
+
+
+class ContentTypeLookupTestCase(DjangoTestCase):
+    @patch.object(utils, "_content_types_loaded", False)
+    def test_templates_are_compiled_with_cached_content_types(self):
+        ContentType.objects.clear_cache()
+        # Loads the content types of all the models at once.
+        with self.assertNumQueries(1):
+            Template(
+                "{% load comments_xtd %}"
+                "{% get_xtdcomment_count as varname for tests.article %}"
+            )
+        with self.assertNumQueries(0):
+            Template(
+                "{% load comments_xtd %}"
+                "{% get_last_xtdcomments 5 as last for tests.diary %}"
+                "{% get_who_can_post for tests.quote as who_can_post %}"
+            )
+
+    def test_unknown_content_type(self):
+        with self.assertRaisesMessage(
+            TemplateSyntaxError,
+            "ContentType 'tests.unknown' used for tag "
+            "'get_xtdcomment_count' doesn't exist",
+        ):
+            Template(
+                "{% load comments_xtd %}"
+                "{% get_xtdcomment_count as varname for tests.unknown %}"
+            )
+
+
+class WhoCanPostTestCase(DjangoTestCase):
+    def test_get_who_can_post(self):
+        t = (
+            "{% load comments_xtd %}"
+            "{% get_who_can_post for tests.quote as who_can_post %}"
+            "{{ who_can_post }}"
+        )
+        self.assertEqual(Template(t).render(Context()), "users")
+
+    def test_can_receive_comments_from(self):
+        article = Article.objects.create(
+            title="September", slug="september", body="During September..."
+        )
+        quote = Quote.objects.create(
+            title="Unusual farewell", slug="farewell", quote="I will be back."
+        )
+        t = Template(
+            "{% load comments_xtd %}{{ object|can_receive_comments_from:user }}"
+        )
+        user = AnonymousUser()
+        self.assertEqual(
+            t.render(Context({"object": article, "user": user})), "True"
+        )
+        self.assertEqual(
+            t.render(Context({"object": quote, "user": user})), "False"
+        )
+
 
 class LastXtdCommentsTestCase(DjangoTestCase):
     def setUp(self):
@@ -92,6 +178,48 @@ class LastXtdCommentsTestCase(DjangoTestCase):
         # the first one must not be rendered in the output.
         self.assertEqual(output.count("<comment>1</comment>"), 0)
 
+    def test_last_xtdcomments_are_fetched_once(self):
+        t = Template(
+            "{% load comments_xtd %}"
+            "{% get_last_xtdcomments 5 as last_comments"
+            "   for tests.article tests.diary %}"
+            "{{ last_comments|length }}"
+            "{% render_last_xtdcomments 5 for tests.article tests.diary %}"
+        )
+        with CaptureQueriesContext(connection) as queries:
+            output = t.render(Context())
+        comment_queries = [
+            query
+            for query in queries.captured_queries
+            if 'FROM "django_comments_xtd_xtdcomment"' in query["sql"]
+        ]
+        self.assertEqual(len(comment_queries), 1)
+        self.assertTrue(output.startswith("5"))
+        self.assertEqual(output.count("<a id="), 5)
+
+    def test_render_last_xtdcomments_with_another_engine_first(self):
+        templates = [
+            {
+                "BACKEND": "django.template.backends.dummy.TemplateStrings",
+                "DIRS": [Path(utils.__file__).parent / "templates"],
+            },
+            *settings.TEMPLATES,
+        ]
+        with override_settings(TEMPLATES=templates):
+            output = Template(
+                "{% load comments_xtd %}"
+                "{% render_last_xtdcomments 5 for tests.article %}"
+            ).render(Context())
+        self.assertEqual(output.count("<a id="), 5)
+
+    def test_count_is_resolved_on_each_render(self):
+        t = Template(
+            "{% load comments_xtd %}"
+            "{% render_last_xtdcomments count for tests.article %}"
+        )
+        self.assertEqual(t.render(Context({"count": 2})).count("<a id="), 2)
+        self.assertEqual(t.render(Context({"count": 4})).count("<a id="), 4)
+
 
 class XtdCommentsTestCase(DjangoTestCase):
     def setUp(self):
@@ -146,6 +274,26 @@ class XtdCommentsTestCase(DjangoTestCase):
     def test_render_xtdcomment_tree(self):
         self._assert_all_comments_are_published()
 
+    def test_render_xtdcomment_tree_with_aggregated_flags(self):
+        user = User.objects.create_user("bob", "bob@example.com", "pwd")
+        CommentFlag.objects.create(comment_id=1, user=user, flag=LIKEDIT_FLAG)
+        CommentFlag.objects.create(
+            comment_id=3, user=user, flag=CommentFlag.SUGGEST_REMOVAL
+        )
+        request = RequestFactory().get("/")
+        request.user = user
+        t = (
+            "{% load comments_xtd %}"
+            "{% render_xtdcomment_tree for object "
+            "allow_feedback allow_flagging %}"
+        )
+        output = Template(t).render(
+            Context({"object": self.article, "user": user, "request": request})
+        )
+        self.assertEqual(output.count('<div id="c'), 9)
+        self.assertEqual(output.count("bi-hand-thumbs-up-fill"), 1)
+        self.assertEqual(output.count("comment flagged"), 1)
+
     def _assert_only_comment_2_and_3_and_their_children_are_published(self):
         t = "{% load comments_xtd %}{% render_xtdcomment_tree for object %}"
         output = Template(t).render(
@@ -1,13 +1,16 @@
-# ruff: noqa: N802
-from unittest.mock import MagicMock
+# ruff: noqa: N802, PLR2004
+from unittest.mock import MagicMock, patch
 
 import pytest
+from django.core.signals import setting_changed
+from django.template import engines, loader
 
 from django_comments_xtd import utils
+from django_comments_xtd.models import XtdComment
 
 
 @pytest.mark.django_db
-def test_send_mail_uses_EmailThread(monkeypatch):
+def test_send_mail_uses_EmailWorkerPool(monkeypatch):
     monkeypatch.setattr(utils.settings, "COMMENTS_XTD_THREADED_EMAILS", True)
     utils.send_mail(
         "the subject",
@@ -16,7 +19,74 @@ def test_send_mail_uses_EmailThread(monkeypatch):
         ["fulanito@example.com"],
         html="<p>The message.</p>",
     )
-    assert utils.mail_sent_queue.get()
+    assert utils.mail_sent_queue.get(timeout=5)
+    assert utils.get_email_worker_pool() is utils.get_email_worker_pool()
+
+
+def _build_mails(count):
+    return [
+        utils._build_mail(
+            f"subject {i}", "body", "from@example.com", [f"{i}@example.com"]
+        )
+        for i in range(count)
+    ]
+
+
+def test_EmailWorkerPool_is_bounded_and_batches_messages(monkeypatch):
+    connections = []
+
+    def get_connection(**kwargs):
+        connection = MagicMock()
+        connections.append(connection)
+        return connection
+
+    monkeypatch.setattr(utils, "get_connection", get_connection)
+    pool = utils.EmailWorkerPool(max_workers=2, batch_size=10)
+    messages = _build_mails(50)
+    # Queue messages before any worker is started.
+    for message in messages:
+        pool.queue.put((message, False))
+    for message in _build_mails(2):
+        messages.append(message)
+        pool.submit(message)
+    assert len(pool.workers) == 2
+    pool.shutdown(timeout=5)
+    assert not any(worker.is_alive() for worker in pool.workers)
+    # Every message has been sent through the connection of its batch.
+    assert len(connections) >= 6
+    sent = [
+        message
+        for connection in connections
+        for (batch,), _ in connection.send_messages.call_args_list
+        for message in batch
+    ]
+    assert sorted(m.subject for m in sent) == sorted(
+        m.subject for m in messages
+    )
+    for connection in connections:
+        assert connection.send_messages.call_count <= 10
+        connection.close.assert_called_once()
+    for _ in messages:
+        utils.mail_sent_queue.get_nowait()
+
+
+def test_EmailWorkerPool_rejects_messages_after_shutdown():
+    pool = utils.EmailWorkerPool(max_workers=1, batch_size=1)
+    pool.shutdown()
+    with pytest.raises(RuntimeError):
+        pool.submit(_build_mails(1)[0])
+
+
+def test_EmailWorkerPool_keeps_working_after_an_error(monkeypatch):
+    connection = MagicMock()
+    connection.send_messages.side_effect = [Exception("Boom"), 1]
+    monkeypatch.setattr(utils, "get_connection", lambda **kw: connection)
+    pool = utils.EmailWorkerPool(max_workers=1, batch_size=1)
+    for message in _build_mails(2):
+        pool.submit(message)
+    pool.shutdown(timeout=5)
+    assert connection.send_messages.call_count == 2
+    assert utils.mail_sent_queue.get_nowait()
 
 
 @pytest.mark.django_db
@@ -34,6 +104,108 @@ def test_send_mail_uses__send_amil(monkeypatch):
     _send_mail_mock.assert_called()
 
 
+# ----------------------------------------------
+def _recipient_templates(*sources):
+    return [engines["django"].from_string(source) for source in sources]
+
+
+def _recipients():
+    return [
+        {"user_name": name, "mute_url": f"/mute/{i}/", "mute_url_short": "/m"}
+        for i, name in enumerate(["Joe", "Mary <mary@example.com>", "Bob"])
+    ]
+
+
+def test_RecipientMessageRenderer_renders_templates_once():
+    templates = _recipient_templates(
+        "{{ user_name }}: {{ comment }}, {{ mute_url }}",
+        "<p>{{ user_name }}</p><p>{{ comment }}</p>"
+        "<a href='{{ mute_url }}'>{{ mute_url_short }}</a>",
+    )
+    context = {"comment": "A <b>comment</b>"}
+    renderer = utils.RecipientMessageRenderer(
+        templates, context, ["user_name", "mute_url", "mute_url_short"]
+    )
+    expected = [
+        [t.render({**context, **r}) for t in templates] for r in _recipients()
+    ]
+    messages = [renderer.render(recipient) for recipient in _recipients()]
+    assert messages == expected
+    assert renderer.partials
+
+    # Once checked, templates are not rendered again.
+    with patch.object(type(templates[0]), "render") as render_mock:
+        renderer.render(_recipients()[1])
+    render_mock.assert_not_called()
+
+
+def test_RecipientMessageRenderer_falls_back_to_render_in_full():
+    templates = _recipient_templates("{{ user_name|upper }}, {{ mute_url }}")
+    renderer = utils.RecipientMessageRenderer(
+        templates, {}, ["user_name", "mute_url", "mute_url_short"]
+    )
+    messages = [renderer.render(recipient) for recipient in _recipients()]
+    assert messages == [
+        ["JOE, /mute/0/"],
+        ["MARY &lt;MARY@EXAMPLE.COM&gt;, /mute/1/"],
+        ["BOB, /mute/2/"],
+    ]
+    assert renderer.partials is False
+
+
+def test_RecipientMessageRenderer_renders_in_full_branching_templates():
+    templates = _recipient_templates(
+        'Hi {{ user_name|default:"friend" }}'
+        '{% if user_name == "Joe" %} (vip){% endif %}, {{ mute_url }}'
+    )
+    renderer = utils.RecipientMessageRenderer(
+        templates, {}, ["user_name", "mute_url", "mute_url_short"]
+    )
+    assert renderer.partials is False
+    recipients = [
+        {"user_name": "Bob", "mute_url": "/a/", "mute_url_short": "/a"},
+        {"user_name": "", "mute_url": "/b/", "mute_url_short": "/b"},
+        {"user_name": "Joe", "mute_url": "/c/", "mute_url_short": "/c"},
+    ]
+    messages = [renderer.render(recipient) for recipient in recipients]
+    assert messages == [
+        ["Hi Bob, /a/"],
+        ["Hi friend, /b/"],
+        ["Hi Joe (vip), /c/"],
+    ]
+
+
+@pytest.mark.parametrize(
+    "source, expected",
+    [
+        ("{% for i in items %}{{ user_name }}{% endfor %}", True),
+        (
+            (
+                "{% load i18n %}{% blocktrans %}Hi {{ user_name }}"
+                "{% endblocktrans %}"
+            ),
+            True,
+        ),
+        ("{{ user_name.title }}", False),
+        ("{% with name=user_name %}{{ name }}{% endwith %}", False),
+        ("{% filter upper %}{{ user_name }}{% endfilter %}", False),
+        ("{% firstof user_name 'friend' %}", False),
+        ("{% include 'django_comments_xtd/comment.html' %}", False),
+    ],
+)
+def test_can_substitute_variables(source, expected):
+    (template,) = _recipient_templates(source)
+    assert utils.can_substitute_variables(template, ["user_name"]) is expected
+
+
+def test_can_substitute_variables_in_followup_templates():
+    for name in ["email_followup_comment.txt", "email_followup_comment.html"]:
+        template = loader.get_template(f"django_comments_xtd/{name}")
+        assert utils.can_substitute_variables(
+            template, ["user_name", "mute_url", "mute_url_short"]
+        )
+
+
 # ----------------------------------------------
 @pytest.mark.django_db
 def test_get_app_model_options_without_args():
@@ -105,4 +277,46 @@ def test_get_app_model_options_with_content_type_valid(
         "allow_flagging": False,
         "allow_feedback": False,
         "show_feedback": False,
-    }
\ No newline at end of file
+    }
+
+
+@pytest.mark.django_db
+def test_get_app_model_options_does_not_fetch_the_content_object(
+    an_articles_comment, monkeypatch, django_assert_num_queries
+):
+    monkeypatch.setattr(
+        utils.settings,
+        "COMMENTS_XTD_APP_MODEL_OPTIONS",
+        mock_options_settings,
+    )
+    comment = XtdComment.objects.get(pk=an_articles_comment.pk)
+    utils.get_app_model_options(comment=comment)  # Warm up the caches.
+    comment = XtdComment.objects.get(pk=an_articles_comment.pk)
+    with django_assert_num_queries(0):
+        options = utils.get_app_model_options(comment=comment)
+    assert options["allow_flagging"] is False
+    # The merged options are shared, and can't be modified.
+    assert utils.get_app_model_options(comment=comment) is options
+    assert utils.get_app_model_options(content_type="tests.article") is options
+    with pytest.raises(TypeError):
+        options["allow_flagging"] = True
+
+
+@pytest.mark.django_db
+def test_get_app_model_options_follows_setting_changes(monkeypatch):
+    options = utils.get_app_model_options(content_type="tests.article")
+    assert options["allow_feedback"] is False
+    monkeypatch.setattr(
+        utils.settings,
+        "COMMENTS_XTD_APP_MODEL_OPTIONS",
+        mock_options_settings,
+    )
+    options = utils.get_app_model_options(content_type="tests.diary")
+    assert options == mock_options_settings["default"]
+    setting_changed.send(
+        sender=None,
+        setting="COMMENTS_XTD_APP_MODEL_OPTIONS",
+        value=None,
+        enter=False,
+    )
+    assert utils._app_model_options is None
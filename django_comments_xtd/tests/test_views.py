@@ -9,8 +9,10 @@ import django_comments
 from django.contrib.auth.models import AnonymousUser, Permission, User
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.sites.models import Site
-from django.http import HttpRequest
+from django.db import connection
+from django.http import Http404, HttpRequest
 from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django_comments.models import CommentFlag
 from django_comments.views import comments
@@ -20,10 +22,12 @@ from django_comments_xtd.conf import settings
 from django_comments_xtd.models import (
     DISLIKEDIT_FLAG,
     LIKEDIT_FLAG,
+    OutboxEmail,
     TmpXtdComment,
     XtdComment,
 )
 from django_comments_xtd.tests.models import Article, Diary, Quote
+from django_comments_xtd.utils import get_mute_key, load_mute_key
 from django_comments_xtd.views import (
     on_comment_was_posted,
     on_comment_will_be_posted,
@@ -761,6 +765,51 @@ class ConfirmCommentTestCase(TestCase):
         self.assertEqual(self.mock_mailer.call_count, 2)
 
 
+@patch.multiple("django_comments_xtd.conf.settings", COMMENTS_XTD_OUTBOX=True)
+class NotifyFollowersOutboxTestCase(TestCase):
+    def setUp(self):
+        self.article = Article.objects.create(
+            title="September", slug="september", body="John's September"
+        )
+        site = Site.objects.get(pk=1)
+        for name in ["Alice", "Bob", "Charlie"]:
+            XtdComment.objects.create(
+                content_object=self.article,
+                site=site,
+                user_name=name,
+                user_email=f"{name.lower()}@example.com",
+                comment=f"{name}'s comment.",
+                followup=True,
+            )
+        self.comment = XtdComment.objects.create(
+            content_object=self.article,
+            site=site,
+            user_name="Dave",
+            user_email="dave@example.com",
+            comment="A comment by Dave.",
+            followup=True,
+        )
+
+    def test_notifications_are_queued_in_one_query(self):
+        with CaptureQueriesContext(connection) as ctx:
+            views.notify_comment_followers(self.comment)
+        inserts = [
+            query["sql"]
+            for query in ctx.captured_queries
+            if query["sql"].startswith("INSERT")
+        ]
+        self.assertEqual(len(inserts), 1)
+        self.assertIn(OutboxEmail._meta.db_table, inserts[0])
+        self.assertEqual(
+            sorted(
+                email.recipient_list[0] for email in OutboxEmail.objects.all()
+            ),
+            ["alice@example.com", "bob@example.com", "charlie@example.com"],
+        )
+        for email in OutboxEmail.objects.all():
+            self.assertIn("A comment by Dave.", email.body)
+
+
 class ReplyNoCommentTestCase(TestCase):
     def test_reply_non_existing_comment_raises_404(self):
         response = self.client.get(
@@ -966,6 +1015,71 @@ class MuteFollowUpTestCase(TestCase):
             self.mock_mailer.call_count == expected_mailer_call_count
         )
 
+    def test_mute_key_is_compact(self):
+        self.assertLess(len(self.bobs_mutekey), 100)
+        self.assertNotIn("bob", self.bobs_mutekey)
+        self.get_mute_followup_url(self.bobs_mutekey)
+        bobs_comment = XtdComment.objects.get(user_email="bob@example.com")
+        self.assertFalse(bobs_comment.followup)
+        self.assertTrue(
+            XtdComment.objects.get(user_email="alice@example.com").followup
+        )
+
+    def test_mute_followup_with_legacy_key(self):
+        bobs_comment = XtdComment.objects.get(user_email="bob@example.com")
+        key = signed.dumps(
+            bobs_comment, compress=True, extra_key=settings.COMMENTS_XTD_SALT
+        ).decode("utf-8")
+        self.get_mute_followup_url(key)
+        bobs_comment.refresh_from_db()
+        self.assertFalse(bobs_comment.followup)
+
+    def test_mute_with_invalid_key(self):
+        request = request_factory.get("/")
+        response = views.mute(request, self.bobs_mutekey[:-1])
+        self.assertEqual(response.status_code, 400)
+
+    def test_mute_key_finds_the_comment_by_id(self):
+        bobs_comment = XtdComment.objects.get(user_email="bob@example.com")
+        _, _, _, comment_id = load_mute_key(self.bobs_mutekey)
+        self.assertEqual(comment_id, bobs_comment.pk)
+        with self.assertNumQueries(1):
+            tmp_comment = views._get_muting_comment(self.bobs_mutekey)
+        self.assertEqual(tmp_comment.user_email, "bob@example.com")
+
+    def test_mute_with_key_without_comment_id(self):
+        ct = ContentType.objects.get_for_model(self.article)
+        key = get_mute_key(ct.pk, self.article.pk, "bob@example.com")
+        self.get_mute_followup_url(key)
+        bobs_comment = XtdComment.objects.get(user_email="bob@example.com")
+        self.assertFalse(bobs_comment.followup)
+
+    def test_mute_all_case_variants_of_the_email(self):
+        bobs_comment = XtdComment.objects.get(user_email="bob@example.com")
+        XtdComment.objects.create(
+            content_type=bobs_comment.content_type,
+            object_pk=bobs_comment.object_pk,
+            site=bobs_comment.site,
+            user_name="Bob",
+            user_email="Bob@Example.com",
+            comment="Bob again",
+            submit_date=bobs_comment.submit_date,
+            followup=True,
+        )
+        self.get_mute_followup_url(self.bobs_mutekey)
+        self.assertFalse(
+            XtdComment.objects.filter(
+                user_email__iexact="bob@example.com", followup=True
+            ).exists()
+        )
+
+    def test_mute_with_key_of_unknown_email(self):
+        ct = ContentType.objects.get_for_model(self.article)
+        key = get_mute_key(ct.pk, self.article.pk, "nobody@example.com")
+        request = request_factory.get("/")
+        with self.assertRaises(Http404):
+            views.mute(request, key)
+
 
 class HTMLDisabledMailTestCase(TestCase):
     def setUp(self):
@@ -1012,4 +1126,4 @@ class HTMLDisabledMailTestCase(TestCase):
         self.assertEqual(response.status_code, 302)
         self.assertTrue(response.url.startswith("/comments/posted/?c="))
         self.assertTrue(self.mock_mailer.call_count == 1)
-        self.assertTrue(self.mock_mailer.call_args[1]["html"] is not None)
\ No newline at end of file
+        self.assertTrue(self.mock_mailer.call_args[1]["html"] is not None)
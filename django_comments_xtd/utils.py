@@ -1,103 +1,445 @@
-# Idea borrowed from Selwin Ong post:
-# http://ui.co.id/blog/asynchronous-send_mail-in-django
-
+import atexit
 import hashlib
+import logging
 import queue
+import re
 import threading
+import uuid
+from types import MappingProxyType
 from urllib.parse import urlencode
 
-
+from django.apps import apps
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.sites.shortcuts import get_current_site
-from django.core.mail import EmailMultiAlternatives
+from django.core import signing
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.template.base import (
+    FilterExpression,
+    NodeList,
+    TokenType,
+    Variable,
+    VariableNode,
+)
+from django.template.defaulttags import ForNode, IfNode, WithNode
+from django.template.loader_tags import BlockNode, ExtendsNode, IncludeNode
+from django.template.smartif import TokenBase
+from django.templatetags.i18n import BlockTranslateNode
 from django.utils.crypto import salted_hmac
+from django.utils.encoding import force_str
+from django.utils.html import conditional_escape
 
 from django_comments_xtd.conf import settings
 from django_comments_xtd.conf.defaults import COMMENTS_XTD_APP_MODEL_OPTIONS
 
+logger = logging.getLogger(__name__)
+
 mail_sent_queue = queue.Queue()
 
+MUTE_KEY_SALT = "django_comments_xtd.mute"
 
-# ruff:noqa: PLR0913
-class EmailThread(threading.Thread):
-    def __init__(
-        self, subject, body, from_email, recipient_list, fail_silently, html
-    ):
-        self.subject = subject
-        self.body = body
-        self.recipient_list = recipient_list
-        self.from_email = from_email
-        self.fail_silently = fail_silently
-        self.html = html
-        threading.Thread.__init__(self)
-
-    def run(self):
-        _send_mail(
-            self.subject,
-            self.body,
-            self.from_email,
-            self.recipient_list,
-            self.fail_silently,
-            self.html,
+
+class EmailWorkerPool:
+    """
+    Send emails in a bounded number of background threads.
+
+    Messages are put in a queue, from which up to `max_workers` threads
+    take them in batches of up to `batch_size` messages. Each batch is sent
+    through a single connection to the email backend.
+    """
+
+    def __init__(self, max_workers, batch_size):
+        self.max_workers = max(1, max_workers)
+        self.batch_size = max(1, batch_size)
+        self.queue = queue.Queue()
+        self.workers = []
+        self.lock = threading.Lock()
+        self.is_shutdown = False
+
+    def submit(self, message, fail_silently=False):
+        with self.lock:
+            if self.is_shutdown:
+                raise RuntimeError("The email worker pool has been shut down.")
+            self.queue.put((message, fail_silently))
+            self.workers = [w for w in self.workers if w.is_alive()]
+            if len(self.workers) < self.max_workers:
+                worker = threading.Thread(
+                    target=self.work, name="django_comments_xtd-email"
+                )
+                worker.daemon = True
+                worker.start()
+                self.workers.append(worker)
+
+    def work(self):
+        stop = False
+        while not stop:
+            item = self.queue.get()
+            if item is None:
+                break
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self.send_batch(batch)
+
+    def send_batch(self, batch):
+        connection = get_connection(
+            fail_silently=all(fail_silently for _, fail_silently in batch)
         )
-        mail_sent_queue.put(True)
+        try:
+            connection.open()
+            for message, fail_silently in batch:
+                message.connection = connection
+                try:
+                    message.send(fail_silently)
+                except Exception:
+                    logger.exception("Error sending email %r.", message.subject)
+                else:
+                    mail_sent_queue.put(True)
+        except Exception:
+            logger.exception("Error opening the email connection.")
+        finally:
+            connection.close()
 
+    def shutdown(self, timeout=None):
+        """Send the queued messages and stop the workers."""
+        with self.lock:
+            if self.is_shutdown:
+                return
+            self.is_shutdown = True
+            workers = [w for w in self.workers if w.is_alive()]
+            for _ in workers:
+                self.queue.put(None)
+        for worker in workers:
+            worker.join(timeout)
 
-def _send_mail(
-    subject, body, from_email, recipient_list, fail_silently=False, html=None
-):
+
+_email_worker_pool = None
+_email_worker_pool_lock = threading.Lock()
+
+
+def get_email_worker_pool():
+    global _email_worker_pool  # noqa: PLW0603
+    with _email_worker_pool_lock:
+        if _email_worker_pool is None:
+            _email_worker_pool = EmailWorkerPool(
+                settings.COMMENTS_XTD_EMAIL_WORKERS,
+                settings.COMMENTS_XTD_EMAIL_BATCH_SIZE,
+            )
+            atexit.register(_email_worker_pool.shutdown)
+        return _email_worker_pool
+
+
+def _build_mail(subject, body, from_email, recipient_list, html=None):
     msg = EmailMultiAlternatives(subject, body, from_email, recipient_list)
     if html:
         msg.attach_alternative(html, "text/html")
+    return msg
+
+
+# ruff:noqa: PLR0913
+def _send_mail(
+    subject, body, from_email, recipient_list, fail_silently=False, html=None
+):
+    msg = _build_mail(subject, body, from_email, recipient_list, html)
     msg.send(fail_silently)
 
 
+def queue_mails(messages):
+    """
+    Queue `messages`, given as tuples (subject, body, from_email,
+    recipient_list, html), in the model OutboxEmail with a single query.
+    """
+    from django_comments_xtd.models import OutboxEmail  # noqa: PLC0415
+
+    OutboxEmail.objects.bulk_create(
+        [
+            OutboxEmail(
+                subject=subject,
+                body=body,
+                html=html or "",
+                from_email=from_email,
+                recipient_list=list(recipient_list),
+            )
+            for subject, body, from_email, recipient_list, html in messages
+        ]
+    )
+
+
 def send_mail(
     subject, body, from_email, recipient_list, fail_silently=False, html=None
 ):
-    if settings.COMMENTS_XTD_THREADED_EMAILS:
-        EmailThread(
-            subject, body, from_email, recipient_list, fail_silently, html
-        ).start()
+    if settings.COMMENTS_XTD_OUTBOX:
+        queue_mails([(subject, body, from_email, recipient_list, html)])
+    elif settings.COMMENTS_XTD_THREADED_EMAILS:
+        msg = _build_mail(subject, body, from_email, recipient_list, html)
+        get_email_worker_pool().submit(msg, fail_silently)
     else:
         _send_mail(
             subject, body, from_email, recipient_list, fail_silently, html
         )
 
 
+# Tags whose content is rendered as is, when their arguments don't refer to
+# the recipient fields.
+TRANSPARENT_NODES = (BlockNode, ForNode, IfNode, WithNode)
+
+
+def _refers_to(value, names):
+    """Whether the tag argument `value` refers to any of the `names`."""
+    if isinstance(value, NodeList):
+        return False
+    if isinstance(value, FilterExpression):
+        return _refers_to(value.var, names) or any(
+            _refers_to(arg, names)
+            for _, args in value.filters
+            for _, arg in args
+        )
+    if isinstance(value, Variable):
+        return bool(value.lookups) and value.lookups[0] in names
+    if isinstance(value, TokenBase):
+        return _refers_to(list(vars(value).values()), names)
+    if isinstance(value, dict):
+        return _refers_to(list(value.values()), names)
+    if isinstance(value, (list, tuple)):
+        return any(_refers_to(item, names) for item in value)
+    return False
+
+
+def _outputs_plain_variables(nodelist, names, transparent=True):
+    """
+    Whether the nodes only output the variables `names` as they are, in
+    `{{ name }}` without filters or in `{% blocktranslate %}`, within tags
+    that render their content as is.
+    """
+    for node in nodelist:
+        if isinstance(node, VariableNode):
+            var = node.filter_expression.var
+            if _refers_to(node.filter_expression, names) and (
+                not transparent
+                or node.filter_expression.filters
+                or len(var.lookups) > 1
+            ):
+                return False
+            continue
+        if isinstance(node, BlockTranslateNode):
+            tokens = node.singular + (node.plural or [])
+            if any(
+                token.token_type == TokenType.VAR and token.contents in names
+                for token in tokens
+            ) and (not transparent or node.asvar):
+                return False
+        # The included or parent templates can't be checked, nor the tags
+        # that read the context by themselves.
+        if isinstance(node, (ExtendsNode, IncludeNode)) or getattr(
+            node, "takes_context", False
+        ):
+            return False
+        if _refers_to(list(vars(node).values()), names):
+            return False
+        nested_transparent = transparent and isinstance(node, TRANSPARENT_NODES)
+        for attr in node.child_nodelists:
+            child_nodelist = getattr(node, attr, None)
+            if child_nodelist and not _outputs_plain_variables(
+                child_nodelist, names, nested_transparent
+            ):
+                return False
+    return True
+
+
+def can_substitute_variables(template, names):
+    """
+    Whether the variables `names` can be substituted in the output of the
+    given template, because it only outputs them, escaped, as they are.
+    Templates of engines other than DjangoTemplates are never substituted.
+    """
+    django_template = getattr(template, "template", None)
+    nodelist = getattr(django_template, "nodelist", None)
+    if nodelist is None or not django_template.engine.autoescape:
+        return False
+    return _outputs_plain_variables(nodelist, set(names))
+
+
+class RecipientMessageRenderer:
+    """
+    Render the same templates for many recipients, whose context differs
+    only in a few string variables, given in `recipient_fields`.
+
+    When every template only outputs those variables as they are (see
+    `can_substitute_variables`), the templates are rendered once with
+    placeholders in place of the variables, that are then replaced with the
+    escaped values of each recipient. The result is also checked against a
+    full render for the first recipient. Otherwise, e.g. when a template
+    applies filters to the variables or uses them in `{% if %}` tags, the
+    templates are rendered in full for every recipient.
+    """
+
+    def __init__(self, templates, context, recipient_fields):
+        self.templates = templates
+        self.context = context
+        token = uuid.uuid4().hex
+        # Terminated, so that no placeholder is a prefix of another one.
+        self.placeholders = {
+            field: f"xtd-{token}-{field}-" for field in recipient_fields
+        }
+        self.placeholder_re = re.compile(
+            "|".join(re.escape(p) for p in self.placeholders.values())
+        )
+        if all(
+            can_substitute_variables(template, recipient_fields)
+            for template in templates
+        ):
+            self.partials = None
+        else:
+            self.partials = False
+
+    def render_full(self, recipient_context):
+        context = {**self.context, **recipient_context}
+        return [template.render(context) for template in self.templates]
+
+    def substitute(self, recipient_context):
+        values = {
+            placeholder: str(conditional_escape(recipient_context[field]))
+            for field, placeholder in self.placeholders.items()
+        }
+        return [
+            self.placeholder_re.sub(lambda m: values[m.group(0)], partial)
+            for partial in self.partials
+        ]
+
+    def render(self, recipient_context):
+        """Return the list of rendered templates for a recipient."""
+        if self.partials is None:
+            messages = self.render_full(recipient_context)
+            self.partials = self.render_full(self.placeholders)
+            if self.substitute(recipient_context) != messages:
+                self.partials = False
+            return messages
+        if self.partials is False:
+            return self.render_full(recipient_context)
+        return self.substitute(recipient_context)
+
+
+class AppModelOptions:
+    """
+    The `COMMENTS_XTD_APP_MODEL_OPTIONS` of every `app_label.model`, merged
+    with the default options, for the given value of the setting.
+    """
+
+    def __init__(self, custom_opts):
+        self.custom_opts = custom_opts
+        default_opts = dict(COMMENTS_XTD_APP_MODEL_OPTIONS["default"])
+        default_opts.update(custom_opts.get("default", {}))
+        self.default = MappingProxyType(default_opts)
+        self.by_app_model = {
+            key: MappingProxyType({**default_opts, **opts})
+            for key, opts in custom_opts.items()
+            if key != "default"
+        }
+
+    def get(self, app_model):
+        return self.by_app_model.get(app_model, self.default)
+
+
+_app_model_options = None
+
+
+def _get_app_model_options_map():
+    global _app_model_options  # noqa: PLW0603
+    custom_opts = settings.COMMENTS_XTD_APP_MODEL_OPTIONS
+    options_map = _app_model_options
+    if options_map is None or options_map.custom_opts is not custom_opts:
+        options_map = _app_model_options = AppModelOptions(custom_opts)
+    return options_map
+
+
+def reset_app_model_options(setting=None, **kwargs):
+    """Discard the merged options. It's a receiver of setting_changed."""
+    global _app_model_options  # noqa: PLW0603
+    if setting in (None, "COMMENTS_XTD_APP_MODEL_OPTIONS"):
+        _app_model_options = None
+
+
 def get_app_model_options(comment=None, content_type=None):
     """
     Get the app_model_option from `COMMENTS_XTD_APP_MODEL_OPTIONS`.
 
     If a comment is given, the content_type is extracted from it. Otherwise,
-    the `content_type` kwarg has to be provided. The funcion checks whether
-    there is a matching comments option's dictionary for the `app_label.model`
-    for the `content_type` and returns it. Otherwise it returns the default
-    from:
+    the `content_type` kwarg has to be provided, either as a ContentType or
+    as an `"app_label.model"` string. The funcion checks whether there is a
+    matching comments option's dictionary for the `app_label.model` for the
+    `content_type` and returns it. Otherwise it returns the default from:
 
         `django_comments_xtd.conf.defaults.COMMENTS_XTD_APP_MODEL_OPTIONS`
-    """
-    init_opts = dict.copy(COMMENTS_XTD_APP_MODEL_OPTIONS)
-    custom_opts = dict.copy(settings.COMMENTS_XTD_APP_MODEL_OPTIONS)
-    if init_opts != custom_opts and "default" in custom_opts:
-        default_opts = dict.copy(init_opts["default"])
-        default_opts.update(custom_opts["default"])
-        init_opts["default"] = default_opts
 
+    The options are merged once per value of the setting, and the returned
+    mapping is read-only. The content type is taken from the ContentType
+    cache, so the commented object is not fetched.
+    """
+    options_map = _get_app_model_options_map()
     if comment:
-        content_type = ContentType.objects.get_for_model(comment.content_object)
-        key = f"{content_type.app_label}.{content_type.model}"
-    elif content_type:
-        key = f"{content_type.app_label}.{content_type.model}"
-    else:
-        return init_opts["default"]
+        content_type_id = getattr(comment, "content_type_id", None)
+        if content_type_id is not None:
+            content_type = ContentType.objects.get_for_id(content_type_id)
+        else:
+            content_type = comment.content_type
+
+    if not content_type:
+        return options_map.default
+    if isinstance(content_type, str):
+        return options_map.get(content_type)
+    return options_map.get(f"{content_type.app_label}.{content_type.model}")
+
+
+_content_types_loaded = False
+
+
+def get_content_type(app_model):
+    """
+    Return the ContentType for an `"app_label.model"` string.
+
+    It comes from the ContentType cache, which is loaded with the content
+    types of all the installed models the first time. Raises ValueError if
+    the string is not in that format, and ContentType.DoesNotExist if there
+    is no such content type.
+    """
+    global _content_types_loaded  # noqa: PLW0603
+    app_label, model = app_model.split(".")
+    if not _content_types_loaded:
+        ContentType.objects.get_for_models(*apps.get_models())
+        _content_types_loaded = True
+    return ContentType.objects.get_by_natural_key(app_label, model)
+
+
+def iter_thread_batches(queryset, threads_per_batch=500):
+    """
+    Yield querysets with the comments of consecutive batches of threads.
+
+    Each batch is read by a separate query once the previous one has been
+    processed, so the comments of a batch can be updated in between.
+    """
+    last_thread_id = -1
+    while True:
+        thread_ids = list(
+            queryset.filter(thread_id__gt=last_thread_id)
+            .order_by("thread_id")
+            .values_list("thread_id", flat=True)
+            .distinct()[:threads_per_batch]
+        )
+        if not thread_ids:
+            return
+        last_thread_id = thread_ids[-1]
+        yield queryset.filter(
+            thread_id__gte=thread_ids[0], thread_id__lte=last_thread_id
+        )
+        if len(thread_ids) < threads_per_batch:
+            return
 
-    try:
-        model_app_opts = dict(init_opts["default"])
-        model_app_opts.update(custom_opts[key])
-        return model_app_opts
-    except Exception:
-        return init_opts["default"]
 
 def get_current_site_id(request=None):
     """it's a shortcut"""
@@ -110,6 +452,48 @@ def get_html_id_suffix(obj):
     return suffix
 
 
+def get_email_hash(email):
+    """Return a short keyed hash of an email address."""
+    value = email.lower()
+    return salted_hmac(MUTE_KEY_SALT, value).hexdigest()[:16]
+
+
+def _get_mute_key_salt():
+    return MUTE_KEY_SALT + force_str(
+        settings.COMMENTS_XTD_SALT, errors="replace"
+    )
+
+
+def get_mute_key(content_type_id, object_pk, email, comment_id=None):
+    """
+    Return the key of the URL to mute the followup notifications of the
+    comments posted to an object, sent to the given email address. The
+    comment_id is the id of a comment posted with that email address, to
+    find it with an indexed lookup.
+    """
+    payload = [content_type_id, str(object_pk), get_email_hash(email)]
+    if comment_id is not None:
+        payload.append(comment_id)
+    return signing.dumps(payload, salt=_get_mute_key_salt())
+
+
+def load_mute_key(key):
+    """
+    Return the tuple (content_type_id, object_pk, email_hash, comment_id)
+    of a key created with `get_mute_key`. The comment_id is None when the
+    key doesn't have it. Raises `signing.BadSignature` if the key is not
+    valid.
+    """
+    payload = signing.loads(key, salt=_get_mute_key_salt())
+    try:
+        content_type_id, object_pk, email_hash, *comment_id = payload
+    except (TypeError, ValueError) as exc:
+        raise signing.BadSignature("Malformed mute key.") from exc
+    if len(comment_id) > 1:
+        raise signing.BadSignature("Malformed mute key.")
+    return content_type_id, object_pk, email_hash, next(iter(comment_id), None)
+
+
 def get_user_avatar(comment):
     path = hashlib.md5(comment.user_email.lower().encode("utf-8")).hexdigest()
     param = urlencode({"s": 48})
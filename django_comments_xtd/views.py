@@ -29,8 +29,14 @@ from django_comments_xtd.models import (
     TmpXtdComment,
 )
 from django_comments_xtd.utils import (
+    RecipientMessageRenderer,
     get_app_model_options,
+    get_content_type,
     get_current_site_id,
+    get_email_hash,
+    get_mute_key,
+    load_mute_key,
+    queue_mails,
     send_mail,
 )
 
@@ -160,8 +166,8 @@ def on_comment_was_posted(sender, comment, request, **kwargs):
             if comment.is_public:
                 notify_comment_followers(new_comment)
     else:
-        key = signed.dumps(
-            comment, compress=True, extra_key=settings.COMMENTS_XTD_SALT
+        key = signed.dumps_comment(
+            comment, extra_key=settings.COMMENTS_XTD_SALT
         )
         site = get_current_site(request)
         send_email_confirmation_request(comment, key, site)
@@ -258,18 +264,21 @@ def notify_comment_followers(comment):
         "is_public": True,
         "followup": True,
     }
-    previous_comments = XtdComment.objects.filter(**kwargs).exclude(
-        user_email=comment.user_email
+    previous_comments = (
+        XtdComment.objects.filter(**kwargs)
+        .exclude(user_email=comment.user_email)
+        .values_list("user_email", "user_name", "pk")
     )
 
     def feed_followers(gen):
-        for instance in gen:
-            followers[instance.user_email] = (
-                instance.user_name,
-                signed.dumps(
-                    instance,
-                    compress=True,
-                    extra_key=settings.COMMENTS_XTD_SALT,
+        for user_email, user_name, pk in gen:
+            followers[user_email] = (
+                user_name,
+                get_mute_key(
+                    comment.content_type_id,
+                    comment.object_pk,
+                    user_email,
+                    comment_id=pk,
                 ),
             )
 
@@ -280,36 +289,54 @@ def notify_comment_followers(comment):
         feed_followers(previous_comments)
 
     subject = _("new comment posted")
-    text_message_template = loader.get_template(
-        "django_comments_xtd/email_followup_comment.txt"
-    )
-    html_message_template = loader.get_template(
-        "django_comments_xtd/email_followup_comment.html"
-    )
-
-    for email, (name, key) in followers.items():
-        mute_url = reverse("comments-xtd-mute", args=[key.decode("utf-8")])
-        message_context = {
-            "user_name": name,
+    templates = [
+        loader.get_template("django_comments_xtd/email_followup_comment.txt")
+    ]
+    if settings.COMMENTS_XTD_SEND_HTML_EMAIL:
+        templates.append(
+            loader.get_template(
+                "django_comments_xtd/email_followup_comment.html"
+            )
+        )
+    # Only the user_name and the mute URLs change between recipients.
+    renderer = RecipientMessageRenderer(
+        templates,
+        {
             "comment": comment,
             "content_object": comment.content_object,
-            "mute_url": mute_url,
             "site": comment.site,
-        }
-        text_message = text_message_template.render(message_context)
-        if settings.COMMENTS_XTD_SEND_HTML_EMAIL:
-            html_message = html_message_template.render(message_context)
-        else:
-            html_message = None
-        send_mail(
-            subject,
-            text_message,
-            settings.COMMENTS_XTD_FROM_EMAIL,
-            [
-                email,
-            ],
-            html=html_message,
+        },
+        ["user_name", "mute_url", "mute_url_short"],
+    )
+
+    mails = []
+    for email, (name, key) in followers.items():
+        mute_url = reverse("comments-xtd-mute", args=[key])
+        messages = renderer.render(
+            {
+                "user_name": name,
+                "mute_url": mute_url,
+                "mute_url_short": mute_url[:40],
+            }
         )
+        text_message = messages[0]
+        html_message = messages[1] if len(messages) > 1 else None
+        mails.append(
+            (
+                subject,
+                text_message,
+                settings.COMMENTS_XTD_FROM_EMAIL,
+                [email],
+                html_message,
+            )
+        )
+
+    if settings.COMMENTS_XTD_OUTBOX:
+        # Queue the notifications to all the followers in one query.
+        queue_mails(mails)
+        return
+    for subject, text_message, from_email, recipient_list, html in mails:
+        send_mail(subject, text_message, from_email, recipient_list, html=html)
 
 
 def reply(request, cid):
@@ -344,17 +371,64 @@ def reply(request, cid):
     )
 
 
-def mute(request, key):
-    try:
-        tmp_comment = signed.loads(
-            str(key), extra_key=settings.COMMENTS_XTD_SALT
-        )
-    except (ValueError, signed.BadSignature) as exc:
-        return bad_request(request, exc)
-
+def _load_legacy_mute_key(key):
+    """
+    Return the comment of a mute key created by former versions, that
+    contained the whole pickled comment, or None if it doesn't exist.
+    """
+    tmp_comment = signed.loads(str(key), extra_key=settings.COMMENTS_XTD_SALT)
     # Can't mute a comment that doesn't have the followup attribute
     # set to True, or a comment that doesn't exist.
     if not tmp_comment.followup or _get_comment_if_exists(tmp_comment) is None:
+        return None
+    return tmp_comment
+
+
+def _get_muting_comment(key):
+    """
+    Return a TmpXtdComment with the content_type, object_pk and user_email
+    of a mute key, or None if no comment matches it.
+    """
+    content_type_id, object_pk, email_hash, comment_id = load_mute_key(key)
+    try:
+        content_type = ContentType.objects.get_for_id(content_type_id)
+    except ContentType.DoesNotExist:
+        return None
+    # Only the comments with followup notifications can be muted.
+    qs = XtdComment.norel_objects.filter(
+        content_type=content_type,
+        object_pk=object_pk,
+        is_public=True,
+        followup=True,
+    )
+    emails = []
+    if comment_id is not None:
+        emails = qs.filter(pk=comment_id).values_list("user_email", flat=True)
+    if not emails:
+        # The comment of the key has been deleted or muted already, or the
+        # key has no comment id.
+        emails = qs.values_list("user_email", flat=True).distinct()
+    for user_email in emails:
+        if get_email_hash(user_email) == email_hash:
+            return TmpXtdComment(
+                content_type=content_type,
+                object_pk=object_pk,
+                user_email=user_email,
+                followup=True,
+            )
+    return None
+
+
+def mute(request, key):
+    try:
+        tmp_comment = _get_muting_comment(key)
+    except signing.BadSignature:
+        try:
+            tmp_comment = _load_legacy_mute_key(key)
+        except (ValueError, signed.BadSignature) as exc:
+            return bad_request(request, exc)
+
+    if tmp_comment is None:
         raise Http404
 
     # Send signal that the comment thread has been muted
@@ -365,7 +439,7 @@ def mute(request, key):
     XtdComment.norel_objects.filter(
         content_type=tmp_comment.content_type,
         object_pk=tmp_comment.object_pk,
-        user_email=tmp_comment.user_email,
+        user_email__iexact=tmp_comment.user_email,
         is_public=True,
         followup=True,
     ).update(followup=False)
@@ -567,13 +641,7 @@ class XtdCommentListView(ListView):
     def get_content_types(self):
         if self.content_types is None:
             return None
-        content_types = []
-        for entry in self.content_types:
-            app, model = entry.split(".")
-            content_types.append(
-                ContentType.objects.get(app_label=app, model=model)
-            )
-        return content_types
+        return [get_content_type(entry) for entry in self.content_types]
 
     def get_queryset(self):
         content_types = self.get_content_types()